@@ -4,6 +4,8 @@ Globally shared app references, namely the dash app, the flask server,
 and the database.
 """
 
+import os
+
 import dash.dependencies
 import dash_bootstrap_components as dbc
 import flask_caching
@@ -18,10 +20,62 @@ app = dash.Dash(
     suppress_callback_exceptions=True,
 )
 server = app.server
-server.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:////data/far_app_data.db"
+# Overridable to run against a scratch database, e.g. of benchmarks.synthetic
+server.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "FAR_DATABASE_URI", "sqlite:////data/far_app_data.db"
+)
+# Pragmas of every SQLite connection, see far_core.engine
+server.config["FAR_SQLITE_PROFILE"] = os.environ.get("FAR_SQLITE_PROFILE", "tuned")
+server.config["FAR_SQLITE_PRAGMAS"] = os.environ.get("FAR_SQLITE_PRAGMAS", "")
+server.config["FAR_READ_POOL_SIZE"] = int(os.environ.get("FAR_READ_POOL_SIZE", 5))
+# Backend of the monthly totals of reports, see far_core.analytics
+server.config["FAR_ANALYTICS_BACKEND"] = os.environ.get(
+    "FAR_ANALYTICS_BACKEND", "sqlite"
+)
+# Closed years kept in the hot tables besides the current one, 0 to never
+# archive, see far_core.archive
+server.config["FAR_ARCHIVE_KEEP_YEARS"] = int(
+    os.environ.get("FAR_ARCHIVE_KEEP_YEARS", 0)
+)
+# Age after which the main page's totals check for writes of other worker
+# processes, see far_core.current_month
+server.config["FAR_CURRENT_MONTH_CHECK_SECONDS"] = float(
+    os.environ.get("FAR_CURRENT_MONTH_CHECK_SECONDS", 5)
+)
+# Interval of the pages' checks for changes of the ledger, 0 to only update
+# pages on reload, see far_core.version
+server.config["FAR_LIVE_REFRESH_SECONDS"] = float(
+    os.environ.get("FAR_LIVE_REFRESH_SECONDS", 2)
+)
+# First month of fiscal years, 1 to 12, see far_core.calendar
+server.config["FAR_FISCAL_YEAR_START_MONTH"] = int(
+    os.environ.get("FAR_FISCAL_YEAR_START_MONTH", 1)
+)
+# Background jobs, see far_core.jobs
+server.config["FAR_JOB_QUEUE_PATH"] = os.environ.get(
+    "FAR_JOB_QUEUE_PATH", "/tmp/far_app_jobs.db"
+)
+server.config["FAR_JOB_WORKERS"] = int(os.environ.get("FAR_JOB_WORKERS", 2))
+# Profiling of callbacks, see far_core.profiling
+server.config["FAR_PROFILE"] = bool(os.environ.get("FAR_PROFILE"))
+server.config["FAR_PROFILE_DIR"] = os.environ.get(
+    "FAR_PROFILE_DIR", "/tmp/far_app_profiles"
+)
+# Detection of repeated queries in development, see far_core.querywatch
+server.config["FAR_DEV_MODE"] = bool(os.environ.get("FAR_DEV_MODE"))
+server.config["FAR_QUERY_REPEAT_THRESHOLD"] = int(
+    os.environ.get("FAR_QUERY_REPEAT_THRESHOLD", 10)
+)
+server.config["FAR_QUERY_REPEAT_RAISE"] = bool(os.environ.get("FAR_QUERY_REPEAT_RAISE"))
+# Rows of each of the expense and income grids of the input page
+server.config["FAR_INPUT_ROWS"] = int(os.environ.get("FAR_INPUT_ROWS", 12))
 db = flask_sqlalchemy.SQLAlchemy(server)
 cache = flask_caching.Cache()
+# The default SQLite cache is shared by every worker process of the server
 cache.init_app(
     server,
-    config={"CACHE_TYPE": "filesystem", "CACHE_DIR": "/tmp/far_app_cache"},
+    config={
+        "CACHE_TYPE": os.environ.get("FAR_CACHE_TYPE", "far_core.cache.SQLiteCache"),
+        "CACHE_DIR": os.environ.get("FAR_CACHE_DIR", "/tmp/far_app_cache"),
+    },
 )
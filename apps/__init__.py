@@ -1,14 +1,45 @@
 #!/usr/bin/python3
 
 import datetime
+import functools
+import importlib
+import types
 
+import dash
+from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
-import pandas as pd
-import sqlalchemy
+import dash_core_components as dcc
 
-from app import cache
+from app import app, cache, server
+import far_core.analytics
+import far_core.archive
+import far_core.calendar
 import far_core.db
+import far_core.jobs
+import far_core.snapshot
+import far_core.version
+import far_core.writer
 
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module which is only imported on its first attribute
+    access, so that the heavy dependencies of a page, e.g. pandas or
+    statsmodels, are loaded when the page is first used rather than at startup.
+    """
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        # Later lookups find the module's attributes without reaching here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(module_name: str) -> types.ModuleType:
+    return LazyModule(module_name)
+
+
+pd = lazy_import("pandas")
 NAVBAR = dbc.NavbarSimple(
     children=[
         dbc.NavItem(dbc.NavLink("Main", href="/")),
@@ -21,6 +52,9 @@ NAVBAR = dbc.NavbarSimple(
                 dbc.DropdownMenuItem("Monthly Review", href="/report/monthly"),
                 dbc.DropdownMenuItem("Annual Review", href="/report/annual"),
                 dbc.DropdownMenuItem("Forecast", href="/report/forecast"),
+                dbc.DropdownMenuItem(
+                    "Cashflow Projection", href="/report/projection"
+                ),
             ],
             nav=True,
             in_navbar=True,
@@ -33,39 +67,70 @@ NAVBAR = dbc.NavbarSimple(
 )
 
 
-@cache.memoize(timeout=5)
-def get_all_expense_records():
-    return far_core.db.ExpenseRecord.query.all()
+@far_core.writer.on_commit
+def _clear_cache():
+    # Every memoized result is read from the ledger, so pages re-running on a
+    # new ledger version must not be served results from before it
+    with server.app_context():
+        cache.clear()
+
+
+def memoize_by_version(func):
+    """
+    Decorator memoizing func for 5 seconds, keyed by the version of the
+    ledger as well as its arguments, so that a result read from a snapshot
+    from before a commit, and cached after _clear_cache() ran, is not served
+    for later versions.
+
+    :param func: function taking a version argument, only there to key its
+        results, which callers may pass, e.g. the version a response is
+        tagged with, and which is otherwise that of the current snapshot
+    """
+    memoized = cache.memoize(timeout=5)(func)
+
+    @functools.wraps(func)
+    def get(*args, version: int = None, **kwargs):
+        if version is None:
+            version = far_core.version.get_ledger_version()
+        return memoized(*args, version=version, **kwargs)
 
+    return get
 
-@cache.memoize(timeout=5)
+
+@memoize_by_version
+def get_all_expense_records(version: int = None):
+    with far_core.snapshot.snapshot() as session:
+        return session.query(
+            far_core.archive.get_entity(session, far_core.db.ExpenseRecord)
+        ).all()
+
+
+@memoize_by_version
 def get_filtered_expense_records(
     *_args,
     category: far_core.ExpenseCategory = None,
     end_date: datetime.date = None,
     reduced_category: far_core.ReducedCategory = None,
     start_date: datetime.date = None,
+    version: int = None,
 ):
     if _args:
         raise NotImplementedError("get_filtered_expense_records() only takes kwargs")
     del _args
-    q = far_core.db.ExpenseRecord.query
-    if category:
-        q = q.filter_by(category=category)
-    if end_date:
-        q = q.filter(far_core.db.ExpenseRecord.date < end_date)
-    if reduced_category:
-        q = q.filter(
-            sqlalchemy.or_(
-                far_core.db.ExpenseRecord.category == cat
-                for cat in far_core.EXPENSE_CATEGORY_BY_REDUCED_CATEGORY[
-                    reduced_category
-                ]
-            )
+    with far_core.snapshot.snapshot() as session:
+        record = far_core.archive.get_entity(
+            session, far_core.db.ExpenseRecord, start_date
         )
-    if start_date:
-        q = q.filter(far_core.db.ExpenseRecord.date >= start_date)
-    return q.all()
+        q = session.query(record)
+        if category:
+            q = q.filter_by(category=category)
+        if end_date:
+            q = q.filter(record.date < end_date)
+        if reduced_category:
+            q = q.filter(record.reduced_category == reduced_category)
+        if start_date:
+            q = q.filter(record.date >= start_date)
+        return q.all()
 
 
 def dataframe_from_expense_records(expense_record_list: list):
@@ -75,29 +140,37 @@ def dataframe_from_expense_records(expense_record_list: list):
     )
 
 
-@cache.memoize(timeout=5)
-def get_all_income_records():
-    return far_core.db.IncomeRecord.query.all()
+@memoize_by_version
+def get_all_income_records(version: int = None):
+    with far_core.snapshot.snapshot() as session:
+        return session.query(
+            far_core.archive.get_entity(session, far_core.db.IncomeRecord)
+        ).all()
 
 
-@cache.memoize(timeout=5)
+@memoize_by_version
 def get_filtered_income_records(
     *_args,
     category: far_core.IncomeCategory = None,
     end_date: datetime.date = None,
     start_date: datetime.date = None,
+    version: int = None,
 ):
     if _args:
         raise NotImplementedError("get_filtered_income_records() only takes kwargs")
     del _args
-    q = far_core.db.IncomeRecord.query
-    if category:
-        q = q.filter_by(category=category)
-    if end_date:
-        q = q.filter(far_core.db.IncomeRecord.date < end_date)
-    if start_date:
-        q = q.filter(far_core.db.IncomeRecord.date >= start_date)
-    return q.all()
+    with far_core.snapshot.snapshot() as session:
+        record = far_core.archive.get_entity(
+            session, far_core.db.IncomeRecord, start_date
+        )
+        q = session.query(record)
+        if category:
+            q = q.filter_by(category=category)
+        if end_date:
+            q = q.filter(record.date < end_date)
+        if start_date:
+            q = q.filter(record.date >= start_date)
+        return q.all()
 
 
 def dataframe_from_income_records(income_record_list: list):
@@ -105,3 +178,147 @@ def dataframe_from_income_records(income_record_list: list):
         data=(inc_rec.pandas_record for inc_rec in income_record_list),
         columns=("id", "Date", "Amount", "Category", "Account", "Note"),
     )
+
+
+# Columns of get_monthly_totals(), by what the totals are split
+_TOTALS_KEYS = {
+    "account": lambda record_type: list(far_core.Accounts),
+    "category": lambda record_type: list(
+        far_core.ExpenseCategory
+        if record_type == "expense"
+        else far_core.IncomeCategory
+    ),
+    "reduced_category": lambda record_type: list(far_core.ReducedCategory),
+}
+
+
+@memoize_by_version
+def get_monthly_totals(
+    record_type: str,
+    months: range,
+    by: str = None,
+    categories: list = None,
+    version: int = None,
+):
+    """
+    :param str record_type: "expense" or "income"
+    :param range months: month keys of consecutive months, see
+        far_core.calendar, e.g. the result of apps.report.get_months()
+    :param str by: "account", "category" or "reduced_category" to split the
+        totals of each month by, or None for an "amount" column of totals
+    :param list categories: categories to total, or None for every category
+    :param int version: see memoize_by_version()
+    :return: pd.DataFrame of the total amounts indexed by the first day of
+        each month, with a column for every account, category or reduced
+        category, in enumeration order, zero where there are no records
+    """
+    totals = far_core.analytics.get_monthly_totals(
+        record_type, months[0], months[-1] + 1, categories
+    )
+    month_starts = list(far_core.calendar.get_month_starts(months[0], len(months)))
+    if by is None:
+        df = (
+            totals.groupby("month")["amount"]
+            .sum()
+            .reindex(months, fill_value=0.0)
+            .to_frame("amount")
+        )
+    else:
+        if by == "reduced_category":
+            totals["reduced_category"] = totals["category"].map(
+                far_core.REDUCED_CATEGORY_BY_EXPENSE_CATEGORY
+            )
+        df = (
+            totals.groupby(["month", by])["amount"]
+            .sum()
+            .unstack(by)
+            .reindex(index=months, columns=_TOTALS_KEYS[by](record_type))
+            .fillna(0.0)
+            .rename_axis(columns=None)
+        )
+    df.index = month_starts
+    return df
+
+
+def get_background_components(name: str) -> list:
+    """
+    :param str name: name of the background callback, see background_callback()
+    :return: the components a layout needs to run the background callback,
+        namely the job id store, the polling interval, a progress bar and an
+        alert showing why the job failed
+    """
+    return [
+        dcc.Store(id=f"{name}_job"),
+        dcc.Interval(id=f"{name}_job_interval", interval=500, disabled=True),
+        dbc.Progress(id=f"{name}_job_progress", value=0, striped=True, animated=True),
+        dbc.Alert(id=f"{name}_job_error", color="danger", is_open=False),
+    ]
+
+
+def background_callback(name: str, outputs: list, inputs: list):
+    """
+    Decorator which runs a callback as a far_core.jobs background job.
+    Every change of the inputs queues a new job, cancelling the job queued
+    for the previous inputs, and the outputs are filled in by polling the
+    job until it is done.
+    The layout must include get_background_components(name).
+
+    :param str name: unique name of the background callback
+    :param list outputs: list of dash.dependencies.Output
+    :param list inputs: list of dash.dependencies.Input
+    """
+
+    def decorator(func):
+        far_core.jobs.job_function(func)
+
+        @app.callback(
+            Output(f"{name}_job", "data"),
+            inputs,
+            [State(f"{name}_job", "data")],
+        )
+        def submit_job(*args):
+            *args, previous_job_id = args
+            return far_core.jobs.submit(func, *args, supersedes=previous_job_id)
+
+        @app.callback(
+            outputs
+            + [
+                Output(f"{name}_job_interval", "disabled"),
+                Output(f"{name}_job_progress", "value"),
+                Output(f"{name}_job_progress", "color"),
+                Output(f"{name}_job_error", "children"),
+                Output(f"{name}_job_error", "is_open"),
+            ],
+            [
+                Input(f"{name}_job", "data"),
+                Input(f"{name}_job_interval", "n_intervals"),
+            ],
+        )
+        def poll_job(job_id, _n_intervals):
+            no_updates = [dash.no_update] * len(outputs)
+            # Progress bar colour, error message and whether it is shown
+            no_error = [None, None, False]
+            job = far_core.jobs.get_job(job_id) if job_id else None
+            if job is None:
+                return no_updates + [True, 0] + no_error
+            if job["status"] in (
+                far_core.jobs.JobStatus.queued,
+                far_core.jobs.JobStatus.running,
+            ):
+                return no_updates + [False, job["progress"] * 100] + no_error
+            if job["status"] is far_core.jobs.JobStatus.done:
+                return list(job["result"]) + [True, 100] + no_error
+            if job["status"] is far_core.jobs.JobStatus.failed:
+                # The outputs still show the previous inputs, so say so
+                return no_updates + [
+                    True,
+                    100,
+                    "danger",
+                    f"Could not update, showing previous results: {job['error']}",
+                    True,
+                ]
+            return no_updates + [True, 0] + no_error
+
+        return func
+
+    return decorator
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Read-only JSON API of the monthly totals of the reports, e.g.
+    /api/totals/expenses?by=category&start=2021-01&end=2022-01
+with by one of "account", "category" or "reduced_category" (expenses only),
+or omitted for the total of each month, start inclusive and end exclusive,
+defaulting to the API_DEFAULT_MONTHS months up to the current one, and
+optionally categories, a comma separated list of category names.
+
+Totals are those of the pages, from the memoized apps.get_monthly_totals()
+at the ledger version of the response, keyed by the names of the accounts
+and categories as in the exports of far_core.export. Responses carry the
+ledger version as their ETag and the time of its latest change as their
+Last-Modified, which are checked before anything is totalled, so that
+revalidating an unchanged response costs one query of the ledger version.
+"""
+
+import flask
+import werkzeug.http
+
+from app import server
+import apps
+import far_core
+import far_core.calendar
+import far_core.version
+
+
+# Months totalled when no start is given, and at most per request
+API_DEFAULT_MONTHS = 12
+API_MAX_MONTHS = 120
+
+_RECORD_TYPES = {"expenses": "expense", "incomes": "income"}
+_CATEGORIES = {"expense": far_core.ExpenseCategory, "income": far_core.IncomeCategory}
+
+
+def _get_month_arg(name: str):
+    """:return: month key of the month of the query argument name, or None"""
+    month_str = flask.request.args.get(name)
+    if not month_str:
+        return None
+    try:
+        return far_core.calendar.month_key(far_core.month_from_string(month_str))
+    except ValueError as e:
+        flask.abort(400, description=f"Invalid {name} month: {e}")
+
+
+def _get_categories_arg(record_type: str):
+    """:return: list of the categories of the query, or None for all of them"""
+    categories_str = flask.request.args.get("categories")
+    if not categories_str:
+        return None
+    category_type = _CATEGORIES[record_type]
+    try:
+        return [category_type[name] for name in categories_str.split(",")]
+    except KeyError as e:
+        flask.abort(400, description=f"Unknown {record_type} category: {e}")
+
+
+@server.route("/api/totals/<record_type>")
+def api_totals(record_type: str):
+    record_type = _RECORD_TYPES.get(record_type)
+    if record_type is None:
+        flask.abort(404)
+    by = flask.request.args.get("by") or None
+    if by not in (None, "account", "category", "reduced_category") or (
+        by == "reduced_category" and record_type != "expense"
+    ):
+        flask.abort(400, description=f"Cannot total {record_type}s by {by}")
+    categories = _get_categories_arg(record_type)
+    end_month = _get_month_arg("end") or far_core.calendar.get_current_month_key() + 1
+    first_month = _get_month_arg("start") or end_month - API_DEFAULT_MONTHS
+    if not 0 < end_month - first_month <= API_MAX_MONTHS:
+        flask.abort(
+            400, description=f"Expected from 1 to {API_MAX_MONTHS} months from start"
+        )
+    months = range(first_month, end_month)
+
+    version, last_modified = far_core.version.get_ledger_state()
+    # The months are part of the tag, as those of a same URL move on with the
+    # current month when start or end is omitted
+    response = far_core.version.set_validators(
+        flask.Response(mimetype="application/json"),
+        version,
+        last_modified,
+        tag=f"{first_month}-{end_month}",
+    )
+    if not werkzeug.http.is_resource_modified(
+        flask.request.environ,
+        etag=response.get_etag()[0],
+        last_modified=last_modified,
+    ):
+        return response.make_conditional(flask.request)
+
+    # Read at the version of the ETag, rather than cached from an earlier one
+    totals = apps.get_monthly_totals(
+        record_type, months, by=by, categories=categories, version=version
+    )
+    month_strs = [month_start.strftime("%Y-%m") for month_start in totals.index]
+    response.set_data(
+        flask.json.dumps(
+            {
+                "record_type": record_type,
+                "by": by,
+                "version": version,
+                "months": month_strs,
+                "totals": {
+                    getattr(column, "name", column): totals[column].tolist()
+                    for column in totals.columns
+                },
+            }
+        )
+    )
+    return response.make_conditional(flask.request)
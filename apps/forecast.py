@@ -4,79 +4,110 @@ from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-import pandas as pd
-import plotly.express as px
-import statsmodels.tsa.api
 
-from app import app
 import apps
 import far_core
+import far_core.calendar
+import far_core.jobs
 
+np = apps.lazy_import("numpy")
+pd = apps.lazy_import("pandas")
+px = apps.lazy_import("plotly.express")
+go = apps.lazy_import("plotly.graph_objects")
+statsmodels_tsa = apps.lazy_import("statsmodels.tsa.api")
 
-LAYOUT = html.Div(
-    [
-        apps.NAVBAR,
-        dbc.Row(
-            dbc.Col(
-                children=[
-                    html.Div(
-                        children=[
-                            html.Label(
-                                children="Choose month to end forecast on:",
-                                className="col-form-label",
-                                htmlFor="report_date_picker_forecast",
-                            ),
-                            dcc.Input(
-                                id="report_date_picker_forecast",
-                                className="form-control",
-                                debounce=True,
-                                type="text",
-                                value=far_core.get_current_month().strftime("%Y-%m"),
-                                placeholder='Month to end forecast on, e.g. "2000-01"',
-                                pattern=r"\d{4}-([1-9]|1[0-2]|0[1-9])",
-                            ),
-                            html.Label(
-                                children="Category for forecast:",
-                                className="col-form-label",
-                                htmlFor="report_category_picker_forecast",
-                            ),
-                            dcc.Dropdown(
-                                id="report_category_picker_forecast",
-                                options=[
-                                    {"label": str(cat), "value": str(cat)}
-                                    for cat in far_core.ExpenseCategory
-                                ],
-                                placeholder="Category",
-                            ),
-                            html.Label(
-                                children="Seasonality",
-                                className="col-form-label",
-                                htmlFor="report_seasonality_forecast",
-                            ),
-                            dcc.Input(
-                                id="report_seasonality_forecast",
-                                value=2,
-                                type="number",
-                                className="form-control",
-                                disabled=True,
-                            ),
-                        ],
-                        className="form-group",
-                    ),
-                    html.Hr(),
-                    dcc.Graph(id="categorical_forecast_graph"),
-                    html.Hr(),
-                ],
-                width=8,
-                align="center",
+
+# Longest forecast horizon, in months, the page allows
+MAX_FORECAST_HORIZON = 24
+# Simulated paths drawn from the fitted model for the prediction interval
+NUMBER_OF_SIMULATIONS = 1000
+# Lower and upper percentiles of the prediction interval
+PREDICTION_INTERVAL = (5, 95)
+
+
+def get_layout():
+    return html.Div(
+        [
+            apps.NAVBAR,
+            dbc.Row(
+                dbc.Col(
+                    children=[
+                        html.Div(
+                            children=[
+                                html.Label(
+                                    children="Choose month to end forecast on:",
+                                    className="col-form-label",
+                                    htmlFor="report_date_picker_forecast",
+                                ),
+                                dcc.Input(
+                                    id="report_date_picker_forecast",
+                                    className="form-control",
+                                    debounce=True,
+                                    type="text",
+                                    value=far_core.get_current_month().strftime(
+                                        "%Y-%m"
+                                    ),
+                                    placeholder='Month to end forecast on, e.g. "2000-01"',
+                                    pattern=r"\d{4}-([1-9]|1[0-2]|0[1-9])",
+                                ),
+                                html.Label(
+                                    children="Category for forecast:",
+                                    className="col-form-label",
+                                    htmlFor="report_category_picker_forecast",
+                                ),
+                                dcc.Dropdown(
+                                    id="report_category_picker_forecast",
+                                    options=[
+                                        {"label": str(cat), "value": str(cat)}
+                                        for cat in far_core.ExpenseCategory
+                                    ],
+                                    placeholder="Category",
+                                ),
+                                html.Label(
+                                    children="Months to forecast:",
+                                    className="col-form-label",
+                                    htmlFor="report_horizon_forecast",
+                                ),
+                                dcc.Input(
+                                    id="report_horizon_forecast",
+                                    className="form-control",
+                                    debounce=True,
+                                    type="number",
+                                    value=3,
+                                    min=1,
+                                    max=MAX_FORECAST_HORIZON,
+                                    step=1,
+                                ),
+                                html.Label(
+                                    children="Seasonality",
+                                    className="col-form-label",
+                                    htmlFor="report_seasonality_forecast",
+                                ),
+                                dcc.Input(
+                                    id="report_seasonality_forecast",
+                                    value=2,
+                                    type="number",
+                                    className="form-control",
+                                    disabled=True,
+                                ),
+                            ],
+                            className="form-group",
+                        ),
+                        html.Hr(),
+                        *apps.get_background_components("categorical_forecast"),
+                        dcc.Graph(id="categorical_forecast_graph"),
+                        html.Hr(),
+                    ],
+                    width=8,
+                    align="center",
+                ),
+                justify="center",
             ),
-            justify="center",
-        ),
-    ]
-)
+        ]
+    )
 
 
-def r_squared(actual: pd.Series, fitted: list) -> float:
+def r_squared(actual: "pd.Series", fitted: list) -> float:
     if actual.empty:
         return 0.0
     actual_sum = sum(actual)
@@ -93,13 +124,14 @@ def r_squared(actual: pd.Series, fitted: list) -> float:
     return 1 - (sse / ssyy)
 
 
-def find_best_seasonality_fit(actual: pd.Series) -> int:
+def find_best_seasonality_fit(actual: "pd.Series") -> int:
     """Find the best seasonality between 2 months and 12 months."""
     best_r2 = 0.0
     best_seasonality = 2
     for seasonality in range(2, 13):
+        far_core.jobs.set_progress(0.5 + seasonality / 26)
         fitted = (
-            statsmodels.tsa.api.ExponentialSmoothing(
+            statsmodels_tsa.ExponentialSmoothing(
                 actual,
                 seasonal_periods=seasonality,
                 trend="add",
@@ -116,17 +148,45 @@ def find_best_seasonality_fit(actual: pd.Series) -> int:
     return best_seasonality
 
 
-@app.callback(
-    [
+def get_prediction_interval(fit, horizon: int) -> tuple:
+    """
+    Simulates NUMBER_OF_SIMULATIONS future paths from the fitted model with
+    bootstrapped residuals, drawing every step of every path in one batch.
+
+    :param fit: fitted statsmodels HoltWintersResults
+    :param int horizon: months to simulate past the end of the fitted series
+    :return: tuple of np.ndarray (lower bound, upper bound), one per month
+    """
+    simulations = fit.simulate(
+        nsimulations=horizon,
+        repetitions=NUMBER_OF_SIMULATIONS,
+        anchor="end",
+        random_errors="bootstrap",
+    )
+    lower, upper = np.percentile(
+        np.asarray(simulations).reshape(horizon, NUMBER_OF_SIMULATIONS),
+        PREDICTION_INTERVAL,
+        axis=1,
+    )
+    return lower, upper
+
+
+@apps.background_callback(
+    "categorical_forecast",
+    outputs=[
         Output("categorical_forecast_graph", "figure"),
         Output("report_seasonality_forecast", "value"),
     ],
-    [
+    inputs=[
         Input("report_date_picker_forecast", "value"),
         Input("report_category_picker_forecast", "value"),
+        Input("report_horizon_forecast", "value"),
+        Input("ledger_version", "data"),
     ],
 )
-def categorical_forecast_graph(date_str: str, category_str: str):
+def categorical_forecast_graph(
+    date_str: str, category_str: str, horizon: int, _version=None
+):
     end_date = far_core.get_date_from_date_str(date_str)
     if not end_date:
         return {"data": []}, 2
@@ -134,26 +194,13 @@ def categorical_forecast_graph(date_str: str, category_str: str):
         category = far_core.ExpenseCategory(category_str)
     except ValueError:
         return {"data": []}, 2
-    data = []
-    months = []
-    for month_delta in range(-(12 * 2) - 1, 0):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        months.append(month_slice_start)
-        data.append(
-            float(
-                far_core.sum_all_records(
-                    apps.get_filtered_expense_records(
-                        category=category,
-                        end_date=month_slice_end,
-                        start_date=month_slice_start,
-                    )
-                )
-            )
-        )
-    series = pd.Series(data, index=months)
+    if not horizon or not 1 <= horizon <= MAX_FORECAST_HORIZON:
+        return {"data": []}, 2
+    end_month = far_core.calendar.month_key(end_date)
+    months = range(end_month - (12 * 2) - 1, end_month)
+    series = apps.get_monthly_totals("expense", months, categories=[category])["amount"]
     best_seasonality = find_best_seasonality_fit(series)
-    fit = statsmodels.tsa.api.ExponentialSmoothing(
+    fit = statsmodels_tsa.ExponentialSmoothing(
         series,
         seasonal_periods=best_seasonality,
         trend="add",
@@ -161,22 +208,40 @@ def categorical_forecast_graph(date_str: str, category_str: str):
         initialization_method="estimated",
     ).fit()
     fitted_vals = fit.fittedvalues
-    forecast = fit.forecast(3)
+    forecast = fit.forecast(horizon)
+    lower, upper = get_prediction_interval(fit, horizon)
     df = pd.concat([series, fitted_vals, forecast], axis=1)
     df.columns = ["Actual", "Fitted", "Forecast"]
     df["Fitted"] = df["Fitted"].clip(lower=0.0)
     df["Forecast"] = df["Forecast"].clip(lower=0.0)
-    return (
-        px.line(
-            df,
-            x=df.index,
-            y=df.columns,
-            title=f"Forecast for {str(category)}",
-            labels={
-                "index": "Month",
-                "value": "Spending (USD)",
-                "variable": "",
-            },
-        ),
-        best_seasonality,
+    fig = px.line(
+        df,
+        x=df.index,
+        y=df.columns,
+        title=f"Forecast for {str(category)}",
+        labels={
+            "index": "Month",
+            "value": "Spending (USD)",
+            "variable": "",
+        },
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=forecast.index,
+            y=upper.clip(min=0.0),
+            line={"width": 0},
+            showlegend=False,
+            hoverinfo="skip",
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=forecast.index,
+            y=lower.clip(min=0.0),
+            fill="tonexty",
+            fillcolor="rgba(128, 128, 128, 0.3)",
+            line={"width": 0},
+            name="Prediction Interval (P{}-P{})".format(*PREDICTION_INTERVAL),
+        )
     )
+    return fig, best_seasonality
@@ -10,22 +10,38 @@ import apps
 import far_core.db
 
 
-LAYOUT = html.Div(
-    [
-        apps.NAVBAR,
-        dbc.Row(
-            [dbc.Col([html.Div("Loading...", id="income_table_div")], width=10)],
-            justify="center",
-        ),
-    ]
-)
+def get_layout():
+    return html.Div(
+        [
+            apps.NAVBAR,
+            dbc.Row(
+                [
+                    dbc.Col(
+                        [
+                            # Outside of the table, which is rendered again
+                            # once the deletion changes the ledger
+                            dbc.Alert(
+                                "Deleted the selected rows",
+                                id="income_alert_auto",
+                                is_open=False,
+                                duration=10000,
+                            ),
+                            html.Div("Loading...", id="income_table_div"),
+                        ],
+                        width=10,
+                    )
+                ],
+                justify="center",
+            ),
+        ]
+    )
 
 
 @app.callback(
     Output("income_table_div", "children"),
-    Input("url", "pathname"),
+    [Input("url", "pathname"), Input("ledger_version", "data")],
 )
-def load_incomes(pathname: str):
+def load_incomes(pathname: str, _version=None):
     if pathname != "/incomes":
         return []
     df = apps.dataframe_from_expense_records(apps.get_all_income_records())
@@ -41,12 +57,6 @@ def load_incomes(pathname: str):
         fixed_rows={"headers": True, "data": 0},
     )
     return [
-        dbc.Alert(
-            "Deleting selected rows... Please reload the page to see changes!",
-            id="income_alert_auto",
-            is_open=False,
-            duration=10000,
-        ),
         html.Button(
             "Delete", id="income_delete_button", className="btn btn-outline-primary"
         ),
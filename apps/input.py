@@ -4,24 +4,31 @@ Dash app for the accounting input page, which handles adding expenses/incomes
 to the database.
 """
 
+import csv
 import datetime
 import logging
 
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ALL, ClientsideFunction, Input, Output, State
 import dash.exceptions
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 import enum
 
-from app import app, db
+from app import app, server
 import apps
 import far_core
 import far_core.db
 
+pd = apps.lazy_import("pandas")
 
 # How many lines of input to accept at a time
-NUMBER_OF_INPUT_ROWS = 12
+NUMBER_OF_INPUT_ROWS = server.config["FAR_INPUT_ROWS"]
+# Fields of each line, in the order assets/input.js receives them
+INPUT_FIELDS = ("date", "amount", "category", "note")
+# Most rows accepted by one bulk submit, and most row errors listed for it
+MAX_BULK_INPUT_ROWS = 10000
+MAX_REPORTED_ERRORS = 50
 
 
 class InputType(enum.Enum):
@@ -36,12 +43,22 @@ def get_layout():
     return html.Div(
         [
             apps.NAVBAR,
+            dcc.Store(id="input_submission"),
+            dcc.Store(id="input_reset"),
+            dcc.Store(id="input_known_values", data=get_known_values()),
             dbc.Alert(
                 "Input validation error! Please check your inputs for mistakes",
                 id="input_alert_auto",
                 is_open=False,
                 duration=4000,  # TODO: increase this and add error message
             ),
+            # Errors found by the validation in the browser, see assets/input.js
+            dbc.Alert(
+                id="input_alert_client",
+                color="warning",
+                is_open=False,
+                duration=10000,
+            ),
             dbc.Row(
                 [
                     dbc.Col(get_account_dropdown(), width=3),
@@ -60,10 +77,26 @@ def get_layout():
                     dbc.Col(html.Div(get_input_form(InputType.income))),
                 ]
             ),
+            html.Hr(),
+            dbc.Row(dbc.Col(get_bulk_input_form(), width=8), justify="center"),
         ]
     )
 
 
+def get_known_values() -> dict:
+    """
+    :return: the accounts and categories accepted by validate_expense_input
+        and validate_income_input, for the validation in the browser
+    """
+    return {
+        "accounts": [str(account) for account in far_core.Accounts],
+        "categories": {
+            str(InputType.expense): [str(cat) for cat in far_core.ExpenseCategory],
+            str(InputType.income): [str(cat) for cat in far_core.IncomeCategory],
+        },
+    }
+
+
 def get_account_dropdown():
     """
     :return: A dropdown element with options for account names
@@ -90,6 +123,41 @@ def get_input_clear_button():
     )
 
 
+def get_bulk_input_form():
+    """
+    :return: form for pasting many rows at once, e.g. from a spreadsheet
+    """
+    return html.Div(
+        [
+            html.H5("Bulk entry"),
+            html.P(
+                "Paste rows of date, amount, category and an optional note,"
+                " separated by tabs or commas, for the account selected above."
+            ),
+            dbc.RadioItems(
+                id="bulk_input_type",
+                options=[
+                    {"label": str(input_type), "value": str(input_type)}
+                    for input_type in InputType
+                ],
+                value=str(InputType.expense),
+                inline=True,
+            ),
+            dcc.Textarea(
+                id="bulk_input_text",
+                placeholder="2021-01-30\t12.50\tGroceries\tWeekly shop",
+                style={"width": "100%", "height": "200px"},
+            ),
+            html.Button(
+                "Submit pasted rows",
+                id="bulk_submit_button",
+                className="btn btn-outline-primary",
+            ),
+            html.Div(id="bulk_input_report"),
+        ]
+    )
+
+
 def get_input_form(input_type):
     """
     :param InputType input_type: enum of expense or income
@@ -122,11 +190,10 @@ def get_input_form(input_type):
 def get_input_row(input_type, identifier):
     """
     :param InputType input_type:
-    :param int identifier: index of the row, used to identify the forms
-        The full row identifier looks like "input-Expense-1-<input name>"
+    :param int identifier: index of the row, which with the input type
+        identifies the row's fields, see get_input_id()
     :return:
     """
-    type_and_identifier = f"input_{input_type}_{identifier}"
     if input_type is InputType.expense:
         categories = (cat_enum for cat_enum in far_core.ExpenseCategory)
     elif input_type is InputType.income:
@@ -135,12 +202,25 @@ def get_input_row(input_type, identifier):
         raise NotImplementedError("Only income and expenses inputs are allowed")
     return html.Tr(
         [
-            html.Td([dcc.Input(id=f"{type_and_identifier}_date", type="text")]),
-            html.Td([dcc.Input(id=f"{type_and_identifier}_amount", type="number")]),
+            html.Td(
+                [
+                    dcc.Input(
+                        id=get_input_id("date", input_type, identifier), type="text"
+                    )
+                ]
+            ),
+            html.Td(
+                [
+                    dcc.Input(
+                        id=get_input_id("amount", input_type, identifier),
+                        type="number",
+                    )
+                ]
+            ),
             html.Td(
                 [
                     dcc.Dropdown(
-                        id=f"{type_and_identifier}_category",
+                        id=get_input_id("category", input_type, identifier),
                         options=[
                             {"label": str(cat), "value": str(cat)} for cat in categories
                         ],
@@ -151,7 +231,7 @@ def get_input_row(input_type, identifier):
             html.Td(
                 [
                     dcc.Input(
-                        id=f"{type_and_identifier}_note",
+                        id=get_input_id("note", input_type, identifier),
                         type="text",
                         placeholder="Notes",
                     )
@@ -161,7 +241,16 @@ def get_input_row(input_type, identifier):
     )
 
 
-LAYOUT = get_layout()
+def get_input_id(field: str, input_type=ALL, identifier=ALL) -> dict:
+    """
+    :param str field: one of INPUT_FIELDS
+    :param input_type: InputType of the row, or a pattern-matching wildcard
+    :param identifier: index of the row, or a pattern-matching wildcard
+    :return: pattern-matching id of a field of the input grids
+    """
+    if isinstance(input_type, InputType):
+        input_type = str(input_type)
+    return {"type": f"input_{field}", "input_type": input_type, "index": identifier}
 
 
 def validate_expense_input(
@@ -212,96 +301,255 @@ def validate_income_input(
     }
 
 
-def generate_all_input_ids():
-    input_ids = []
-    for input_type in InputType:
-        for i in range(NUMBER_OF_INPUT_ROWS):
-            for specific_input in ("date", "amount", "category", "note"):
-                input_ids.append(f"input_{input_type}_{i}_{specific_input}")
-    return input_ids
-
-
-def handle_submit(ctx, account_name: str, in_states: tuple):
+def handle_submit(account_name: str, rows: list) -> bool:
     """
-    Handles the submit button, validating input rows and inserting them into
-    the database if all are valid inputs.
+    Validates the submitted input rows, inserting them into the database if
+    all are valid inputs.
 
-    :param dash.callback_context ctx: context of the callback
     :param str account_name:
-    :param tuple[str] in_states: tuple of states from handle_inputs
-    :return: List of outputs for handle_inputs
+    :param list rows: dicts of the non-empty rows, with keys "input_type",
+        "date", "amount", "category" and "note"
+    :return: whether any row failed validation
     """
     logger = logging.getLogger(__name__).getChild("handle_submit")
-    for i in range(NUMBER_OF_INPUT_ROWS):
-        exp_id = f"input_{InputType.expense}_{i}"
-        inc_id = f"input_{InputType.income}_{i}"
-        exp_date = ctx.states[f"{exp_id}_date.value"]
-        exp_amount = ctx.states[f"{exp_id}_amount.value"]
-        exp_category = ctx.states[f"{exp_id}_category.value"]
-        exp_note = ctx.states[f"{exp_id}_note.value"]
+    records = {InputType.expense: [], InputType.income: []}
+    for row in rows:
+        input_type = InputType(row["input_type"])
+        if input_type is InputType.expense:
+            validate = validate_expense_input
+        else:
+            validate = validate_income_input
         try:
-            exp_kwargs = validate_expense_input(
-                date=exp_date,
-                amount=exp_amount,
-                category=exp_category,
-                note=exp_note,
+            kwargs = validate(
+                date=row["date"],
+                amount=row["amount"],
+                category=row["category"],
+                note=row["note"],
                 account=account_name,
             )
-            if exp_kwargs:
-                exp_record = far_core.db.ExpenseRecord(**exp_kwargs)
         except ValueError as e:
-            logger.info("Handle expense input validation error: %s", e)
+            logger.info("Handle %s input validation error: %s", input_type, e)
             # Validation error, display the alert bar
-            db.session.rollback()
-            return (True, account_name) + in_states
-        if exp_kwargs:
-            db.session.add(exp_record)
-        inc_date = ctx.states[f"{inc_id}_date.value"]
-        inc_amount = ctx.states[f"{inc_id}_amount.value"]
-        inc_category = ctx.states[f"{inc_id}_category.value"]
-        inc_note = ctx.states[f"{inc_id}_note.value"]
-        try:
-            inc_kwargs = validate_income_input(
-                date=inc_date,
-                amount=inc_amount,
-                category=inc_category,
-                note=inc_note,
-                account=account_name,
+            return True
+        if kwargs:
+            records[input_type].append(kwargs)
+    far_core.db.insert_records(
+        expense_records=records[InputType.expense],
+        income_records=records[InputType.income],
+    )
+    return False
+
+
+def parse_bulk_input(text: str) -> tuple:
+    """
+    Parses pasted rows of INPUT_FIELDS, separated by tabs if any line has
+    one, as when copied from a spreadsheet, and otherwise by commas.
+    Blank lines are skipped and the note may be left out.
+
+    :param str text: the pasted rows
+    :return: tuple of (pd.DataFrame of the fields as strings, indexed by
+        line number, dict of error messages by line number)
+    """
+    lines = text.splitlines()
+    delimiter = "\t" if any("\t" in line for line in lines) else ","
+    reader = csv.reader(lines, delimiter=delimiter)
+    rows = []
+    line_numbers = []
+    errors = {}
+    for fields in reader:
+        fields = [field.strip() for field in fields]
+        if not any(fields):
+            continue
+        if len(fields) > len(INPUT_FIELDS):
+            errors[reader.line_num] = f"Expected at most {len(INPUT_FIELDS)} columns"
+            continue
+        rows.append(fields + [""] * (len(INPUT_FIELDS) - len(fields)))
+        line_numbers.append(reader.line_num)
+    return (
+        pd.DataFrame(
+            rows, columns=INPUT_FIELDS, index=pd.Index(line_numbers, name="line")
+        ),
+        errors,
+    )
+
+
+def validate_bulk_input(rows, input_type: InputType) -> tuple:
+    """
+    Applies the rules of validate_expense_input and validate_income_input to
+    every row at once.
+
+    :param pd.DataFrame rows: as returned by parse_bulk_input()
+    :param InputType input_type: whether the rows are expenses or incomes
+    :return: tuple of (pd.DataFrame of the valid rows, with "date",
+        "amount", "category" and "note" columns ready to insert, dict of
+        error messages by line number of the invalid rows)
+    """
+    if input_type is InputType.expense:
+        category_enum = far_core.ExpenseCategory
+    else:
+        category_enum = far_core.IncomeCategory
+    amounts = pd.to_numeric(rows["amount"], errors="coerce")
+    categories = rows["category"].map({str(cat): cat for cat in category_enum})
+    dates = far_core.dates_from_strings(rows["date"])
+    tomorrow = datetime.datetime.now().date() + datetime.timedelta(days=1)
+    # Only the first error of each row is kept, in the order of the checks
+    errors = pd.Series("", index=rows.index)
+    for invalid, message in (
+        (
+            (rows["date"] == "")
+            | (rows["amount"] == "")
+            | (amounts == 0)
+            | (rows["category"] == ""),
+            "Missing required field in input",
+        ),
+        (amounts.isna(), "Amount is not a number: '" + rows["amount"] + "'"),
+        (amounts < 0, "Amount cannot be negative"),
+        (categories.isna(), "Unknown category: '" + rows["category"] + "'"),
+        (dates.isna(), "Unrecognised date string: '" + rows["date"] + "'"),
+        (dates.dt.date > tomorrow, "Dates cannot be set in the future!"),
+    ):
+        errors = errors.mask(invalid & (errors == ""), message)
+    valid = errors == ""
+    return (
+        pd.DataFrame(
+            {
+                "date": dates[valid].dt.date,
+                "amount": amounts[valid],
+                "category": categories[valid],
+                "note": rows["note"][valid].where(rows["note"] != "", None),
+            }
+        ),
+        errors[~valid].to_dict(),
+    )
+
+
+def get_bulk_input_error_report(errors: dict) -> list:
+    """
+    :param dict errors: error messages by line number
+    :return: alert listing the first MAX_REPORTED_ERRORS errors
+    """
+    lines = sorted(errors)
+    table_rows = [
+        html.Tr([html.Td(line), html.Td(errors[line])])
+        for line in lines[:MAX_REPORTED_ERRORS]
+    ]
+    if len(lines) > MAX_REPORTED_ERRORS:
+        table_rows.append(
+            html.Tr(
+                html.Td(
+                    f"... and {len(lines) - MAX_REPORTED_ERRORS} more", colSpan=2
+                )
             )
-            if inc_kwargs:
-                inc_record = far_core.db.IncomeRecord(**inc_kwargs)
-        except ValueError as e:
-            logger.info("Handle income input validation error: %s", e)
-            # Validation error, display the alert bar
-            db.session.rollback()
-            return (True, account_name) + in_states
-        if inc_kwargs:
-            db.session.add(inc_record)
-    db.session.commit()
-    return [False, account_name] + [""] * len(in_states)
+        )
+    return [
+        dbc.Alert(
+            f"{len(lines)} rows have errors, nothing was added. Please fix them"
+            " and submit again.",
+            color="danger",
+        ),
+        dbc.Table(
+            [
+                html.Thead(html.Tr([html.Th("Line"), html.Th("Error")])),
+                html.Tbody(table_rows),
+            ],
+            bordered=True,
+            size="sm",
+        ),
+    ]
 
 
 @app.callback(
     [
-        Output("input_alert_auto", "is_open"),
-        Output("account_dropdown", "value"),
-    ]
-    + [Output(input_id, "value") for input_id in generate_all_input_ids()],
-    Input("clear_input_button", "n_clicks"),
+        Output("bulk_input_report", "children"),
+        Output("bulk_input_text", "value"),
+    ],
+    Input("bulk_submit_button", "n_clicks"),
+    [
+        State("bulk_input_text", "value"),
+        State("bulk_input_type", "value"),
+        State("account_dropdown", "value"),
+    ],
+)
+def handle_bulk_input(n_clicks, text: str, input_type_str: str, account_name: str):
+    """
+    Validates all pasted rows and inserts them in one statement, if all are
+    valid inputs, otherwise reports the error of every invalid row.
+    """
+    logger = logging.getLogger(__name__).getChild("handle_bulk_input")
+    if not n_clicks or not text:
+        raise dash.exceptions.PreventUpdate()
+    try:
+        account = far_core.Accounts(account_name)
+    except ValueError:
+        return dbc.Alert("Select an account first", color="danger"), dash.no_update
+    input_type = InputType(input_type_str)
+    rows, errors = parse_bulk_input(text)
+    if len(rows) > MAX_BULK_INPUT_ROWS:
+        return (
+            dbc.Alert(
+                f"At most {MAX_BULK_INPUT_ROWS} rows can be added at a time",
+                color="danger",
+            ),
+            dash.no_update,
+        )
+    records, row_errors = validate_bulk_input(rows, input_type)
+    errors.update(row_errors)
+    if errors:
+        logger.info("Bulk %s input has %d invalid rows", input_type, len(errors))
+        return get_bulk_input_error_report(errors), dash.no_update
+    records["account"] = account
+    if input_type is InputType.expense:
+        far_core.db.insert_records(expense_records=records.to_dict("records"))
+    else:
+        far_core.db.insert_records(income_records=records.to_dict("records"))
+    return (
+        dbc.Alert(f"Added {len(records)} {input_type} records", color="success"),
+        "",
+    )
+
+
+# Gathers the non-empty rows of the grids in the browser, so only those are
+# sent to the server, and only if they pass the same validation as
+# handle_submit, see assets/input.js
+app.clientside_callback(
+    ClientsideFunction(namespace="input", function_name="collect"),
+    [
+        Output("input_submission", "data"),
+        Output("input_alert_client", "is_open"),
+        Output("input_alert_client", "children"),
+    ],
     Input("submit_input_button", "n_clicks"),
     [State("account_dropdown", "value")]
-    + [State(input_id, "value") for input_id in generate_all_input_ids()],
+    + [State(get_input_id(field), "value") for field in INPUT_FIELDS]
+    + [State(get_input_id("date"), "id"), State("input_known_values", "data")],
 )
-def handle_inputs(clear_clicks, submit_clicks, account_name, *in_states):
+
+
+@app.callback(
+    [
+        Output("input_alert_auto", "is_open"),
+        Output("input_reset", "data"),
+    ],
+    Input("input_submission", "data"),
+)
+def handle_inputs(submission: dict):
     """
-    Handler for the input sheet, determines whether clearing or submitting.
+    Handler for the submitted input rows, resetting the grids on success.
     """
-    ctx = dash.callback_context
-    if not ctx.triggered:
+    if not submission:
         raise dash.exceptions.PreventUpdate()
-    triggered_ids = tuple(t["prop_id"] for t in ctx.triggered)
-    if "submit_input_button.n_clicks" in triggered_ids and submit_clicks:
-        return handle_submit(ctx, account_name=account_name, in_states=in_states)
-    elif "clear_input_button.n_clicks" in triggered_ids and clear_clicks:
-        return [False, ""] + [""] * len(in_states)
-    return (False, account_name) + in_states
+    if handle_submit(submission["account"], submission["rows"]):
+        return True, dash.no_update
+    return False, submission["submitted"]
+
+
+# Blanks the grids after a successful submit, and the account too on Clear,
+# without a round trip to the server
+app.clientside_callback(
+    ClientsideFunction(namespace="input", function_name="clear"),
+    [Output("account_dropdown", "value")]
+    + [Output(get_input_id(field), "value") for field in INPUT_FIELDS],
+    Input("clear_input_button", "n_clicks"),
+    Input("input_reset", "data"),
+    [State(get_input_id("date"), "id")],
+)
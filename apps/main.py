@@ -1,7 +1,5 @@
 #!/usr/bin/python3
 
-import collections
-
 from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 import dash_html_components as html
@@ -10,55 +8,54 @@ from app import app
 import apps
 import apps.report
 import far_core
+import far_core.calendar
+import far_core.current_month
 
 
-LAYOUT = html.Div(
-    [
-        apps.NAVBAR,
-        dbc.Row(
-            dbc.Col(
-                children=[
-                    dbc.Table(
-                        children=[],
-                        id="main_page_discretionary_by_account",
-                        bordered=True,
-                        responsive=True,
-                        striped=True,
-                    ),
-                    dbc.Table(
-                        children=[],
-                        id="main_page_categorical_expenses",
-                        bordered=True,
-                        responsive=True,
-                        striped=True,
-                    ),
-                    dbc.Table(
-                        children=[],
-                        id="main_page_categorical_incomes",
-                        bordered=True,
-                        responsive=True,
-                        striped=True,
-                    ),
-                ],
-                id="main_page_col",
-                width=6,
-                align="center",
+def get_layout():
+    return html.Div(
+        [
+            apps.NAVBAR,
+            dbc.Row(
+                dbc.Col(
+                    children=[
+                        dbc.Table(
+                            children=[],
+                            id="main_page_discretionary_by_account",
+                            bordered=True,
+                            responsive=True,
+                            striped=True,
+                        ),
+                        dbc.Table(
+                            children=[],
+                            id="main_page_categorical_expenses",
+                            bordered=True,
+                            responsive=True,
+                            striped=True,
+                        ),
+                        dbc.Table(
+                            children=[],
+                            id="main_page_categorical_incomes",
+                            bordered=True,
+                            responsive=True,
+                            striped=True,
+                        ),
+                    ],
+                    id="main_page_col",
+                    width=6,
+                    align="center",
+                ),
+                justify="center",
             ),
-            justify="center",
-        ),
-    ]
-)
+        ]
+    )
 
 
-@app.callback(
-    Output("main_page_discretionary_by_account", "children"),
-    Input("url", "pathname"),
-)
-def main_page_discretionary_by_account(pathname):
-    if pathname != "/":
-        return []
-    start_date = far_core.get_current_month()
-    end_date = far_core.month_delta(start_date, 1)
+def get_month_header(totals) -> str:
+    return far_core.calendar.month_from_key(totals.month).strftime("%Y-%m")
+
+
+def get_discretionary_by_account_rows(totals) -> list:
     table_rows = [
         html.Thead(
             [
@@ -66,27 +63,22 @@ def main_page_discretionary_by_account(pathname):
                 html.Tr(
                     [
                         html.Th("Account Name"),
-                        html.Th(start_date.strftime("%Y-%m")),
+                        html.Th(get_month_header(totals)),
                     ]
                 ),
             ]
         ),
     ]
-    counter = collections.Counter()
-    exp_records = apps.get_filtered_expense_records(
-        end_date=end_date,
-        start_date=start_date,
-    )
-    for exp_record in exp_records:
-        if exp_record.category.reduced_category is far_core.ReducedCategory.fun:
-            counter[exp_record.account] += exp_record.amount
     for account in far_core.Accounts:
+        amount = totals.expense_by_reduced_category_and_account[
+            (far_core.ReducedCategory.fun, account)
+        ]
         table_rows.append(
             html.Tbody(
                 html.Tr(
                     [
                         html.Td(str(account)),
-                        html.Td(far_core.usd_str(counter[account])),
+                        html.Td(far_core.usd_str(amount)),
                     ]
                 )
             )
@@ -94,15 +86,7 @@ def main_page_discretionary_by_account(pathname):
     return table_rows
 
 
-@app.callback(
-    Output("main_page_categorical_expenses", "children"),
-    Input("url", "pathname"),
-)
-def main_page_categorical_expenses(pathname):
-    if pathname != "/":
-        return []
-    start_date = far_core.get_current_month()
-    end_date = far_core.month_delta(start_date, 1)
+def get_categorical_expense_rows(totals) -> list:
     table_rows = [
         html.Thead(
             [
@@ -112,33 +96,20 @@ def main_page_categorical_expenses(pathname):
                 html.Tr(
                     [
                         html.Th("Category"),
-                        html.Th(start_date.strftime("%Y-%m")),
+                        html.Th(get_month_header(totals)),
                     ]
                 ),
             ]
         ),
     ]
-    category_counters = []
-    exp_records = apps.get_filtered_expense_records(
-        end_date=end_date, start_date=start_date
-    )
-    category_counters.append(apps.report.get_category_counter(exp_records))
     category_rows = apps.report.get_categorical_review_table_expense_rows(
-        category_counters
+        [totals.expense_by_category]
     )
     table_rows.append(html.Tbody(category_rows))
     return table_rows
 
 
-@app.callback(
-    Output("main_page_categorical_incomes", "children"),
-    Input("url", "pathname"),
-)
-def main_page_categorical_incomes(pathname):
-    if pathname != "/":
-        return []
-    start_date = far_core.get_current_month()
-    end_date = far_core.month_delta(start_date, 1)
+def get_categorical_income_rows(totals) -> list:
     table_rows = [
         html.Thead(
             [
@@ -148,19 +119,34 @@ def main_page_categorical_incomes(pathname):
                 html.Tr(
                     [
                         html.Th("Category"),
-                        html.Th(start_date.strftime("%Y-%m")),
+                        html.Th(get_month_header(totals)),
                     ]
                 ),
             ]
         ),
     ]
-    category_counters = []
-    inc_records = apps.get_filtered_income_records(
-        end_date=end_date, start_date=start_date
-    )
-    category_counters.append(apps.report.get_category_counter(inc_records))
     category_rows = apps.report.get_categorical_review_table_income_rows(
-        category_counters
+        [totals.income_by_category]
     )
     table_rows.append(html.Tbody(category_rows))
     return table_rows
+
+
+@app.callback(
+    [
+        Output("main_page_discretionary_by_account", "children"),
+        Output("main_page_categorical_expenses", "children"),
+        Output("main_page_categorical_incomes", "children"),
+    ],
+    [Input("url", "pathname"), Input("ledger_version", "data")],
+)
+def main_page(pathname, _version=None):
+    """Renders every table of the main page from the current month's totals"""
+    if pathname != "/":
+        return [], [], []
+    totals = far_core.current_month.get_current_month_totals()
+    return (
+        get_discretionary_by_account_rows(totals),
+        get_categorical_expense_rows(totals),
+        get_categorical_income_rows(totals),
+    )
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+"""
+Dash app for the cashflow projection page, which simulates future months of
+income minus expenses from the per-category history of the ledger.
+"""
+
+from dash.dependencies import Input, Output
+import dash_bootstrap_components as dbc
+import dash_core_components as dcc
+import dash_html_components as html
+
+from app import app
+import apps
+import far_core
+import far_core.calendar
+
+np = apps.lazy_import("numpy")
+go = apps.lazy_import("plotly.graph_objects")
+
+
+# Months of history used to build the per-category residual distributions
+HISTORY_MONTHS = 24
+# Months simulated into the future
+PROJECTION_MONTHS = 12
+NUMBER_OF_PATHS = 10000
+PERCENTILES = (5, 25, 50, 75, 95)
+# Reduced categories counted as spending by the savings rate, see
+# apps.report.get_spending
+SPENDING_REDUCED_CATEGORIES = (
+    far_core.ReducedCategory.fun,
+    far_core.ReducedCategory.mandatory,
+    far_core.ReducedCategory.debt,
+)
+
+
+def get_layout():
+    return html.Div(
+        [
+            apps.NAVBAR,
+            dbc.Row(
+                dbc.Col(
+                    children=[
+                        html.Div(
+                            children=[
+                                html.Label(
+                                    children="Choose month to start projection on:",
+                                    className="col-form-label",
+                                    htmlFor="report_date_picker_projection",
+                                ),
+                                dcc.Input(
+                                    id="report_date_picker_projection",
+                                    className="form-control",
+                                    debounce=True,
+                                    type="text",
+                                    value=far_core.get_current_month().strftime(
+                                        "%Y-%m"
+                                    ),
+                                    placeholder='Month to start projection on, e.g. "2000-01"',
+                                    pattern=r"\d{4}-([1-9]|1[0-2]|0[1-9])",
+                                ),
+                                html.Label(
+                                    children="Starting balance:",
+                                    className="col-form-label",
+                                    htmlFor="report_starting_balance_projection",
+                                ),
+                                dcc.Input(
+                                    id="report_starting_balance_projection",
+                                    className="form-control",
+                                    debounce=True,
+                                    type="number",
+                                    value=0,
+                                ),
+                            ],
+                            className="form-group",
+                        ),
+                        html.Hr(),
+                        dcc.Graph(id="cashflow_projection_graph"),
+                        html.Hr(),
+                        dbc.Table(
+                            children=[],
+                            id="cashflow_projection_table",
+                            bordered=True,
+                            responsive=True,
+                            striped=True,
+                        ),
+                    ],
+                    width=8,
+                    align="center",
+                ),
+                justify="center",
+            ),
+        ]
+    )
+
+
+def get_monthly_history(record_type: str, categories: list, months: range):
+    """
+    :param str record_type: "expense" or "income"
+    :param list categories: category enums, one column per category
+    :param range months: month keys of the history window, see far_core.calendar
+    :return: np.ndarray of shape (len(months), len(categories)) holding the
+        total amount per month and category
+    """
+    totals = apps.get_monthly_totals(record_type, months, by="category")
+    return totals[categories].to_numpy(dtype=np.float64)
+
+
+def simulate_category_paths(history, months: int, paths: int, rng):
+    """
+    Simulates future monthly amounts per category as the historical mean of
+    the category plus a residual bootstrapped from that category's history.
+    Every path, month and category is drawn in a single batch.
+
+    :param np.ndarray history: shape (history months, categories)
+    :return: np.ndarray of shape (paths, months, categories)
+    """
+    mean = history.mean(axis=0)
+    residuals = history - mean
+    draws = rng.integers(0, history.shape[0], size=(paths, months, history.shape[1]))
+    simulated = mean + residuals[draws, np.arange(history.shape[1])]
+    # Amounts are never negative, even if a residual would make them so
+    return np.maximum(simulated, 0.0, out=simulated)
+
+
+def simulate_cashflows(
+    expense_history,
+    income_history,
+    spending_mask,
+    starting_balance: float = 0.0,
+    months: int = PROJECTION_MONTHS,
+    paths: int = NUMBER_OF_PATHS,
+    rng=None,
+) -> dict:
+    """
+    :param np.ndarray expense_history: shape (history months, expense categories)
+    :param np.ndarray income_history: shape (history months, income categories)
+    :param np.ndarray spending_mask: boolean mask over the expense categories
+        which count as spending for the savings rate
+    :return: dict of np.ndarray with keys:
+        "balance": shape (paths, months), running balance of each path
+        "savings_rate": shape (paths,), savings rate of each path
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    expenses = simulate_category_paths(expense_history, months, paths, rng)
+    incomes = simulate_category_paths(income_history, months, paths, rng)
+    total_incomes = incomes.sum(axis=2)
+    net_cashflow = total_incomes - expenses.sum(axis=2)
+    balance = starting_balance + np.cumsum(net_cashflow, axis=1)
+    path_incomes = total_incomes.sum(axis=1)
+    path_spending = expenses[:, :, spending_mask].sum(axis=(1, 2))
+    savings_rate = np.divide(
+        path_incomes - path_spending,
+        path_incomes,
+        out=np.zeros(paths),
+        where=path_incomes > 0,  # avoid zero division
+    )
+    return {"balance": balance, "savings_rate": savings_rate}
+
+
+def get_projection(start_date, starting_balance: float = 0.0) -> tuple:
+    """
+    :param datetime.date start_date: first projected month, the history window
+        ends on the month before it
+    :return: tuple of (projected months, simulate_cashflows result)
+    """
+    start_month = far_core.calendar.month_key(start_date)
+    history = range(start_month - HISTORY_MONTHS, start_month)
+    expense_categories = list(far_core.ExpenseCategory)
+    income_categories = list(far_core.IncomeCategory)
+    expense_history = get_monthly_history("expense", expense_categories, history)
+    income_history = get_monthly_history("income", income_categories, history)
+    spending_mask = np.array(
+        [
+            far_core.REDUCED_CATEGORY_BY_EXPENSE_CATEGORY[cat]
+            in SPENDING_REDUCED_CATEGORIES
+            for cat in expense_categories
+        ]
+    )
+    months = list(far_core.calendar.get_month_starts(start_month, PROJECTION_MONTHS))
+    return months, simulate_cashflows(
+        expense_history,
+        income_history,
+        spending_mask,
+        starting_balance=starting_balance,
+    )
+
+
+@app.callback(
+    [
+        Output("cashflow_projection_graph", "figure"),
+        Output("cashflow_projection_table", "children"),
+    ],
+    [
+        Input("report_date_picker_projection", "value"),
+        Input("report_starting_balance_projection", "value"),
+        Input("ledger_version", "data"),
+    ],
+)
+def cashflow_projection(date_str: str, starting_balance: float, _version=None):
+    start_date = far_core.get_date_from_date_str(date_str)
+    if not start_date:
+        return {"data": []}, []
+    months, projection = get_projection(start_date, float(starting_balance or 0.0))
+    balance_bands = np.percentile(projection["balance"], PERCENTILES, axis=0)
+    fig = go.Figure()
+    for low, high in ((0, -1), (1, -2)):
+        fig.add_trace(
+            go.Scatter(
+                x=months,
+                y=balance_bands[high],
+                line={"width": 0},
+                showlegend=False,
+                hoverinfo="skip",
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=months,
+                y=balance_bands[low],
+                fill="tonexty",
+                fillcolor="rgba(0, 0, 255, 0.15)",
+                line={"width": 0},
+                name=f"P{PERCENTILES[low]}-P{PERCENTILES[high]}",
+            )
+        )
+    fig.add_trace(
+        go.Scatter(
+            x=months,
+            y=balance_bands[len(PERCENTILES) // 2],
+            line={"color": "blue"},
+            name="Median",
+        )
+    )
+    fig.update_layout(
+        title=f"Projected Balance ({NUMBER_OF_PATHS:,} simulated paths)",
+        xaxis_title="Month",
+        yaxis_title="Balance (USD)",
+    )
+    ending_balances = balance_bands[:, -1]
+    savings_rates = np.percentile(projection["savings_rate"], PERCENTILES)
+    table_rows = [
+        html.Thead(
+            [
+                html.Tr(
+                    [
+                        html.Th(
+                            f"Projection: {PROJECTION_MONTHS} months",
+                            colSpan=len(PERCENTILES) + 1,
+                        )
+                    ]
+                ),
+                html.Tr(
+                    [html.Th("Percentile")]
+                    + [html.Th(f"P{percentile}") for percentile in PERCENTILES]
+                ),
+            ]
+        ),
+        html.Tbody(
+            [
+                html.Tr(
+                    [html.Td("Ending Balance")]
+                    + [html.Td(far_core.usd_str(value)) for value in ending_balances]
+                ),
+                html.Tr(
+                    [html.Td("Savings Rate")]
+                    + [html.Td(f"{value:.1%}") for value in savings_rates]
+                ),
+            ]
+        ),
+    ]
+    return fig, table_rows
@@ -1,21 +1,21 @@
 #!/usr/bin/python3
 
-import collections
-import decimal
-
 from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
-import pandas as pd
-import plotly.express as px
 
 from app import app
 import apps
 import far_core
+import far_core.calendar
+import far_core.jobs
 from far_core import get_date_from_date_str
 
+pd = apps.lazy_import("pandas")
+px = apps.lazy_import("plotly.express")
+
 
 def get_layout(report_type: str):
     if report_type not in ("annual", "monthly"):
@@ -44,6 +44,8 @@ def get_layout(report_type: str):
         )
     )
     children.append(html.Hr())
+    if report_type == "annual":
+        children.extend(apps.get_background_components("annual_report"))
 
     # Executive Summary
     if report_type == "monthly":
@@ -112,8 +114,10 @@ def get_layout(report_type: str):
     )
 
 
-ANNUAL_LAYOUT = get_layout("annual")
-MONTHLY_LAYOUT = get_layout("monthly")
+def get_months(end_date, count: int) -> range:
+    """:return: range of the month keys of the count months before end_date"""
+    end_month = far_core.calendar.month_key(end_date)
+    return range(end_month - count, end_month)
 
 
 @app.callback(
@@ -121,23 +125,19 @@ MONTHLY_LAYOUT = get_layout("monthly")
         Output("executive_summary_header_monthly", "children"),
         Output("executive_summary_text_monthly", "children"),
     ],
-    Input("report_date_picker_monthly", "value"),
+    [
+        Input("report_date_picker_monthly", "value"),
+        Input("ledger_version", "data"),
+    ],
 )
-def executive_summary_monthly(date_str: str) -> tuple:
+def executive_summary_monthly(date_str: str, _version=None) -> tuple:
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return ["No summary..."], [f"No summary available for {date_str}"]
-    start_date = far_core.month_delta(end_date, -1)
-    exp_records = apps.get_filtered_expense_records(
-        end_date=end_date,
-        start_date=start_date,
-    )
-    inc_records = apps.get_filtered_income_records(
-        end_date=end_date,
-        start_date=start_date,
-    )
-    total_expenses = far_core.sum_all_records(exp_records)
-    total_income = far_core.sum_all_records(inc_records)
+    months = get_months(end_date, 1)
+    start_date = far_core.calendar.month_from_key(months[0])
+    total_expenses = apps.get_monthly_totals("expense", months)["amount"].sum()
+    total_income = apps.get_monthly_totals("income", months)["amount"].sum()
     net_cashflow = total_income - total_expenses
     header_children = []
     if net_cashflow > 0:
@@ -172,13 +172,6 @@ def executive_summary_monthly(date_str: str) -> tuple:
     return header_children, text_children
 
 
-def get_category_counter(records: list) -> collections.Counter:
-    counter = collections.Counter()
-    for record in records:
-        counter[record.category] += record.amount
-    return counter
-
-
 def get_categorical_review_table_expense_rows(category_counters: list) -> list:
     cat_rows = []
     for cat in far_core.ExpenseCategory:
@@ -217,44 +210,34 @@ def get_categorical_review_table_income_rows(category_counters: list) -> list:
 
 @app.callback(
     Output("categorical_expense_table_monthly", "children"),
-    Input("report_date_picker_monthly", "value"),
+    [
+        Input("report_date_picker_monthly", "value"),
+        Input("ledger_version", "data"),
+    ],
 )
-def categorical_review_table_monthly(date_str: str):
+def categorical_review_table_monthly(date_str: str, _version=None):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return []
+    totals = apps.get_monthly_totals("expense", get_months(end_date, 3), by="category")
     table_rows = [
         html.Thead(
             [
                 html.Tr([html.Th("Categorical Expense Review: Monthly", colSpan=4)]),
                 html.Tr(
-                    [
-                        html.Th("Category"),
-                        html.Th(far_core.month_delta(end_date, -3).strftime("%Y-%m")),
-                        html.Th(far_core.month_delta(end_date, -2).strftime("%Y-%m")),
-                        html.Th(far_core.month_delta(end_date, -1).strftime("%Y-%m")),
-                    ]
+                    [html.Th("Category")]
+                    + [html.Th(month.strftime("%Y-%m")) for month in totals.index]
                 ),
             ]
         ),
     ]
-    category_counters = []
-    for month_delta in range(-3, 0):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        category_counters.append(get_category_counter(exp_records))
+    # Each month's row of totals maps every category to its amount
+    category_counters = [row for _, row in totals.iterrows()]
     category_rows = get_categorical_review_table_expense_rows(category_counters)
     table_rows.append(html.Tbody(category_rows))
     return table_rows
 
 
-@app.callback(
-    Output("categorical_expense_table_annual", "children"),
-    Input("report_date_picker_annual", "value"),
-)
 def categorical_review_table_annual(date_str: str):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
@@ -268,7 +251,9 @@ def categorical_review_table_annual(date_str: str):
                         html.Th("Category"),
                         html.Th(
                             "Year ending on {}".format(
-                                far_core.month_delta(end_date, -12).strftime("%Y-%m")
+                                far_core.calendar.month_from_key(
+                                    far_core.calendar.month_key(end_date) - 12
+                                ).strftime("%Y-%m")
                             )
                         ),
                         html.Th("Year ending on {}".format(end_date.strftime("%Y-%m"))),
@@ -277,143 +262,74 @@ def categorical_review_table_annual(date_str: str):
             ]
         ),
     ]
-    category_counters = []
-    for month_delta in range(-25, -12, 12):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 12)
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        category_counters.append(get_category_counter(exp_records))
+    # The two years of 12 months starting 25 and 13 months before end_date
+    months = get_months(end_date, 25)[:24]
+    totals = apps.get_monthly_totals("expense", months, by="category")
+    category_counters = [totals.iloc[:12].sum(), totals.iloc[12:].sum()]
     category_rows = get_categorical_review_table_expense_rows(category_counters)
     header_row.append(html.Tbody(category_rows))
     return header_row
 
 
-def get_reduced_category_counter(exp_records: list) -> collections.Counter:
+def get_cash_flow_review_figure(months: range, title: str):
     """
-    :return: a collections.Counter with keys of far_core.ReducedCategory and
-        value of the sum of expenses in that reduced category from exp_records.
+    :return: figure of the spending per reduced category, and the income,
+        of each month
     """
-    counter = collections.Counter()
-    for record in exp_records:
-        counter[record.category.reduced_category] += record.amount
-    return counter
-
-
-@app.callback(
-    Output("cash_flow_review_graph_monthly", "figure"),
-    Input("report_date_picker_monthly", "value"),
-)
-def cash_flow_review_graph_monthly(date_str: str):
-    end_date = get_date_from_date_str(date_str)
-    if not end_date:
-        return {"data": []}
-    months = []
-    reduced_category_counters = []
-    incomes = []
-    for month_delta in range(-13, 0):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        months.append(month_slice_start)
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        reduced_category_counters.append(get_reduced_category_counter(exp_records))
-        inc_records = apps.get_filtered_income_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        month_income = 0.0
-        for inc_record in inc_records:
-            month_income += float(inc_record.amount)
-        incomes.append(month_income)
-    df = pd.DataFrame(index=months)
-    colours = []
-    for red_cat in far_core.ReducedCategory:
-        df[str(red_cat)] = [float(cntr[red_cat]) for cntr in reduced_category_counters]
-        colours.append(red_cat.colour)
-    df["Income"] = incomes
+    # Renamed into a copy, as memoized results may be shared
+    df = apps.get_monthly_totals("expense", months, by="reduced_category").rename(
+        columns=str
+    )
+    colours = [red_cat.colour for red_cat in far_core.ReducedCategory]
+    df["Income"] = apps.get_monthly_totals("income", months)["amount"]
     colours.append("black")
     return px.line(
         df,
         x=df.index,
         y=df.columns,
-        title="Monthly Cash Flow Review",
+        title=title,
         color_discrete_sequence=colours,
         labels={"index": "Month", "value": "Spending (USD)", "variable": "Category"},
     )
 
 
 @app.callback(
-    Output("cash_flow_review_graph_annual", "figure"),
-    Input("report_date_picker_annual", "value"),
+    Output("cash_flow_review_graph_monthly", "figure"),
+    [
+        Input("report_date_picker_monthly", "value"),
+        Input("ledger_version", "data"),
+    ],
 )
-def cash_flow_review_graph_annual(date_str: str):
+def cash_flow_review_graph_monthly(date_str: str, _version=None):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return {"data": []}
-    months = []
-    reduced_category_counters = []
-    incomes = []
-    for month_delta in range((-12 * 3) - 1, 0):  # Three years
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        months.append(month_slice_start)
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        reduced_category_counters.append(get_reduced_category_counter(exp_records))
-        inc_records = apps.get_filtered_income_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        month_income = 0.0
-        for inc_record in inc_records:
-            month_income += float(inc_record.amount)
-        incomes.append(month_income)
-    df = pd.DataFrame(index=months)
-    colours = []
-    for red_cat in far_core.ReducedCategory:
-        df[str(red_cat)] = [float(cntr[red_cat]) for cntr in reduced_category_counters]
-        colours.append(red_cat.colour)
-    df["Income"] = incomes
-    colours.append("black")
-    return px.line(
-        df,
-        x=df.index,
-        y=df.columns,
-        title="Annual Cash Flow Review",
-        color_discrete_sequence=colours,
-        labels={"index": "Month", "value": "Spending (USD)", "variable": "Category"},
+    return get_cash_flow_review_figure(
+        get_months(end_date, 13), "Monthly Cash Flow Review"
     )
 
 
-@app.callback(
-    Output("discretionary_spending_review_graph_monthly", "figure"),
-    Input("report_date_picker_monthly", "value"),
-)
-def discretionary_spending_review_graph_monthly(date_str: str):
+def cash_flow_review_graph_annual(date_str: str):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return {"data": []}
-    months = []
-    account_counters = []
-    for month_delta in range(-13, 0):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        months.append(month_slice_start)
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        account_counter = collections.Counter()
-        for exp_record in exp_records:
-            if exp_record.category.reduced_category is far_core.ReducedCategory.fun:
-                account_counter[exp_record.account] += exp_record.amount
-        account_counters.append(account_counter)
-    df = pd.DataFrame(index=months)
-    colours = []
-    for account in far_core.Accounts:
-        df[str(account)] = [float(cntr[account]) for cntr in account_counters]
-        colours.append(account.colour)
+    # Three years
+    return get_cash_flow_review_figure(
+        get_months(end_date, (12 * 3) + 1), "Annual Cash Flow Review"
+    )
+
+
+def get_discretionary_spending_review_figure(months: range):
+    """:return: figure of the discretionary spending per account of each month"""
+    df = apps.get_monthly_totals(
+        "expense",
+        months,
+        by="account",
+        categories=sorted(
+            far_core.EXPENSE_CATEGORY_BY_REDUCED_CATEGORY[far_core.ReducedCategory.fun]
+        ),
+    ).rename(columns=str)
+    colours = [account.colour for account in far_core.Accounts]
     return px.line(
         df,
         x=df.index,
@@ -425,115 +341,77 @@ def discretionary_spending_review_graph_monthly(date_str: str):
 
 
 @app.callback(
-    Output("discretionary_spending_review_graph_annual", "figure"),
-    Input("report_date_picker_annual", "value"),
+    Output("discretionary_spending_review_graph_monthly", "figure"),
+    [
+        Input("report_date_picker_monthly", "value"),
+        Input("ledger_version", "data"),
+    ],
 )
+def discretionary_spending_review_graph_monthly(date_str: str, _version=None):
+    end_date = get_date_from_date_str(date_str)
+    if not end_date:
+        return {"data": []}
+    return get_discretionary_spending_review_figure(get_months(end_date, 13))
+
+
 def discretionary_spending_review_graph_annual(date_str: str):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return {"data": []}
-    months = []
-    account_counters = []
-    for month_delta in range(-(12 * 3) - 1, 0):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        months.append(month_slice_start)
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        account_counter = collections.Counter()
-        for exp_record in exp_records:
-            if exp_record.category.reduced_category is far_core.ReducedCategory.fun:
-                account_counter[exp_record.account] += exp_record.amount
-        account_counters.append(account_counter)
-    df = pd.DataFrame(index=months)
-    colours = []
-    for account in far_core.Accounts:
-        df[str(account)] = [float(cntr[account]) for cntr in account_counters]
-        colours.append(account.colour)
-    return px.line(
-        df,
-        x=df.index,
-        y=df.columns,
-        title="Discretionary Spending Review",
-        color_discrete_sequence=colours,
-        labels={"index": "Month", "value": "Spending (USD)", "variable": "Account"},
-    )
+    return get_discretionary_spending_review_figure(get_months(end_date, (12 * 3) + 1))
 
 
-def get_discretionary_rate(exp_records: list) -> decimal.Decimal:
+def get_spending(reduced_category_totals):
     """
-    :param List[far_core.db.ExpenseRecord] exp_records: window of expenses
-    :return: the discretionary rate over the window, which is defined as
-        (discretionary expenses / total non-asset & non-misc spending).
+    :param pd.DataFrame reduced_category_totals: expense totals by reduced
+        category, see apps.get_monthly_totals
+    :return: pd.Series of the spending, i.e. non-asset & non-misc expenses
     """
-    total_expense = decimal.Decimal(0)
-    total_discretionary = decimal.Decimal(0)
-    for exp_record in exp_records:
-        if exp_record.category.reduced_category in (
+    return reduced_category_totals[
+        [
             far_core.ReducedCategory.fun,
             far_core.ReducedCategory.mandatory,
             far_core.ReducedCategory.debt,
-        ):
-            total_expense += exp_record.amount
-        if exp_record.category.reduced_category is far_core.ReducedCategory.fun:
-            total_discretionary += exp_record.amount
-    return (
-        total_discretionary / total_expense if total_expense else total_expense
-    )  # avoid zero division
+        ]
+    ].sum(axis=1)
 
 
-def get_savings_rate(exp_records: list, inc_records: list) -> decimal.Decimal:
+def get_discretionary_rate(reduced_category_totals):
     """
-    :param List[far_core.db.ExpenseRecord] exp_records: window of expenses
-    :param List[far_core.db.IncomeRecord] inc_records: window of incomes
-    :return: the savings rate over the window, which is defined as:
-        (income - expenses) / income.
+    :param pd.DataFrame reduced_category_totals: expense totals by reduced
+        category of each window, see apps.get_monthly_totals
+    :return: pd.Series of the discretionary rate of each window, which is
+        defined as (discretionary expenses / total non-asset & non-misc
+        spending).
     """
-    total_expense = decimal.Decimal(0)
-    total_income = far_core.sum_all_records(inc_records)
-    for exp_record in exp_records:
-        if exp_record.category.reduced_category in (
-            far_core.ReducedCategory.fun,
-            far_core.ReducedCategory.mandatory,
-            far_core.ReducedCategory.debt,
-        ):
-            total_expense += exp_record.amount
-    return (
-        (total_income - total_expense) / total_income
-        if total_income
-        else total_income  # avoid zero division error
-    )
+    spending = get_spending(reduced_category_totals)
+    discretionary = reduced_category_totals[far_core.ReducedCategory.fun]
+    # avoid zero division
+    return (discretionary / spending.where(spending != 0)).fillna(0.0)
 
 
-@app.callback(
-    Output("kpi_graph_monthly", "figure"),
-    Input("report_date_picker_monthly", "value"),
-)
-def kpi_graph_monthly(date_str: str):
-    end_date = get_date_from_date_str(date_str)
-    if not end_date:
-        return {"data": []}
-    months = []
-    savings_rates = []
-    discretionary_rates = []
-    for month_delta in range(-13, 0):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        months.append(month_slice_start)
-        inc_records = apps.get_filtered_income_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        discretionary_rates.append(get_discretionary_rate(exp_records))
-        savings_rates.append(
-            get_savings_rate(exp_records=exp_records, inc_records=inc_records)
-        )
-    df = pd.DataFrame(index=months)
-    df["Savings Rate"] = savings_rates
-    df["Discretionary Rate"] = discretionary_rates
+def get_savings_rate(reduced_category_totals, incomes):
+    """
+    :param pd.DataFrame reduced_category_totals: expense totals by reduced
+        category of each window, see apps.get_monthly_totals
+    :param pd.Series incomes: income totals of each window
+    :return: pd.Series of the savings rate of each window, which is defined
+        as: (income - expenses) / income.
+    """
+    spending = get_spending(reduced_category_totals)
+    # avoid zero division error
+    return ((incomes - spending) / incomes.where(incomes != 0)).fillna(0.0)
+
+
+def get_kpi_figure(months: range):
+    """:return: figure of the savings and discretionary rates of each month"""
+    reduced_category_totals = apps.get_monthly_totals(
+        "expense", months, by="reduced_category"
+    )
+    incomes = apps.get_monthly_totals("income", months)["amount"]
+    df = pd.DataFrame(index=incomes.index)
+    df["Savings Rate"] = get_savings_rate(reduced_category_totals, incomes)
+    df["Discretionary Rate"] = get_discretionary_rate(reduced_category_totals)
     colours = ["green", "red"]
     return px.line(
         df,
@@ -546,53 +424,69 @@ def kpi_graph_monthly(date_str: str):
 
 
 @app.callback(
-    Output("kpi_graph_annual", "figure"),
-    Input("report_date_picker_annual", "value"),
+    Output("kpi_graph_monthly", "figure"),
+    [
+        Input("report_date_picker_monthly", "value"),
+        Input("ledger_version", "data"),
+    ],
 )
+def kpi_graph_monthly(date_str: str, _version=None):
+    end_date = get_date_from_date_str(date_str)
+    if not end_date:
+        return {"data": []}
+    return get_kpi_figure(get_months(end_date, 13))
+
+
 def kpi_graph_annual(date_str: str):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return {"data": []}
-    months = []
-    savings_rates = []
-    discretionary_rates = []
-    for month_delta in range(-(12 * 3) - 1, 0):
-        month_slice_start = far_core.month_delta(end_date, month_delta)
-        month_slice_end = far_core.month_delta(end_date, month_delta + 1)
-        months.append(month_slice_start)
-        inc_records = apps.get_filtered_income_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        exp_records = apps.get_filtered_expense_records(
-            end_date=month_slice_end, start_date=month_slice_start
-        )
-        discretionary_rates.append(get_discretionary_rate(exp_records))
-        savings_rates.append(
-            get_savings_rate(exp_records=exp_records, inc_records=inc_records)
-        )
-    df = pd.DataFrame(index=months)
-    df["Savings Rate"] = savings_rates
-    df["Discretionary Rate"] = discretionary_rates
-    colours = ["green", "red"]
-    return px.line(
-        df,
-        x=df.index,
-        y=df.columns,
-        title="Key Performance Indicators",
-        color_discrete_sequence=colours,
-        labels={"index": "Month", "value": "", "variable": "KPI"},
+    return get_kpi_figure(get_months(end_date, (12 * 3) + 1))
+
+
+@apps.background_callback(
+    "annual_report",
+    outputs=[
+        Output("categorical_expense_table_annual", "children"),
+        Output("cash_flow_review_graph_annual", "figure"),
+        Output("discretionary_spending_review_graph_annual", "figure"),
+        Output("kpi_graph_annual", "figure"),
+    ],
+    inputs=[
+        Input("report_date_picker_annual", "value"),
+        Input("ledger_version", "data"),
+    ],
+)
+def annual_report(date_str: str, _version=None) -> list:
+    """
+    Runs every panel of the annual report as one background job, as each
+    panel reads the full 37 months of records.
+    """
+    panels = (
+        categorical_review_table_annual,
+        cash_flow_review_graph_annual,
+        discretionary_spending_review_graph_annual,
+        kpi_graph_annual,
     )
+    outputs = []
+    for i, panel in enumerate(panels):
+        far_core.jobs.set_progress(i / len(panels))
+        outputs.append(panel(date_str))
+    return outputs
 
 
 @app.callback(
     Output("expense_breakdown_monthly_div", "children"),
-    Input("report_date_picker_monthly", "value"),
+    [
+        Input("report_date_picker_monthly", "value"),
+        Input("ledger_version", "data"),
+    ],
 )
-def load_expenses(date_str: str):
+def load_expenses(date_str: str, _version=None):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return ["Loading table..."]
-    start_date = far_core.month_delta(end_date, -1)
+    start_date = far_core.calendar.month_from_key(get_months(end_date, 1)[0])
     df = apps.dataframe_from_expense_records(
         apps.get_filtered_expense_records(
             end_date=end_date,
@@ -613,13 +507,16 @@ def load_expenses(date_str: str):
 
 @app.callback(
     Output("income_breakdown_monthly_div", "children"),
-    Input("report_date_picker_monthly", "value"),
+    [
+        Input("report_date_picker_monthly", "value"),
+        Input("ledger_version", "data"),
+    ],
 )
-def load_incomes(date_str: str):
+def load_incomes(date_str: str, _version=None):
     end_date = get_date_from_date_str(date_str)
     if not end_date:
         return ["Loading table..."]
-    start_date = far_core.month_delta(end_date, -1)
+    start_date = far_core.calendar.month_from_key(get_months(end_date, 1)[0])
     df = apps.dataframe_from_income_records(
         apps.get_filtered_income_records(
             end_date=end_date,
@@ -0,0 +1,125 @@
+/*
+ * Clientside callbacks of the input page, see apps/input.py
+ */
+
+/*
+ * Mirrors far_core.date_from_string, accepting "2021-01-30" or "1/30/2021".
+ * Returns null for unrecognised or impossible dates.
+ */
+function farDateFromString(dateStr) {
+    let match = /^(\d{4})-(\d{1,2})-(\d{1,2})$/.exec(dateStr);
+    let year, month, day;
+    if (match) {
+        [year, month, day] = [match[1], match[2], match[3]].map(Number);
+    } else {
+        match = /^(\d{1,2})\/(\d{1,2})\/(\d{4})$/.exec(dateStr);
+        if (!match) {
+            return null;
+        }
+        [month, day, year] = [match[1], match[2], match[3]].map(Number);
+    }
+    const date = new Date(year, month - 1, day);
+    if (date.getFullYear() !== year || date.getMonth() !== month - 1
+            || date.getDate() !== day) {
+        return null;
+    }
+    return date;
+}
+
+/*
+ * Mirrors validate_expense_input and validate_income_input of apps/input.py,
+ * which stay authoritative. Returns an error message, or null if valid.
+ */
+function farValidateRow(account, row, known) {
+    if (!account || !row.amount || !row.category || !row.date) {
+        return "Missing required field in input";
+    }
+    if (known.accounts.indexOf(account) === -1) {
+        return `Unknown account ${account}`;
+    }
+    if (row.amount <= 0.0) {
+        return "Amount cannot be negative";
+    }
+    if (known.categories[row.input_type].indexOf(row.category) === -1) {
+        return `Unknown ${row.input_type} category ${row.category}`;
+    }
+    const date = farDateFromString(row.date);
+    if (date === null) {
+        return `Unrecognised date string: '${row.date}'`;
+    }
+    const tomorrow = new Date();
+    tomorrow.setHours(0, 0, 0, 0);
+    tomorrow.setDate(tomorrow.getDate() + 1);
+    if (date > tomorrow) {
+        return "Dates cannot be set in the future!";
+    }
+    return null;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    input: {
+        /*
+         * Gathers the non-empty rows of the input grids into the submission
+         * sent to the server, unless a row fails validation, in which case
+         * the error is shown without a round trip. Each field's values
+         * arrive in the same row order as the ids of the date fields.
+         */
+        collect: function(
+            n_clicks, account, dates, amounts, categories, notes, ids, known
+        ) {
+            const no_update = window.dash_clientside.no_update;
+            if (!n_clicks) {
+                return [no_update, no_update, no_update];
+            }
+            const rows = [];
+            for (let i = 0; i < ids.length; i++) {
+                // Same rule as validate_expense_input for an empty row
+                if (!dates[i] && !amounts[i] && !categories[i] && !notes[i]) {
+                    continue;
+                }
+                const row = {
+                    input_type: ids[i].input_type,
+                    index: ids[i].index,
+                    date: dates[i] || null,
+                    amount: amounts[i] === undefined ? null : amounts[i],
+                    category: categories[i] || null,
+                    note: notes[i] || null,
+                };
+                const error = farValidateRow(account, row, known);
+                if (error !== null) {
+                    return [
+                        no_update,
+                        true,
+                        `${row.input_type} row ${row.index + 1}: ${error}`,
+                    ];
+                }
+                rows.push(row);
+            }
+            return [
+                {account: account || null, rows: rows, submitted: n_clicks},
+                false,
+                no_update,
+            ];
+        },
+
+        /*
+         * Blanks the grids after a successful submit, and the account too
+         * on Clear, without a round trip to the server.
+         */
+        clear: function(clear_clicks, reset, ids) {
+            const triggered = window.dash_clientside.callback_context.triggered
+                .map(t => t.prop_id);
+            let account;
+            if (triggered.indexOf("clear_input_button.n_clicks") !== -1
+                    && clear_clicks) {
+                account = "";
+            } else if (triggered.indexOf("input_reset.data") !== -1 && reset) {
+                account = window.dash_clientside.no_update;
+            } else {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            const blanks = ids.map(() => "");
+            return [account, blanks, blanks, blanks, blanks];
+        },
+    },
+});
@@ -0,0 +1,5 @@
+#!/usr/bin/python3
+"""
+Benchmarks of the Finance and Reporting App, run from the repository root
+with e.g. `python3 -m benchmarks.startup`
+"""
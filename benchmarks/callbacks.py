@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+"""
+Callback benchmark, which times every main page, report, forecast and
+projection callback against synthetic ledgers of 10k, 100k and 1M expense
+records, and fails if any callback got slower than its stored baseline by
+more than the regression threshold, or has no baseline.
+
+Record baselines on a quiet machine with
+    python3 -m benchmarks.callbacks --update-baselines
+then compare later changes against them with
+    python3 -m benchmarks.callbacks
+"""
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import benchmarks.synthetic
+import far_core
+
+
+# Expense records per ledger size, spread over LEDGER_YEARS
+SIZES = {"10k": 10000, "100k": 100000, "1M": 1000000}
+LEDGER_YEARS = 4
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "callbacks_baselines.json")
+# Changes smaller than this are noise, however large relative to the baseline
+MIN_REGRESSION_SECONDS = 0.01
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Stand for the month reported on, and the current month, in the arguments
+# of CALLBACKS
+_MONTH = "<month>"
+_CURRENT_MONTH = "<current month>"
+# Benchmarked callbacks, as "module.function", and their arguments
+CALLBACKS = (
+    ("apps.main.main_page", ("/",)),
+    ("apps.expenses.load_expenses", ("/expenses",)),
+    ("apps.incomes.load_incomes", ("/incomes",)),
+    ("apps.report.executive_summary_monthly", (_MONTH,)),
+    ("apps.report.categorical_review_table_monthly", (_MONTH,)),
+    ("apps.report.cash_flow_review_graph_monthly", (_MONTH,)),
+    ("apps.report.discretionary_spending_review_graph_monthly", (_MONTH,)),
+    ("apps.report.kpi_graph_monthly", (_MONTH,)),
+    ("apps.report.load_expenses", (_MONTH,)),
+    ("apps.report.load_incomes", (_MONTH,)),
+    ("apps.report.categorical_review_table_annual", (_MONTH,)),
+    ("apps.report.cash_flow_review_graph_annual", (_MONTH,)),
+    ("apps.report.discretionary_spending_review_graph_annual", (_MONTH,)),
+    ("apps.report.kpi_graph_annual", (_MONTH,)),
+    (
+        "apps.forecast.categorical_forecast_graph",
+        (_CURRENT_MONTH, str(far_core.ExpenseCategory.groceries), 12),
+    ),
+    ("apps.projection.cashflow_projection", (_CURRENT_MONTH, 0)),
+)
+
+
+def get_callback_names() -> list:
+    """:return: list of the names of CALLBACKS, without importing the app"""
+    return [name for name, _ in CALLBACKS]
+
+
+def get_callbacks(month: str = None) -> list:
+    """
+    Imports the app, so only call within a process using the ledger.
+
+    :param str month: month reported on, e.g. "2021-05", defaults to the
+        last full month of the ledger
+    :return: list of (name, function, args) of each of CALLBACKS, with
+        functions unwrapped from their Dash callback decorator
+    """
+    import index  # noqa: F401, registers every page's callbacks
+
+    current_month = far_core.get_current_month().strftime("%Y-%m")
+    if month is None:
+        month = far_core.month_delta(far_core.get_current_month(), -1).strftime(
+            "%Y-%m"
+        )
+    values = {_MONTH: month, _CURRENT_MONTH: current_month}
+    callbacks = []
+    for name, args in CALLBACKS:
+        module_name, func_name = name.rsplit(".", 1)
+        func = getattr(importlib.import_module(module_name), func_name)
+        callbacks.append(
+            (
+                name,
+                getattr(func, "__wrapped__", func),
+                tuple(values.get(arg, arg) for arg in args),
+            )
+        )
+    return callbacks
+
+
+def get_ledger_path(data_dir: str, size: str) -> str:
+    """
+    :return: path of the synthetic ledger of size, generated if missing.
+        Ledgers end on the current month, so reports always cover them.
+    """
+    end_month = far_core.get_current_month()
+    path = os.path.join(data_dir, f"ledger_{size}_{end_month:%Y-%m}.db")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"Generating the {size} ledger at {path}", file=sys.stderr)
+        benchmarks.synthetic.generate_ledger(
+            path, LEDGER_YEARS, SIZES[size] / (LEDGER_YEARS * 365.25)
+        )
+    return path
+
+
+def run_in_subprocess(module: str, ledger_path: str, extra_args: list) -> dict:
+    """
+    Runs `python3 -m module --worker ledger_path extra_args...` against the
+    ledger, with caching disabled so every call reads the database.
+
+    :return: the JSON printed on the last line of the worker's output
+    """
+    env = dict(
+        os.environ,
+        FAR_DATABASE_URI=f"sqlite:///{os.path.abspath(ledger_path)}",
+        FAR_CACHE_TYPE="NullCache",
+    )
+    output = subprocess.run(
+        # Library warnings, e.g. of statsmodels' fits, would drown the results
+        [sys.executable, "-W", "ignore", "-m", module, "--worker", ledger_path]
+        + extra_args,
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=_ROOT,
+        env=env,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def _worker(repeat: int) -> dict:
+    from app import server
+    import far_core.db
+    import far_core.querywatch
+    import far_core.snapshot
+
+    results = {}
+    with server.app_context():
+        # As the app's entrypoints do, e.g. for ledgers of earlier versions
+        far_core.db.init_tables()
+        for name, func, args in get_callbacks():
+            # The first call also imports the callback's lazy dependencies
+            with far_core.querywatch.watch(
+                name, threshold=sys.maxsize, raise_on_repeat=False
+            ) as watch, far_core.snapshot.snapshot():
+                func(*args)
+            runs = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                # Each call reads in one snapshot, as within a request
+                with far_core.snapshot.snapshot():
+                    func(*args)
+                runs.append(time.perf_counter() - start)
+            results[name] = {
+                "seconds": statistics.median(runs),
+                "queries": sum(watch.counts.values()),
+            }
+    return results
+
+
+def find_missing(results: dict, expected: dict) -> list:
+    """
+    :param dict expected: baselines or budgets, by size then callback name
+    :return: list of (size, callback) of each result with nothing expected
+    """
+    return [
+        (size, name)
+        for size, callbacks in results.items()
+        for name in callbacks
+        if name not in expected.get(size, {})
+    ]
+
+
+def find_regressions(results: dict, baselines: dict, threshold: float) -> list:
+    """
+    :return: list of (size, callback, seconds, baseline seconds) of each
+        callback slower than its baseline by more than threshold
+    """
+    regressions = []
+    for size, callbacks in results.items():
+        for name, result in callbacks.items():
+            baseline = baselines.get(size, {}).get(name)
+            if baseline is None:
+                continue
+            if (
+                result["seconds"] > baseline["seconds"] * (1 + threshold)
+                and result["seconds"] - baseline["seconds"] > MIN_REGRESSION_SECONDS
+            ):
+                regressions.append((size, name, result["seconds"], baseline["seconds"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", choices=SIZES, default=list(SIZES), help="ledger sizes"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="calls per callback, median is kept"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="slowdown relative to the baseline which fails the run",
+    )
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument(
+        "--update-baselines",
+        action="store_true",
+        help="record the results as the new baselines instead of comparing",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default="/tmp/far_benchmarks",
+        help="where synthetic ledgers are kept between runs",
+    )
+    parser.add_argument("--output", help="path of a JSON file to record results in")
+    parser.add_argument("--worker", metavar="LEDGER", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(_worker(args.repeat)))
+        return
+
+    results = {}
+    for size in args.sizes:
+        ledger_path = get_ledger_path(args.data_dir, size)
+        results[size] = run_in_subprocess(
+            "benchmarks.callbacks", ledger_path, ["--repeat", str(args.repeat)]
+        )
+        print(f"\n{size} expense records")
+        print(f"{'callback':<60} {'seconds':>8} {'queries':>8}")
+        for name, result in results[size].items():
+            print(f"{name:<60} {result['seconds']:>8.3f} {result['queries']:>8}")
+    if args.output:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if args.update_baselines:
+        for size, callbacks in results.items():
+            baselines[size] = callbacks
+        with open(args.baselines, "wt") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"\nUpdated the baselines in {args.baselines}")
+        return
+    # Callbacks without a baseline would otherwise pass unchecked
+    missing = find_missing(results, baselines)
+    for size, name in missing:
+        print(f"NO BASELINE {size} {name}")
+    if missing:
+        print(f"Record baselines in {args.baselines} with --update-baselines")
+    regressions = find_regressions(results, baselines, args.threshold)
+    for size, name, seconds, baseline_seconds in regressions:
+        print(
+            f"REGRESSION {size} {name}: {seconds:.3f}s"
+            f" against a baseline of {baseline_seconds:.3f}s"
+        )
+    if missing or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+#!/usr/bin/python3
+"""
+Load test, which replays the /_dash-update-component requests a browser
+makes for common actions against a running server, from many simulated
+users at once, and reports latency percentiles and throughput per request.
+
+Against a server which is already running, e.g. the docker container:
+    python3 -m benchmarks.loadtest --url http://localhost:8080 --users 8
+The input scenario adds records to the ledger, so rather run it against a
+server started on a copy of a synthetic ledger with
+    python3 -m benchmarks.loadtest --spawn 100k --users 8
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import benchmarks.callbacks
+import far_core
+
+
+SCENARIOS = ("monthly_report", "forecast", "input")
+# How long a forecast job may take before counting as failed
+JOB_TIMEOUT_SECONDS = 120
+# Browsers poll background jobs at the interval of apps.get_background_components
+JOB_POLL_SECONDS = 0.5
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DashClient:
+    """Makes callback requests the way the Dash renderer does"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        with urllib.request.urlopen(f"{self.url}/_dash-dependencies") as response:
+            self.dependencies = json.load(response)
+
+    @staticmethod
+    def _split_output(output: str) -> list:
+        """:return: list of (id, property) of a callback's output string"""
+        if output.startswith(".."):
+            outputs = output[2:-2].split("...")
+        else:
+            outputs = [output]
+        return [tuple(o.rsplit(".", 1)) for o in outputs]
+
+    def find(self, output: str) -> dict:
+        """:return: the dependency of the callback with output "id.property\""""
+        for dependency in self.dependencies:
+            # Clientside callbacks run in the browser, never on the server
+            if dependency.get("clientside_function"):
+                continue
+            if tuple(output.rsplit(".", 1)) in self._split_output(dependency["output"]):
+                return dependency
+        raise KeyError(f"No callback outputs {output}")
+
+    def call(self, output: str, values: dict, changed: list) -> dict:
+        """
+        :param str output: any output of the callback, as "id.property"
+        :param dict values: values of the callback's inputs and states by
+            "id.property", missing ones are None
+        :param list changed: "id.property" of the inputs which triggered it
+        :return: the outputs by id and property, empty if the update was
+            prevented
+        """
+        dependency = self.find(output)
+        outputs = [
+            {"id": output_id, "property": prop}
+            for output_id, prop in self._split_output(dependency["output"])
+        ]
+        payload = {
+            "output": dependency["output"],
+            "outputs": outputs if dependency["output"].startswith("..") else outputs[0],
+            "inputs": [
+                dict(dep, value=values.get(f"{dep['id']}.{dep['property']}"))
+                for dep in dependency["inputs"]
+            ],
+            "changedPropIds": changed,
+            "state": [
+                dict(dep, value=values.get(f"{dep['id']}.{dep['property']}"))
+                for dep in dependency["state"]
+            ],
+        }
+        request = urllib.request.Request(
+            f"{self.url}/_dash-update-component",
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=JOB_TIMEOUT_SECONDS) as response:
+            body = response.read()
+        return json.loads(body)["response"] if body else {}
+
+
+class Results:
+    """Latencies and errors per request name, shared by all users"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def record(self, name: str, seconds: float = None):
+        with self._lock:
+            if seconds is None:
+                self.errors[name] += 1
+            else:
+                self.latencies[name].append(seconds)
+
+    def timed(self, name: str, func, *args):
+        """:return: func(*args), recording its latency or its failure"""
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except (urllib.error.URLError, OSError, ValueError, KeyError):
+            self.record(name)
+            raise
+        self.record(name, time.perf_counter() - start)
+        return result
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(int(round(percent / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def monthly_report(client: DashClient, results: Results, rng: random.Random):
+    """Opens the monthly report on one of the last 12 months"""
+    results.timed(
+        "display_page /report/monthly",
+        client.call,
+        "page-content.children",
+        {"url.pathname": "/report/monthly"},
+        ["url.pathname"],
+    )
+    month = far_core.month_delta(far_core.get_current_month(), -rng.randint(1, 12))
+    values = {"report_date_picker_monthly.value": month.strftime("%Y-%m")}
+    for output in (
+        "executive_summary_header_monthly.children",
+        "categorical_expense_table_monthly.children",
+        "cash_flow_review_graph_monthly.figure",
+        "discretionary_spending_review_graph_monthly.figure",
+        "kpi_graph_monthly.figure",
+        "expense_breakdown_monthly_div.children",
+        "income_breakdown_monthly_div.children",
+    ):
+        results.timed(
+            output.split(".")[0],
+            client.call,
+            output,
+            values,
+            ["report_date_picker_monthly.value"],
+        )
+
+
+def forecast(client: DashClient, results: Results, rng: random.Random):
+    """Switches the forecast to a random category and waits for its job"""
+    values = {
+        "report_date_picker_forecast.value": far_core.get_current_month().strftime(
+            "%Y-%m"
+        ),
+        "report_category_picker_forecast.value": str(
+            rng.choice(list(far_core.ExpenseCategory))
+        ),
+        "report_horizon_forecast.value": 12,
+    }
+    start = time.perf_counter()
+    response = results.timed(
+        "categorical_forecast submit_job",
+        client.call,
+        "categorical_forecast_job.data",
+        values,
+        ["report_category_picker_forecast.value"],
+    )
+    job_id = response["categorical_forecast_job"]["data"]
+    n_intervals = 0
+    while time.perf_counter() - start < JOB_TIMEOUT_SECONDS:
+        response = results.timed(
+            "categorical_forecast poll_job",
+            client.call,
+            "categorical_forecast_job_interval.disabled",
+            {
+                "categorical_forecast_job.data": job_id,
+                "categorical_forecast_job_interval.n_intervals": n_intervals,
+            },
+            ["categorical_forecast_job_interval.n_intervals"],
+        )
+        if response["categorical_forecast_job_interval"]["disabled"]:
+            # Failed jobs also fill the progress bar, but open the error alert,
+            # and are counted as errors of the job rather than its latencies
+            failed = response["categorical_forecast_job_error"]["is_open"]
+            done = response["categorical_forecast_job_progress"]["value"] == 100
+            if done and not failed:
+                results.record(
+                    "categorical_forecast job (end to end)",
+                    time.perf_counter() - start,
+                )
+                return
+            break
+        n_intervals += 1
+        time.sleep(JOB_POLL_SECONDS)
+    results.record("categorical_forecast job (end to end)")
+
+
+def input_form(client: DashClient, results: Results, rng: random.Random):
+    """Submits an expense and an income on the input page"""
+    results.timed(
+        "display_page /input",
+        client.call,
+        "page-content.children",
+        {"url.pathname": "/input"},
+        ["url.pathname"],
+    )
+    today = datetime.date.today().isoformat()
+    # As gathered in the browser by assets/input.js
+    submission = {
+        "account": str(rng.choice(list(far_core.Accounts))),
+        "rows": [
+            {
+                "input_type": "Expense",
+                "index": 0,
+                "date": today,
+                "amount": round(rng.uniform(1, 100), 2),
+                "category": str(rng.choice(list(far_core.ExpenseCategory))),
+                "note": "load test",
+            },
+            {
+                "input_type": "Income",
+                "index": 0,
+                "date": today,
+                "amount": round(rng.uniform(100, 1000), 2),
+                "category": str(rng.choice(list(far_core.IncomeCategory))),
+                "note": "load test",
+            },
+        ],
+        "submitted": 1,
+    }
+    response = results.timed(
+        "handle_inputs submit",
+        client.call,
+        "input_alert_auto.is_open",
+        {"input_submission.data": submission},
+        ["input_submission.data"],
+    )
+    if response["input_alert_auto"]["is_open"]:
+        raise ValueError("The input form rejected the submitted rows")
+
+
+_SCENARIO_FUNCTIONS = {
+    "monthly_report": monthly_report,
+    "forecast": forecast,
+    "input": input_form,
+}
+
+
+def run_user(
+    client: DashClient,
+    results: Results,
+    scenarios: list,
+    deadline: float,
+    seed: int,
+):
+    """Runs random scenarios back to back until the deadline"""
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        scenario = rng.choice(scenarios)
+        try:
+            _SCENARIO_FUNCTIONS[scenario](client, results, rng)
+        except (urllib.error.URLError, OSError, ValueError, KeyError):
+            # Already recorded as an error, start over as a user would
+            results.record(f"{scenario} (scenario)")
+
+
+def run_load(url: str, scenarios: list, users: int, duration: float) -> dict:
+    """
+    :return: dict with "elapsed" seconds and the "results" of every user
+    """
+    client = DashClient(url)
+    results = Results()
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [
+        threading.Thread(
+            target=run_user,
+            args=(client, results, scenarios, deadline, seed),
+            name=f"far_loadtest_user_{seed}",
+        )
+        for seed in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"elapsed": time.perf_counter() - start, "results": results}
+
+
+def summarise(elapsed: float, results: Results) -> dict:
+    """:return: dict of statistics by request name"""
+    summary = {}
+    for name in sorted(set(results.latencies) | set(results.errors)):
+        latencies = sorted(results.latencies[name])
+        summary[name] = {
+            "requests": len(latencies),
+            "errors": results.errors[name],
+            "per_second": len(latencies) / elapsed,
+        }
+        if latencies:
+            summary[name].update(
+                {
+                    f"p{percent}": percentile(latencies, percent)
+                    for percent in (50, 95, 99)
+                }
+            )
+    return summary
+
+
+def spawn_server(size: str, data_dir: str, port: int, workdir: str):
+    """
+    Starts the production server on a copy of the synthetic ledger of size,
+    with its own cache and job queue.
+
+    :return: the subprocess.Popen of gunicorn, once it is serving
+    """
+    ledger_path = os.path.join(workdir, "ledger.db")
+    shutil.copyfile(benchmarks.callbacks.get_ledger_path(data_dir, size), ledger_path)
+    env = dict(
+        os.environ,
+        FAR_DATABASE_URI=f"sqlite:///{ledger_path}",
+        FAR_CACHE_DIR=os.path.join(workdir, "cache"),
+        FAR_JOB_QUEUE_PATH=os.path.join(workdir, "jobs.db"),
+        PYTHONWARNINGS="ignore",
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--config",
+            "gunicorn.conf.py",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "wsgi:server",
+        ],
+        cwd=_ROOT,
+        env=env,
+    )
+    for _ in range(120):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_dash-dependencies")
+            return server
+        except (urllib.error.URLError, OSError):
+            if server.poll() is not None:
+                raise RuntimeError("The server exited while starting")
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("The server did not start serving within a minute")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument(
+        "--spawn",
+        choices=benchmarks.callbacks.SIZES,
+        help="start a server on a copy of the synthetic ledger of this size",
+    )
+    parser.add_argument("--port", type=int, default=8181, help="port of --spawn")
+    parser.add_argument(
+        "--data-dir",
+        default="/tmp/far_benchmarks",
+        help="where synthetic ledgers are kept between runs",
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument("--users", type=int, default=4, help="concurrent users")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--output", help="path of a JSON file to record results in")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="far_loadtest_") as workdir:
+        server = None
+        url = args.url
+        if args.spawn:
+            server = spawn_server(args.spawn, args.data_dir, args.port, workdir)
+            url = f"http://127.0.0.1:{args.port}"
+        try:
+            run = run_load(url, args.scenarios, args.users, args.duration)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    summary = summarise(run["elapsed"], run["results"])
+    total = sum(stats["requests"] for stats in summary.values())
+    print(
+        f"\n{args.users} users for {run['elapsed']:.1f}s:"
+        f" {total} requests, {total / run['elapsed']:.1f} requests/s"
+    )
+    print(
+        f"{'request':<46} {'count':>6} {'errors':>6} {'req/s':>7}"
+        f" {'p50':>7} {'p95':>7} {'p99':>7}"
+    )
+    for name, stats in summary.items():
+        latencies = "".join(
+            f" {stats[p]:>7.3f}" if p in stats else f" {'-':>7}"
+            for p in ("p50", "p95", "p99")
+        )
+        print(
+            f"{name:<46} {stats['requests']:>6} {stats['errors']:>6}"
+            f" {stats['per_second']:>7.2f}{latencies}"
+        )
+    if args.output:
+        with open(args.output, "wt") as f:
+            json.dump(
+                {"users": args.users, "elapsed": run["elapsed"], "requests": summary},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
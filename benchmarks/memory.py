@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+"""
+Memory benchmark, which measures the peak RSS and the peak of Python
+allocations traced by tracemalloc of every callback of
+benchmarks.callbacks, against synthetic ledgers of each size, and fails if
+any callback exceeds its stored budget, or has no budget.
+
+Each callback runs in a fresh process, so its peak RSS is that of a server
+worker which has only served that callback. Record budgets, with headroom
+over the measured peaks, with
+    python3 -m benchmarks.memory --update-budgets
+then check later changes against them with
+    python3 -m benchmarks.memory
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import resource
+import sys
+import tracemalloc
+
+import benchmarks.callbacks
+
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "memory_budgets.json")
+MEASUREMENTS = ("peak_rss_kib", "tracemalloc_peak_kib")
+
+
+def _current_rss_kib() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _import_lazy_modules():
+    """
+    Imports the dependencies the pages defer importing, so that they count
+    towards the starting RSS rather than the callback which first uses them
+    """
+    import apps
+
+    for module in list(sys.modules.values()):
+        if not getattr(module, "__name__", "").startswith("apps"):
+            continue
+        for value in list(vars(module).values()):
+            if isinstance(value, apps.LazyModule):
+                importlib.import_module(value.__name__)
+
+
+def _worker(callback: str) -> dict:
+    from app import server
+    import far_core.db
+
+    with server.app_context():
+        # As the app's entrypoints do, e.g. for ledgers of earlier versions
+        far_core.db.init_tables()
+        callbacks = {
+            name: (func, args)
+            for name, func, args in benchmarks.callbacks.get_callbacks()
+        }
+        func, args = callbacks[callback]
+        _import_lazy_modules()
+        gc.collect()
+        start_rss_kib = _current_rss_kib()
+        func(*args)
+        peak_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Traced separately, as tracing inflates both the time and the RSS
+        gc.collect()
+        tracemalloc.start()
+        func(*args)
+        _, tracemalloc_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "start_rss_kib": start_rss_kib,
+        "peak_rss_kib": peak_rss_kib,
+        "tracemalloc_peak_kib": tracemalloc_peak // 1024,
+    }
+
+
+def find_overruns(results: dict, budgets: dict) -> list:
+    """
+    :return: list of (size, callback, measurement, value, budget) of each
+        measurement over its budget
+    """
+    overruns = []
+    for size, callbacks in results.items():
+        for name, result in callbacks.items():
+            budget = budgets.get(size, {}).get(name, {})
+            for measurement in MEASUREMENTS:
+                if measurement in budget and result[measurement] > budget[measurement]:
+                    overruns.append(
+                        (
+                            size,
+                            name,
+                            measurement,
+                            result[measurement],
+                            budget[measurement],
+                        )
+                    )
+    return overruns
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        choices=benchmarks.callbacks.SIZES,
+        default=list(benchmarks.callbacks.SIZES),
+        help="ledger sizes",
+    )
+    parser.add_argument(
+        "--callbacks", nargs="+", help="names of the callbacks to measure, or all"
+    )
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument(
+        "--update-budgets",
+        action="store_true",
+        help="record the results plus headroom as the new budgets",
+    )
+    parser.add_argument(
+        "--headroom",
+        type=float,
+        default=0.2,
+        help="budgets recorded by --update-budgets over the measured peaks",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default="/tmp/far_benchmarks",
+        help="where synthetic ledgers are kept between runs",
+    )
+    parser.add_argument("--output", help="path of a JSON file to record results in")
+    parser.add_argument("--worker", metavar="LEDGER", help=argparse.SUPPRESS)
+    parser.add_argument("--callback", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(_worker(args.callback)))
+        return
+
+    # The app is only imported by the workers, against the synthetic ledgers
+    names = args.callbacks or benchmarks.callbacks.get_callback_names()
+    results = {}
+    for size in args.sizes:
+        ledger_path = benchmarks.callbacks.get_ledger_path(args.data_dir, size)
+        results[size] = {}
+        print(f"\n{size} expense records")
+        print(
+            f"{'callback':<60} {'start MiB':>9} {'peak MiB':>9}"
+            f" {'traced MiB':>10}"
+        )
+        for name in names:
+            result = benchmarks.callbacks.run_in_subprocess(
+                "benchmarks.memory", ledger_path, ["--callback", name]
+            )
+            results[size][name] = result
+            print(
+                f"{name:<60} {result['start_rss_kib'] / 1024:>9.1f}"
+                f" {result['peak_rss_kib'] / 1024:>9.1f}"
+                f" {result['tracemalloc_peak_kib'] / 1024:>10.1f}"
+            )
+        largest_peak = max(
+            result["peak_rss_kib"] for result in results[size].values()
+        )
+        print(f"Largest peak RSS of a worker: {largest_peak / 1024:.1f} MiB")
+    if args.output:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    budgets = {}
+    if os.path.exists(args.budgets):
+        with open(args.budgets) as f:
+            budgets = json.load(f)
+    if args.update_budgets:
+        for size, callbacks in results.items():
+            budgets[size] = {
+                name: {
+                    measurement: int(result[measurement] * (1 + args.headroom))
+                    for measurement in MEASUREMENTS
+                }
+                for name, result in callbacks.items()
+            }
+        with open(args.budgets, "wt") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+        print(f"\nUpdated the budgets in {args.budgets}")
+        return
+    # Callbacks without a budget would otherwise pass unchecked
+    missing = benchmarks.callbacks.find_missing(results, budgets)
+    for size, name in missing:
+        print(f"NO BUDGET {size} {name}")
+    if missing:
+        print(f"Record budgets in {args.budgets} with --update-budgets")
+    overruns = find_overruns(results, budgets)
+    for size, name, measurement, value, budget in overruns:
+        print(
+            f"OVER BUDGET {size} {name}: {measurement} of {value / 1024:.1f} MiB"
+            f" against a budget of {budget / 1024:.1f} MiB"
+        )
+    if missing or overruns:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
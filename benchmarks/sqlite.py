@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+"""
+SQLite benchmark, which compares the pragma profiles of far_core.engine on
+a copy of a synthetic ledger: a year's scan of expense records through the
+engine of flask_sqlalchemy, which connects for every session, and through
+the pool of read-only connections, and sequential commits through
+far_core.writer.
+
+    python3 -m benchmarks.sqlite --sizes 100k
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import benchmarks.callbacks
+
+
+SCAN_SQL = "SELECT * FROM expense_record WHERE date >= ?"
+
+
+def _time_scans(engine, start_date: datetime.date, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with engine.connect() as conn:
+            conn.exec_driver_sql(SCAN_SQL, (start_date,)).fetchall()
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def _worker(profile: str, repeat: int, writes: int) -> dict:
+    # Read by app.py, so set before the app is imported
+    os.environ["FAR_SQLITE_PROFILE"] = profile
+    from app import db, server
+    import far_core.db
+    import far_core.engine
+
+    with server.app_context():
+        start_date = far_core.month_delta(far_core.get_current_month(), -12)
+        # Switches the journal mode of the copy of the ledger
+        db.engine.connect().close()
+        results = {
+            "scan_fresh_connection_seconds": _time_scans(
+                db.engine, start_date, repeat
+            ),
+            "scan_read_pool_seconds": _time_scans(
+                far_core.engine.read_only_engine, start_date, repeat
+            ),
+        }
+        record = {
+            "date": start_date,
+            "amount": 1,
+            "category": far_core.ExpenseCategory.groceries,
+            "account": list(far_core.Accounts)[0],
+            "note": None,
+        }
+        start = time.perf_counter()
+        for _ in range(writes):
+            far_core.db.insert_records(expense_records=[record])
+        results["commits_per_second"] = writes / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        choices=benchmarks.callbacks.SIZES,
+        default=list(benchmarks.callbacks.SIZES),
+        help="ledger sizes",
+    )
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        default=["default", "tuned"],
+        help="profiles of far_core.engine to compare",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="scans per engine, median is kept"
+    )
+    parser.add_argument(
+        "--writes", type=int, default=200, help="sequential commits to time"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default="/tmp/far_benchmarks",
+        help="where synthetic ledgers are kept between runs",
+    )
+    parser.add_argument("--output", help="path of a JSON file to record results in")
+    parser.add_argument("--worker", metavar="LEDGER", help=argparse.SUPPRESS)
+    parser.add_argument("--profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(_worker(args.profile, args.repeat, args.writes)))
+        return
+
+    results = {}
+    for size in args.sizes:
+        ledger_path = benchmarks.callbacks.get_ledger_path(args.data_dir, size)
+        results[size] = {}
+        print(f"\n{size} expense records")
+        print(
+            f"{'profile':<10} {'fresh scan s':>12} {'pooled scan s':>13}"
+            f" {'commits/s':>10}"
+        )
+        for profile in args.profiles:
+            # Profiles change the journal mode of the database, and the
+            # commits its records, so each gets its own copy of the ledger
+            with tempfile.TemporaryDirectory() as workdir:
+                copy_path = os.path.join(workdir, os.path.basename(ledger_path))
+                shutil.copy(ledger_path, copy_path)
+                result = benchmarks.callbacks.run_in_subprocess(
+                    "benchmarks.sqlite",
+                    copy_path,
+                    [
+                        "--profile",
+                        profile,
+                        "--repeat",
+                        str(args.repeat),
+                        "--writes",
+                        str(args.writes),
+                    ],
+                )
+            results[size][profile] = result
+            print(
+                f"{profile:<10} {result['scan_fresh_connection_seconds']:>12.4f}"
+                f" {result['scan_read_pool_seconds']:>13.4f}"
+                f" {result['commits_per_second']:>10.0f}"
+            )
+    if args.output:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
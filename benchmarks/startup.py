@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+"""
+Startup benchmark, which records how long each module of the app takes to
+import in a fresh interpreter, along with the peak memory of the import.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+# Modules in the order they are imported at startup, ending with the
+# entrypoint which imports all of them
+MODULES = (
+    "app",
+    "far_core",
+    "far_core.db",
+    "apps",
+    "apps.main",
+    "apps.expenses",
+    "apps.incomes",
+    "apps.input",
+    "apps.report",
+    "apps.forecast",
+    "apps.projection",
+    "index",
+)
+
+_MEASURE_IMPORT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules_loaded": len(sys.modules),
+}}))
+"""
+
+
+def measure_import(module: str) -> dict:
+    """Imports module in a fresh interpreter, so nothing is already cached"""
+    output = subprocess.run(
+        [sys.executable, "-c", _MEASURE_IMPORT.format(module=module)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="imports per module, median is kept"
+    )
+    parser.add_argument("--output", help="path of a JSON file to record results in")
+    args = parser.parse_args()
+    results = {}
+    print(f"{'module':<20} {'seconds':>8} {'max rss MiB':>12} {'modules':>8}")
+    for module in MODULES:
+        runs = [measure_import(module) for _ in range(args.repeat)]
+        results[module] = {
+            "seconds": statistics.median(run["seconds"] for run in runs),
+            "max_rss_kib": statistics.median(run["max_rss_kib"] for run in runs),
+            "modules_loaded": runs[-1]["modules_loaded"],
+        }
+        print(
+            f"{module:<20} {results[module]['seconds']:>8.3f}"
+            f" {results[module]['max_rss_kib'] / 1024:>12.1f}"
+            f" {results[module]['modules_loaded']:>8}"
+        )
+    if args.output:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
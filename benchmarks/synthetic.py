@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+"""
+Deterministic generator of synthetic ledgers, which writes years of expense
+and income records across every category and account into a scratch SQLite
+file, e.g.
+    python3 -m benchmarks.synthetic /tmp/ledger.db --years 4 --per-day 70
+
+The same seed, years, transactions per day and end month always produce the
+same records.
+"""
+
+import argparse
+import datetime
+import os
+
+import numpy as np
+import sqlalchemy
+
+import far_core
+import far_core.db
+
+
+# Rows inserted per executemany, bounding the memory of large ledgers
+INSERT_CHUNK_ROWS = 50000
+# Income transactions per expense transaction
+INCOME_RATIO = 0.1
+
+
+def _generate_records(
+    rng, categories: list, start_date, days: int, count: int, amount_range: tuple
+) -> list:
+    """
+    :return: list of dicts, one per record, sorted by date
+    """
+    accounts = list(far_core.Accounts)
+    # Fixed per ledger so categories differ in frequency and typical amount
+    weights = rng.dirichlet(np.ones(len(categories)))
+    scales = rng.uniform(*amount_range, size=len(categories))
+    day_offsets = np.sort(rng.integers(0, days, size=count))
+    category_index = rng.choice(len(categories), size=count, p=weights)
+    account_index = rng.integers(0, len(accounts), size=count)
+    amounts = np.round(
+        rng.lognormal(mean=0.0, sigma=0.5, size=count) * scales[category_index], 2
+    )
+    dates = (np.datetime64(start_date) + day_offsets).astype(object)
+    return [
+        {
+            "date": date,
+            "amount": amount,
+            "category": categories[cat],
+            "account": accounts[acc],
+            "note": None,
+        }
+        for date, amount, cat, acc in zip(
+            dates, amounts.tolist(), category_index.tolist(), account_index.tolist()
+        )
+    ]
+
+
+def _insert(engine, table, records: list):
+    with engine.begin() as conn:
+        for i in range(0, len(records), INSERT_CHUNK_ROWS):
+            conn.execute(table.insert(), records[i : i + INSERT_CHUNK_ROWS])
+
+
+def generate_ledger(
+    path: str,
+    years: int,
+    transactions_per_day: float,
+    seed: int = 0,
+    end_date: datetime.date = None,
+) -> dict:
+    """
+    Writes a new synthetic ledger to path, replacing any file already there.
+
+    :param str path: path of the SQLite file
+    :param int years: years of records, ending on the month before end_date
+    :param float transactions_per_day: expense records per day, on average
+    :param int seed: seed of the random generator
+    :param datetime.date end_date: first month without records, defaults to
+        the current month so that reports on recent months have data
+    :return: dict with the number of "expense_record" and "income_record" rows
+    """
+    if end_date is None:
+        end_date = far_core.get_current_month()
+    start_date = far_core.month_delta(end_date, -12 * years)
+    days = (end_date - start_date).days
+    rng = np.random.default_rng(seed)
+    expense_records = _generate_records(
+        rng,
+        list(far_core.ExpenseCategory),
+        start_date,
+        days,
+        round(days * transactions_per_day),
+        (5.0, 200.0),
+    )
+    income_records = _generate_records(
+        rng,
+        list(far_core.IncomeCategory),
+        start_date,
+        days,
+        max(round(days * transactions_per_day * INCOME_RATIO), 1),
+        (600.0, 1800.0),
+    )
+    if os.path.exists(path):
+        os.remove(path)
+    engine = sqlalchemy.create_engine(f"sqlite:///{os.path.abspath(path)}")
+    try:
+        far_core.db.db.Model.metadata.create_all(engine)
+        _insert(engine, far_core.db.ExpenseRecord.__table__, expense_records)
+        _insert(engine, far_core.db.IncomeRecord.__table__, income_records)
+    finally:
+        engine.dispose()
+    return {
+        "expense_record": len(expense_records),
+        "income_record": len(income_records),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="path of the SQLite file to write")
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument(
+        "--per-day", type=float, default=10.0, help="expense records per day"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--end-month",
+        type=far_core.month_from_string,
+        help='first month without records, e.g. "2021-06", defaults to this month',
+    )
+    args = parser.parse_args()
+    counts = generate_ledger(
+        args.path, args.years, args.per_day, seed=args.seed, end_date=args.end_month
+    )
+    print(
+        f"Wrote {counts['expense_record']} expense and"
+        f" {counts['income_record']} income records to {args.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
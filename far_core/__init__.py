@@ -101,44 +101,44 @@ class ExpenseCategory(str, enum.Enum):
     @property
     def reduced_category(self):
         try:
-            return {
-                self.business: ReducedCategory.mandatory,
-                self.car_fees: ReducedCategory.mandatory,
-                self.clothing: ReducedCategory.mandatory,
-                self.debt: ReducedCategory.debt,
-                self.dependents: ReducedCategory.mandatory,
-                self.dining_out: ReducedCategory.fun,
-                self.drugs: ReducedCategory.fun,
-                self.education: ReducedCategory.mandatory,
-                self.finance: ReducedCategory.debt,
-                self.gift: ReducedCategory.misc,
-                self.groceries: ReducedCategory.mandatory,
-                self.grooming: ReducedCategory.mandatory,
-                self.health: ReducedCategory.mandatory,
-                self.household_supplies: ReducedCategory.mandatory,
-                self.house_repairs: ReducedCategory.mandatory,
-                self.insurance: ReducedCategory.mandatory,
-                self.investment: ReducedCategory.asset,
-                self.leisure: ReducedCategory.fun,
-                self.mortgage: ReducedCategory.mandatory,
-                self.recreation: ReducedCategory.fun,
-                self.refueling: ReducedCategory.mandatory,
-                self.rent: ReducedCategory.mandatory,
-                self.taxes: ReducedCategory.mandatory,
-                self.transit: ReducedCategory.mandatory,
-                self.utility_bills: ReducedCategory.mandatory,
-                self.vacation: ReducedCategory.fun,
-                self.other: ReducedCategory.misc,
-            }[self]
+            return REDUCED_CATEGORY_BY_EXPENSE_CATEGORY[self]
         except KeyError:
             raise ValueError(f"Category {self.value} does not have a reduced category")
 
 
+# Built once, as the lookups run for every record of some pages
+REDUCED_CATEGORY_BY_EXPENSE_CATEGORY = {
+    ExpenseCategory.business: ReducedCategory.mandatory,
+    ExpenseCategory.car_fees: ReducedCategory.mandatory,
+    ExpenseCategory.clothing: ReducedCategory.mandatory,
+    ExpenseCategory.debt: ReducedCategory.debt,
+    ExpenseCategory.dependents: ReducedCategory.mandatory,
+    ExpenseCategory.dining_out: ReducedCategory.fun,
+    ExpenseCategory.drugs: ReducedCategory.fun,
+    ExpenseCategory.education: ReducedCategory.mandatory,
+    ExpenseCategory.finance: ReducedCategory.debt,
+    ExpenseCategory.gift: ReducedCategory.misc,
+    ExpenseCategory.groceries: ReducedCategory.mandatory,
+    ExpenseCategory.grooming: ReducedCategory.mandatory,
+    ExpenseCategory.health: ReducedCategory.mandatory,
+    ExpenseCategory.household_supplies: ReducedCategory.mandatory,
+    ExpenseCategory.house_repairs: ReducedCategory.mandatory,
+    ExpenseCategory.insurance: ReducedCategory.mandatory,
+    ExpenseCategory.investment: ReducedCategory.asset,
+    ExpenseCategory.leisure: ReducedCategory.fun,
+    ExpenseCategory.mortgage: ReducedCategory.mandatory,
+    ExpenseCategory.recreation: ReducedCategory.fun,
+    ExpenseCategory.refueling: ReducedCategory.mandatory,
+    ExpenseCategory.rent: ReducedCategory.mandatory,
+    ExpenseCategory.taxes: ReducedCategory.mandatory,
+    ExpenseCategory.transit: ReducedCategory.mandatory,
+    ExpenseCategory.utility_bills: ReducedCategory.mandatory,
+    ExpenseCategory.vacation: ReducedCategory.fun,
+    ExpenseCategory.other: ReducedCategory.misc,
+}
 EXPENSE_CATEGORY_BY_REDUCED_CATEGORY = {red_cat: set() for red_cat in ReducedCategory}
-for red_cat in ReducedCategory:
-    for cat in ExpenseCategory:
-        if cat.reduced_category is red_cat:
-            EXPENSE_CATEGORY_BY_REDUCED_CATEGORY[red_cat].add(cat)
+for cat, red_cat in REDUCED_CATEGORY_BY_EXPENSE_CATEGORY.items():
+    EXPENSE_CATEGORY_BY_REDUCED_CATEGORY[red_cat].add(cat)
 
 
 @enum.unique
@@ -160,12 +160,16 @@ class IncomeCategory(str, enum.Enum):
         return self.value
 
 
+# Formats accepted for dates, e.g. "2021-01-30" and "1/30/2021"
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y")
+
+
 def date_from_string(date_str: str) -> datetime.date:
     """
     Accepts either ISO with hyphens dates such as "2021-01-30" or US-style
     dates with slashes such as "1/30/2021"
     """
-    for fmt in ("%Y-%m-%d", "%m/%d/%Y"):
+    for fmt in DATE_FORMATS:
         try:
             dt_obj = datetime.datetime.strptime(date_str, fmt)
         except ValueError:
@@ -175,6 +179,22 @@ def date_from_string(date_str: str) -> datetime.date:
     raise ValueError(f"Unrecognised date string: '{date_str}'")
 
 
+def dates_from_strings(date_strs):
+    """
+    Vectorised date_from_string, accepting the same formats.
+
+    :param pd.Series date_strs: series of date strings
+    :return: pd.Series of datetime64, NaT where a string is unrecognised
+    """
+    # Imported here, as the rest of far_core does not need pandas
+    import pandas as pd
+
+    dates = pd.to_datetime(date_strs, format=DATE_FORMATS[0], errors="coerce")
+    for fmt in DATE_FORMATS[1:]:
+        dates = dates.fillna(pd.to_datetime(date_strs, format=fmt, errors="coerce"))
+    return dates
+
+
 def month_from_string(month_str: str) -> datetime.date:
     """
     Accepts year-month strings with hyphens such as "%Y-%m"
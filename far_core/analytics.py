@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+"""
+Monthly totals of the ledger, which the report, forecast and projection
+pages aggregate from rather than fetching every record.
+
+With FAR_ANALYTICS_BACKEND "sqlite", the default, totals are grouped by SQL
+in the snapshot of far_core.snapshot. With "duckdb", they are columnar
+scans of a mirror of the record tables in an in-memory DuckDB database of
+each worker process, as a DuckDB file can only be written by one process.
+SQLite stays the system of record: the mirror is loaded from it on first
+use, then brought up to date before each query from the LedgerChange log,
+which follows the writes of every process. duckdb is an optional
+dependency, only needed by that backend.
+"""
+
+import os
+import threading
+
+import sqlalchemy
+
+from app import server
+import far_core
+import far_core.archive
+import far_core.calendar
+import far_core.db
+import far_core.metrics
+import far_core.snapshot
+
+
+BACKENDS = ("sqlite", "duckdb")
+# Columns of the DataFrames of get_monthly_totals()
+TOTALS_COLUMNS = ("month", "category", "account", "amount")
+# Records read per statement when bringing the mirror up to date
+MIRROR_CHUNK_IDS = 500
+
+_MODELS = {"expense": far_core.db.ExpenseRecord, "income": far_core.db.IncomeRecord}
+_CATEGORIES = {"expense": far_core.ExpenseCategory, "income": far_core.IncomeCategory}
+
+_mirror_lock = threading.Lock()
+_mirror = None
+
+
+def get_ledger_version(session) -> int:
+    """
+    :param session: sqlalchemy.orm.Session reading the ledger
+    :return: id of the latest change of the ledger, or 0 if none
+    """
+    return session.execute(
+        sqlalchemy.text("SELECT coalesce(max(change_id), 0) FROM ledger_change")
+    ).scalar()
+
+
+def get_changed_record_ids(session, version: int) -> tuple:
+    """
+    :param session: sqlalchemy.orm.Session reading the ledger
+    :param int version: version of the ledger a reader is up to date with,
+        or None if it has not read the ledger yet
+    :return: tuple of the version of the ledger, and a dict of the list of
+        the ids of the records of each model changed since version, or None
+        if the reader must read the whole ledger again, as the changes since
+        version were pruned
+    """
+    latest = get_ledger_version(session)
+    if latest == version:
+        return latest, {model: [] for model in _MODELS.values()}
+    oldest = session.execute(
+        sqlalchemy.text("SELECT min(change_id) FROM ledger_change")
+    ).scalar()
+    if version is None or latest < version or oldest is None or oldest > version + 1:
+        return latest, None
+    changed_ids = {}
+    for model in _MODELS.values():
+        changed_ids[model] = (
+            session.execute(
+                sqlalchemy.text(
+                    "SELECT DISTINCT record_id FROM ledger_change"
+                    " WHERE table_name = :table AND change_id > :version"
+                ),
+                {"table": model.__tablename__, "version": version},
+            )
+            .scalars()
+            .all()
+        )
+    return latest, changed_ids
+
+
+class _Mirror:
+    """Columnar copy of the record tables in an in-memory DuckDB database"""
+
+    def __init__(self):
+        # Only needed by this backend, so not a requirement of the app
+        import duckdb
+
+        self.pid = os.getpid()
+        self.conn = duckdb.connect(":memory:")
+        self.version = None
+
+    def _load(self, session, model, record_ids: list = None):
+        """
+        Copies the records of model with record_ids, or all of them, from
+        session, replacing any previous copy
+        """
+        import pandas as pd
+
+        table = model.__tablename__
+        id_column = far_core.archive.get_id_column(model)
+        sql = (
+            f"SELECT {id_column} AS id, date, amount, category, account"
+            f" FROM {far_core.archive.get_view_name(model)}"
+        )
+        if record_ids is None:
+            chunks = [session.execute(sqlalchemy.text(sql)).all()]
+            self.conn.execute(
+                f"CREATE OR REPLACE TABLE {table} (id BIGINT, date DATE,"
+                f" amount DOUBLE, category VARCHAR, account VARCHAR)"
+            )
+        else:
+            chunks = []
+            statement = sqlalchemy.text(f"{sql} WHERE {id_column} IN :ids").bindparams(
+                sqlalchemy.bindparam("ids", expanding=True)
+            )
+            for i in range(0, len(record_ids), MIRROR_CHUNK_IDS):
+                ids = record_ids[i : i + MIRROR_CHUNK_IDS]
+                self.conn.register("changed_ids", pd.DataFrame({"id": ids}))
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE id IN (SELECT id FROM changed_ids)"
+                )
+                self.conn.unregister("changed_ids")
+                chunks.append(session.execute(statement, {"ids": ids}).all())
+        for rows in chunks:
+            far_core.metrics.record_rows_fetched(len(rows))
+            if not rows:
+                continue
+            self.conn.register(
+                "changed_rows",
+                pd.DataFrame(
+                    rows, columns=("id", "date", "amount", "category", "account")
+                ),
+            )
+            self.conn.execute(
+                f"INSERT INTO {table} SELECT id, CAST(date AS DATE),"
+                f" CAST(amount AS DOUBLE), category, account FROM changed_rows"
+            )
+            self.conn.unregister("changed_rows")
+
+    def update(self, session):
+        """Brings the mirror up to the version of the ledger seen by session"""
+        version, changed_ids = get_changed_record_ids(session, self.version)
+        if version == self.version:
+            return
+        for model in _MODELS.values():
+            if changed_ids is None:
+                self._load(session, model)
+            elif changed_ids[model]:
+                self._load(session, model, changed_ids[model])
+        self.version = version
+
+
+def _get_sqlite_totals(record_type: str, start_date, end_date, categories) -> list:
+    with far_core.snapshot.snapshot() as session:
+        table = far_core.archive.get_source(session, _MODELS[record_type], start_date)
+        # The month key of far_core.calendar
+        month = (
+            sqlalchemy.cast(
+                sqlalchemy.func.strftime("%Y", table.c.date), sqlalchemy.Integer
+            )
+            * 12
+            + sqlalchemy.cast(
+                sqlalchemy.func.strftime("%m", table.c.date), sqlalchemy.Integer
+            )
+            - 1
+        )
+        query = (
+            sqlalchemy.select(
+                month,
+                table.c.category,
+                table.c.account,
+                sqlalchemy.func.sum(table.c.amount, type_=sqlalchemy.Float),
+            )
+            .where(table.c.date >= start_date, table.c.date < end_date)
+            .group_by(month, table.c.category, table.c.account)
+        )
+        if categories is not None:
+            query = query.where(table.c.category.in_(categories))
+        rows = session.execute(query).all()
+    far_core.metrics.record_rows_fetched(len(rows))
+    return rows
+
+
+def _get_duckdb_totals(record_type: str, start_date, end_date, categories) -> list:
+    global _mirror
+    sql = (
+        "SELECT year(date) * 12 + month(date) - 1, category, account, sum(amount)"
+        f" FROM {_MODELS[record_type].__tablename__}"
+        " WHERE date >= ? AND date < ?"
+    )
+    parameters = [start_date, end_date]
+    if categories is not None:
+        sql += " AND list_contains(?, category)"
+        parameters.append([cat.name for cat in categories])
+    sql += " GROUP BY ALL"
+    with far_core.snapshot.snapshot() as session, _mirror_lock:
+        # A mirror inherited through a fork belongs to the parent process
+        if _mirror is None or _mirror.pid != os.getpid():
+            _mirror = _Mirror()
+        _mirror.update(session)
+        rows = _mirror.conn.execute(sql, parameters).fetchall()
+    far_core.metrics.record_rows_fetched(len(rows))
+    category_type = _CATEGORIES[record_type]
+    return [
+        (month, category_type[category], far_core.Accounts[account], amount)
+        for month, category, account, amount in rows
+    ]
+
+
+def get_monthly_totals(
+    record_type: str, first_month: int, end_month: int, categories: list = None
+):
+    """
+    :param str record_type: "expense" or "income"
+    :param int first_month: month key of the first month totalled, see
+        far_core.calendar
+    :param int end_month: month key of the first month after those totalled
+    :param list categories: categories to total, or None for every category
+    :return: pd.DataFrame of TOTALS_COLUMNS, the total amount per month,
+        category and account with any records, with months as month keys
+        and amounts as floats
+    """
+    import pandas as pd
+
+    start_date = far_core.calendar.month_from_key(first_month)
+    end_date = far_core.calendar.month_from_key(end_month)
+    backend = server.config["FAR_ANALYTICS_BACKEND"]
+    if backend == "sqlite":
+        rows = _get_sqlite_totals(record_type, start_date, end_date, categories)
+    elif backend == "duckdb":
+        rows = _get_duckdb_totals(record_type, start_date, end_date, categories)
+    else:
+        raise ValueError(
+            f"Unknown analytics backend {backend}, expected one of {BACKENDS}"
+        )
+    return pd.DataFrame.from_records(rows, columns=TOTALS_COLUMNS)
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+"""
+Archive of the closed years of the ledger, which moves their records out of
+the hot expense_record and income_record tables into a partition table per
+year, e.g. expense_record_2019, once they are older than the
+FAR_ARCHIVE_KEEP_YEARS years before the current one.
+
+Reports look back three years at most, so queries starting within the hot
+years only touch the hot tables, keeping their working set small. Queries
+reaching further back, and full-history pages such as /expenses, read the
+union views expense_record_all and income_record_all of the hot table and
+its partitions. Records keep their ids when archived, and ids stay unique
+across the hot table and its partitions.
+"""
+
+import datetime
+import logging
+import re
+
+import sqlalchemy
+import sqlalchemy.orm
+
+from app import server
+import far_core
+import far_core.db
+
+
+MODELS = (far_core.db.ExpenseRecord, far_core.db.IncomeRecord)
+
+_views = {}
+
+
+def get_partition_name(model, year: int) -> str:
+    return f"{model.__tablename__}_{year}"
+
+
+def get_view_name(model) -> str:
+    return f"{model.__tablename__}_all"
+
+
+def get_view(model) -> sqlalchemy.Table:
+    """:return: table of the union view of model's hot table and partitions"""
+    if model not in _views:
+        _views[model] = model.__table__.to_metadata(
+            sqlalchemy.MetaData(), name=get_view_name(model)
+        )
+    return _views[model]
+
+
+def get_id_column(model) -> str:
+    return model.__table__.primary_key.columns.values()[0].name
+
+
+def get_archived_years(conn, model) -> list:
+    """
+    :param conn: sqlalchemy.engine.Connection or sqlalchemy.orm.Session
+    :return: sorted list of the years of model's partitions
+    """
+    pattern = re.compile(rf"{model.__tablename__}_(\d{{4}})")
+    names = conn.execute(
+        sqlalchemy.text("SELECT name FROM sqlite_master WHERE type = 'table'")
+    ).scalars()
+    return sorted(
+        int(match.group(1))
+        for match in (pattern.fullmatch(name) for name in names)
+        if match
+    )
+
+
+def get_table_names(conn, model) -> list:
+    """:return: list of the names of model's hot table and partitions"""
+    return [model.__tablename__] + [
+        get_partition_name(model, year) for year in get_archived_years(conn, model)
+    ]
+
+
+def get_hot_start(session, model) -> datetime.date:
+    """
+    :param session: sqlalchemy.orm.Session of a snapshot, see far_core.snapshot
+    :return: first day of the hot years of model, or None if none are archived
+    """
+    key = ("far_archived_years", model.__tablename__)
+    # Partitions only change on startup, so once per snapshot is enough
+    if key not in session.info:
+        session.info[key] = get_archived_years(session, model)
+    years = session.info[key]
+    return datetime.date(years[-1] + 1, 1, 1) if years else None
+
+
+def get_source(session, model, start_date: datetime.date = None) -> sqlalchemy.Table:
+    """
+    :return: model's hot table, if it holds every record from start_date on,
+        or else the union view
+    """
+    hot_start = get_hot_start(session, model)
+    if hot_start is None or (start_date is not None and start_date >= hot_start):
+        return model.__table__
+    return get_view(model)
+
+
+def get_entity(session, model, start_date: datetime.date = None):
+    """:return: model, or model mapped onto its union view, see get_source"""
+    source = get_source(session, model, start_date)
+    if source is model.__table__:
+        return model
+    return sqlalchemy.orm.aliased(model, source, adapt_on_names=True)
+
+
+def get_next_record_id(conn, model) -> int:
+    """
+    :param conn: sqlalchemy.engine.Connection or sqlalchemy.orm.Session
+    :return: the id after the largest of model's records, archived or not,
+        which SQLite would not know of once the largest ids are archived
+    """
+    id_column = get_id_column(model)
+    return 1 + max(
+        conn.execute(
+            sqlalchemy.text(f"SELECT coalesce(max({id_column}), 0) FROM {table}")
+        ).scalar()
+        for table in get_table_names(conn, model)
+    )
+
+
+def create_views(conn):
+    """Creates the union views, and the change triggers of every partition"""
+    for model in MODELS:
+        columns = ", ".join(column.name for column in model.__table__.columns)
+        selects = [f"SELECT {columns} FROM {model.__tablename__}"]
+        for year in get_archived_years(conn, model):
+            partition = get_partition_name(model, year)
+            selects.append(f"SELECT {columns} FROM {partition}")
+            for trigger in far_core.db.get_change_triggers(model, partition):
+                conn.exec_driver_sql(trigger)
+        conn.exec_driver_sql(f"DROP VIEW IF EXISTS {get_view_name(model)}")
+        conn.exec_driver_sql(
+            f"CREATE VIEW {get_view_name(model)} AS {' UNION ALL '.join(selects)}"
+        )
+
+
+def archive_year(conn, year: int) -> dict:
+    """
+    Moves the records of year from the hot tables into their partitions
+
+    :return: dict of the number of records moved per hot table
+    """
+    start_date, end_date = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+    moved = {}
+    for model in MODELS:
+        table = model.__table__
+        partition = table.to_metadata(
+            sqlalchemy.MetaData(), name=get_partition_name(model, year)
+        )
+        partition.create(conn, checkfirst=True)
+        in_year = sqlalchemy.and_(table.c.date >= start_date, table.c.date < end_date)
+        conn.execute(
+            partition.insert().from_select(
+                [column.name for column in table.columns],
+                sqlalchemy.select(table).where(in_year),
+            )
+        )
+        moved[model.__tablename__] = conn.execute(
+            table.delete().where(in_year)
+        ).rowcount
+    return moved
+
+
+def archive_closed_years(conn, keep_years: int):
+    """
+    Archives every year before the keep_years years before the current one
+
+    :param conn: sqlalchemy.engine.Connection within a transaction
+    """
+    logger = logging.getLogger(__name__).getChild("archive_closed_years")
+    first_hot_year = far_core.get_current_month().year - keep_years
+    years = set()
+    for model in MODELS:
+        years.update(
+            int(year)
+            for year in conn.exec_driver_sql(
+                f"SELECT DISTINCT strftime('%Y', date) FROM {model.__tablename__}"
+                f" WHERE date < ?",
+                (datetime.date(first_hot_year, 1, 1).isoformat(),),
+            ).scalars()
+        )
+    for year in sorted(years):
+        moved = archive_year(conn, year)
+        logger.warning("Archived the records of %d: %s", year, moved)
+    create_views(conn)
+
+
+def init_archive(conn):
+    """
+    Creates the union views, then archives closed years if
+    FAR_ARCHIVE_KEEP_YEARS is set
+
+    :param conn: sqlalchemy.engine.Connection within a transaction
+    """
+    create_views(conn)
+    if server.config["FAR_ARCHIVE_KEEP_YEARS"]:
+        archive_closed_years(conn, server.config["FAR_ARCHIVE_KEEP_YEARS"])
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+SQLite cache backend for flask_caching, which every worker process of the
+server can share. Use it with CACHE_TYPE "far_core.cache.SQLiteCache".
+"""
+
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+from flask_caching.backends.base import BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """
+    Stores pickled values in a single SQLite file in WAL mode, so readers in
+    any process do not block each other or a writer.
+    """
+
+    # Chance of deleting expired entries on each set()
+    PRUNE_PROBABILITY = 0.01
+
+    def __init__(self, path: str, default_timeout: int = 300):
+        super().__init__(default_timeout=default_timeout)
+        self._path = path
+        self._local = threading.local()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        os.makedirs(config["CACHE_DIR"], exist_ok=True)
+        kwargs["path"] = os.path.join(config["CACHE_DIR"], "cache.db")
+        return cls(*args, **kwargs)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Connections can be shared neither across threads nor across a fork
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " expires REAL NOT NULL"
+                ")"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def _expires(self, timeout) -> float:
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else 0.0
+
+    def get(self, key):
+        row = self._conn.execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires = 0 OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def has(self, key):
+        row = self._conn.execute(
+            "SELECT 1 FROM cache WHERE key = ? AND (expires = 0 OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def set(self, key, value, timeout=None):
+        if random.random() < self.PRUNE_PROBABILITY:
+            self._conn.execute(
+                "DELETE FROM cache WHERE expires != 0 AND expires <= ?", (time.time(),)
+            )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (
+                key,
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                self._expires(timeout),
+            ),
+        )
+        return True
+
+    def add(self, key, value, timeout=None):
+        self._conn.execute(
+            "DELETE FROM cache WHERE key = ? AND expires != 0 AND expires <= ?",
+            (key, time.time()),
+        )
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (
+                key,
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                self._expires(timeout),
+            ),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        cursor = self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        return cursor.rowcount == 1
+
+    def clear(self):
+        self._conn.execute("DELETE FROM cache")
+        return True
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+"""
+Calendar of the reports, which identifies periods by integer keys, so that
+report windows are ranges of integers and bucketing arrays of dates into
+periods is a single NumPy operation rather than a call per date.
+
+A month key is year * 12 + month - 1, so that the months of a window have
+consecutive keys, e.g. the month before month_key(date) is month_key(date) - 1.
+A quarter key is year * 4 + quarter - 1, i.e. the month key // 3.
+A week key counts the weeks, from Monday to Sunday, since 0001-01-01.
+A fiscal year key is the calendar year in which the fiscal year starts, the
+fiscal years starting in FAR_FISCAL_YEAR_START_MONTH.
+"""
+
+import datetime
+import functools
+
+from app import server
+
+
+# Days from 0001-01-01, the first day of week 0, to the NumPy epoch 1970-01-01
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal() - 1
+
+
+def month_key(date: datetime.date) -> int:
+    return date.year * 12 + date.month - 1
+
+
+def month_from_key(key: int) -> datetime.date:
+    """:return: the first day of the month of key"""
+    year, month = divmod(key, 12)
+    return datetime.date(year, month + 1, 1)
+
+
+def quarter_key(date: datetime.date) -> int:
+    return month_key(date) // 3
+
+
+def week_key(date: datetime.date) -> int:
+    return (date.toordinal() - 1) // 7
+
+
+def fiscal_year_key(date: datetime.date, start_month: int = None) -> int:
+    """
+    :param int start_month: first month of fiscal years, 1 to 12, defaults
+        to FAR_FISCAL_YEAR_START_MONTH
+    """
+    start_month = start_month or server.config["FAR_FISCAL_YEAR_START_MONTH"]
+    return (month_key(date) - start_month + 1) // 12
+
+
+def get_current_month_key() -> int:
+    return month_key(datetime.date.today())
+
+
+@functools.lru_cache(maxsize=256)
+def get_month_starts(first_key: int, months: int) -> tuple:
+    """
+    :return: tuple of the first day of each of the months from the month of
+        first_key on, computed once per window
+    """
+    return tuple(month_from_key(key) for key in range(first_key, first_key + months))
+
+
+def month_keys(dates):
+    """
+    Vectorised month_key.
+
+    :param dates: array-like of dates, e.g. a list of datetime.date or a
+        pd.Series of datetime64
+    :return: np.ndarray of int64 month keys
+    """
+    # Imported here, as only the vectorised functions need numpy
+    import numpy as np
+
+    # Months since 1970-01
+    return np.asarray(dates, dtype="datetime64[M]").astype(np.int64) + 1970 * 12
+
+
+def quarter_keys(dates):
+    """Vectorised quarter_key, see month_keys()"""
+    return month_keys(dates) // 3
+
+
+def week_keys(dates):
+    """Vectorised week_key, see month_keys()"""
+    import numpy as np
+
+    # Days since 1970-01-01
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    return (days + _EPOCH_ORDINAL) // 7
+
+
+def fiscal_year_keys(dates, start_month: int = None):
+    """Vectorised fiscal_year_key, see month_keys()"""
+    start_month = start_month or server.config["FAR_FISCAL_YEAR_START_MONTH"]
+    return (month_keys(dates) - start_month + 1) // 12
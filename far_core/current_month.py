@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+"""
+Totals of the records of the current month, by account, category and
+reduced category, which each worker process keeps in memory for the main
+page, so that rendering it is a lookup rather than a query.
+
+The totals are loaded on first use, then brought up to date incrementally
+from the LedgerChange log, only reading the records which changed. Writes
+of this process update them before far_core.writer returns, through its
+commit hook. Writes of other processes are picked up once the totals are
+more than FAR_CURRENT_MONTH_CHECK_SECONDS old, which costs one query of
+the ledger version when nothing changed.
+"""
+
+import collections
+import os
+import threading
+import time
+
+import sqlalchemy
+
+from app import server
+import far_core
+import far_core.analytics
+import far_core.calendar
+import far_core.db
+import far_core.metrics
+import far_core.snapshot
+import far_core.writer
+
+
+_MODELS = {"expense": far_core.db.ExpenseRecord, "income": far_core.db.IncomeRecord}
+
+_lock = threading.Lock()
+_current = None
+
+
+class CurrentMonthTotals:
+    """
+    Totals of the records of one month, each a collections.Counter of the
+    total amount per key, zero for keys without records
+    """
+
+    def __init__(self, month: int):
+        """:param int month: month key, see far_core.calendar"""
+        self.month = month
+        self.expense_by_account = collections.Counter()
+        self.expense_by_category = collections.Counter()
+        self.expense_by_reduced_category = collections.Counter()
+        # Keyed by (reduced category, account)
+        self.expense_by_reduced_category_and_account = collections.Counter()
+        self.income_by_account = collections.Counter()
+        self.income_by_category = collections.Counter()
+
+    def copy(self):
+        totals = CurrentMonthTotals(self.month)
+        for name, counter in vars(self).items():
+            if isinstance(counter, collections.Counter):
+                setattr(totals, name, counter.copy())
+        return totals
+
+    def add(self, record_type: str, amount, category, account):
+        """Adds amount, negative to remove a record, to every total it is in"""
+        if record_type == "expense":
+            reduced_category = far_core.REDUCED_CATEGORY_BY_EXPENSE_CATEGORY[category]
+            self.expense_by_account[account] += amount
+            self.expense_by_category[category] += amount
+            self.expense_by_reduced_category[reduced_category] += amount
+            self.expense_by_reduced_category_and_account[
+                (reduced_category, account)
+            ] += amount
+        else:
+            self.income_by_account[account] += amount
+            self.income_by_category[category] += amount
+
+
+class _CurrentMonth:
+    def __init__(self):
+        self.pid = os.getpid()
+        self.version = None
+        self.checked = 0.0
+        self.totals = None
+        # (amount, category, account) of each counted record, by record type
+        # and id, to take a record out of the totals once it changes
+        self.records = {}
+
+    def _read(self, session, record_type: str, month: int, record_ids: list = None):
+        """:return: rows of the id, amount, category and account of records"""
+        table = _MODELS[record_type].__table__
+        id_column = table.primary_key.columns.values()[0]
+        start_date, end_date = far_core.calendar.get_month_starts(month, 2)
+        query = sqlalchemy.select(
+            id_column, table.c.amount, table.c.category, table.c.account
+        ).where(table.c.date >= start_date, table.c.date < end_date)
+        if record_ids is not None:
+            query = query.where(id_column.in_(record_ids))
+        rows = session.execute(query).all()
+        far_core.metrics.record_rows_fetched(len(rows))
+        return rows
+
+    def update(self, session):
+        """Brings the totals up to the version of the ledger seen by session"""
+        month = far_core.calendar.get_current_month_key()
+        if self.totals is not None and self.totals.month != month:
+            # A new month starts with no records counted
+            self.version = None
+        version, changed_ids = far_core.analytics.get_changed_record_ids(
+            session, self.version
+        )
+        self.checked = time.monotonic()
+        if version == self.version:
+            return
+        if changed_ids is None:
+            totals, self.records = CurrentMonthTotals(month), {}
+        else:
+            # Copied, so that pages rendering the previous totals are not
+            # affected
+            totals = self.totals.copy()
+        for record_type, model in _MODELS.items():
+            if changed_ids is None:
+                rows = self._read(session, record_type, month)
+            elif changed_ids[model]:
+                for record_id in changed_ids[model]:
+                    record = self.records.pop((record_type, record_id), None)
+                    if record is not None:
+                        amount, category, account = record
+                        totals.add(record_type, -amount, category, account)
+                rows = self._read(session, record_type, month, changed_ids[model])
+            else:
+                continue
+            for record_id, amount, category, account in rows:
+                self.records[(record_type, record_id)] = (amount, category, account)
+                totals.add(record_type, amount, category, account)
+        self.totals, self.version = totals, version
+
+
+def _get_current_month() -> _CurrentMonth:
+    global _current
+    # Totals inherited through a fork belong to the parent process
+    if _current is None or _current.pid != os.getpid():
+        _current = _CurrentMonth()
+    return _current
+
+
+def get_current_month_totals() -> CurrentMonthTotals:
+    """
+    :return: CurrentMonthTotals of the current month, which must only be
+        read from
+    """
+    current = _get_current_month()
+    max_age = server.config["FAR_CURRENT_MONTH_CHECK_SECONDS"]
+    if (
+        current.totals is None
+        or current.totals.month != far_core.calendar.get_current_month_key()
+        or time.monotonic() - current.checked > max_age
+    ):
+        with _lock, far_core.snapshot.snapshot() as session:
+            current.update(session)
+    return current.totals
+
+
+@far_core.writer.on_commit
+def _update_after_commit():
+    current = _get_current_month()
+    # Totals are only kept once a page has asked for them
+    if current.totals is None:
+        return
+    with _lock, far_core.snapshot.snapshot() as session:
+        current.update(session)
@@ -4,9 +4,26 @@ DB models and DB utilities of the Finance and Reporting App.
 """
 
 import logging
+import time
+
+import sqlalchemy
 
 from app import db
 import far_core
+import far_core.engine
+import far_core.writer
+
+
+def _get_reduced_category(context) -> far_core.ReducedCategory:
+    category = context.get_current_parameters()["category"]
+    # Resolved as the category column does, which also takes member names,
+    # e.g. those of the JSON imports of far_core.import_records
+    if not isinstance(category, far_core.ExpenseCategory):
+        try:
+            category = far_core.ExpenseCategory[category]
+        except KeyError:
+            category = far_core.ExpenseCategory(category)
+    return far_core.REDUCED_CATEGORY_BY_EXPENSE_CATEGORY[category]
 
 
 class ExpenseRecord(db.Model):
@@ -23,6 +40,13 @@ class ExpenseRecord(db.Model):
     category = db.Column(db.Enum(far_core.ExpenseCategory), nullable=False)
     account = db.Column(db.Enum(far_core.Accounts), nullable=False)
     note = db.Column(db.String(length=1024), nullable=True)
+    # Follows category, so that reduced category filters use an index
+    reduced_category = db.Column(
+        db.Enum(far_core.ReducedCategory),
+        nullable=False,
+        index=True,
+        default=_get_reduced_category,
+    )
 
     def __str__(self):
         return (
@@ -43,13 +67,7 @@ class ExpenseRecord(db.Model):
 
 
 def delete_expense_records_by_id(expense_ids: list):
-    try:
-        for expense_id in expense_ids:
-            ExpenseRecord.query.filter(ExpenseRecord.expense_id == expense_id).delete()
-    except Exception:
-        db.session.rollback()
-        raise
-    db.session.commit()
+    _delete_records_by_id(ExpenseRecord, expense_ids)
 
 
 class IncomeRecord(db.Model):
@@ -86,21 +104,157 @@ class IncomeRecord(db.Model):
 
 
 def delete_income_records_by_id(income_ids: list):
-    try:
-        for income_id in income_ids:
-            IncomeRecord.query.filter(IncomeRecord.income_id == income_id).delete()
-    except Exception:
-        db.session.rollback()
-        raise
-    db.session.commit()
+    _delete_records_by_id(IncomeRecord, income_ids)
+
+
+def _delete_records_by_id(model, record_ids: list):
+    """Deletes the records of model with record_ids, archived or not"""
+    # Imported here, as far_core.archive imports this module
+    import far_core.archive
+
+    id_column = far_core.archive.get_id_column(model)
+    record_ids = list(record_ids)
+
+    def delete(conn):
+        for table in far_core.archive.get_table_names(conn, model):
+            conn.execute(
+                sqlalchemy.text(
+                    f"DELETE FROM {table} WHERE {id_column} IN :ids"
+                ).bindparams(sqlalchemy.bindparam("ids", expanding=True)),
+                {"ids": record_ids},
+            )
+
+    far_core.writer.execute(delete)
+
+
+def insert_records(expense_records: list = (), income_records: list = ()):
+    """
+    Inserts expense and income records in one transaction, with one
+    statement per table, through far_core.writer
+
+    :param list expense_records: dicts of the ExpenseRecord columns, except
+        the id and the reduced category
+    :param list income_records: dicts of the IncomeRecord columns, except
+        the id
+    """
+    # Imported here, as far_core.archive imports this module
+    import far_core.archive
+
+    def insert(conn):
+        for model, records in (
+            (ExpenseRecord, expense_records),
+            (IncomeRecord, income_records),
+        ):
+            if not records:
+                continue
+            # Ids are given explicitly, as SQLite would reuse archived ones
+            next_id = far_core.archive.get_next_record_id(conn, model)
+            id_column = far_core.archive.get_id_column(model)
+            conn.execute(
+                model.__table__.insert(),
+                [
+                    dict(record, **{id_column: next_id + i})
+                    for i, record in enumerate(records)
+                ],
+            )
+
+    far_core.writer.execute(insert)
+
+
+class LedgerChange(db.Model):
+    """
+    Logs the id of every inserted, updated or deleted record, filled by the
+    triggers of get_change_triggers() whichever process writes, so that
+    readers such as far_core.analytics can follow the changes of the ledger
+    """
+
+    __tablename__ = "ledger_change"
+    # Change ids are never reused, even once the latest changes are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    change_id = db.Column(db.Integer, primary_key=True, nullable=False)
+    table_name = db.Column(db.String(length=32), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    # Unix time of the change
+    changed = db.Column(db.Float, nullable=False)
+
+
+# Changes older than this are pruned at startup, readers further behind
+# reload the whole ledger
+CHANGE_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+def get_change_triggers(model, table: str = None) -> list:
+    """
+    :param table: name of the table whose changes are logged, model's own
+        table by default, or one of its partitions, see far_core.archive
+    :return: list of the DDL of the triggers filling LedgerChange, which
+        log the changes of table as changes of model's records
+    """
+    table = table or model.__tablename__
+    id_column = model.__table__.primary_key.columns.values()[0].name
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_change"
+        f" AFTER {event} ON {table} BEGIN"
+        f" INSERT INTO ledger_change (table_name, record_id, changed)"
+        f" VALUES ('{model.__tablename__}', {row}.{id_column},"
+        f" (julianday('now') - 2440587.5) * 86400.0);"
+        f" END"
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+    ]
+
+
+def add_reduced_category_column(conn, table: str):
+    """
+    Adds the reduced_category column of ExpenseRecord, and its index, to
+    table if it predates them, filling it in from the category
+
+    :param conn: sqlalchemy.engine.Connection within a transaction
+    :param str table: name of the expense_record table or of a partition
+    """
+    columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+    if "reduced_category" in columns:
+        return
+    logger = logging.getLogger(__name__).getChild("add_reduced_category_column")
+    logger.warning("Adding the reduced_category column to %s", table)
+    reduced_categories = " ".join(
+        f"WHEN '{cat.name}' THEN '{red_cat.name}'"
+        for cat, red_cat in far_core.REDUCED_CATEGORY_BY_EXPENSE_CATEGORY.items()
+    )
+    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN reduced_category VARCHAR(9)")
+    conn.exec_driver_sql(
+        f"UPDATE {table} SET reduced_category = CASE category {reduced_categories} END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_reduced_category"
+        f" ON {table} (reduced_category)"
+    )
 
 
 def init_tables():
     """
-    Initialises all tables if no tables already exist
+    Initialises all tables if no tables already exist, and adds the tables,
+    columns, triggers and views of later versions to existing databases, then
+    archives closed years, see far_core.archive
     """
     logger = logging.getLogger(__name__)
     logger.info("Checking if DB tables need to be initialised")
     if not db.engine.table_names():
         logger.warning("Creating DB tables for the first time!")
-        db.create_all()
+    db.create_all()
+    # Imported here, as far_core.archive imports this module
+    import far_core.archive
+
+    with db.engine.begin() as conn:
+        for table in far_core.archive.get_table_names(conn, ExpenseRecord):
+            add_reduced_category_column(conn, table)
+        for model in (ExpenseRecord, IncomeRecord):
+            for trigger in get_change_triggers(model):
+                conn.exec_driver_sql(trigger)
+        far_core.archive.init_archive(conn)
+        # The latest change is kept, as it holds the version of the ledger
+        conn.exec_driver_sql(
+            "DELETE FROM ledger_change WHERE changed < ?"
+            " AND change_id < (SELECT max(change_id) FROM ledger_change)",
+            (time.time() - CHANGE_RETENTION_SECONDS,),
+        )
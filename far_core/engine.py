@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""
+Tuning of the SQLite connections of the app, which applies the pragmas of
+the FAR_SQLITE_PROFILE profile to every new connection, plus a pool of
+read-only connections for report queries.
+
+The "tuned" profile switches the database to WAL journaling, so that reads
+and the writer of far_core.writer do not block each other, and relaxes
+synchronous to NORMAL, which in WAL mode stays safe against corruption and
+only risks the last transactions on power loss. Memory mapped I/O and a
+larger page cache speed up the scans of reports. The "default" profile
+leaves SQLite's own settings, to compare against. Single pragmas of the
+profile are overridden with FAR_SQLITE_PRAGMAS, e.g. "mmap_size=0".
+
+The engine of flask_sqlalchemy opens a connection for every session, so
+its page cache is lost between requests, whereas the read-only engine
+keeps up to FAR_READ_POOL_SIZE connections, and their caches, per process.
+"""
+
+import functools
+
+import sqlalchemy
+import sqlalchemy.engine
+import sqlalchemy.event
+import sqlalchemy.pool
+
+from app import db, server
+
+
+PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+        # Negative sizes are in KiB, i.e. 32 MiB per connection
+        "cache_size": -32768,
+        "mmap_size": 256 * 1024 * 1024,
+    },
+}
+
+
+def get_pragmas() -> dict:
+    """
+    :return: dict of the name and value of each pragma of the configured
+        profile, with the overrides of FAR_SQLITE_PRAGMAS
+    :raises ValueError: for an unknown profile or a malformed override
+    """
+    profile = server.config["FAR_SQLITE_PROFILE"]
+    if profile not in PROFILES:
+        raise ValueError(
+            f"Unknown SQLite profile {profile}, expected one of {list(PROFILES)}"
+        )
+    pragmas = dict(PROFILES[profile])
+    for override in server.config["FAR_SQLITE_PRAGMAS"].split(","):
+        if not override.strip():
+            continue
+        name, sep, value = override.partition("=")
+        if not sep or not name.strip().isidentifier():
+            raise ValueError(f"Malformed SQLite pragma override: '{override}'")
+        pragmas[name.strip()] = value.strip()
+    return pragmas
+
+
+def _apply_pragmas(dbapi_connection, connection_record, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in get_pragmas().items():
+            # The journal mode belongs to the database file, which read-only
+            # connections cannot change, so the read-write engine sets it
+            if read_only and name == "journal_mode":
+                continue
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=1")
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine: sqlalchemy.engine.Engine, read_only: bool = False):
+    """
+    Applies the SQLite profile to every connection engine opens from now on
+
+    :param engine: engine of a SQLite database
+    :param bool read_only: whether engine opens read-only connections
+    """
+    sqlalchemy.event.listen(
+        engine, "connect", functools.partial(_apply_pragmas, read_only=read_only)
+    )
+
+
+def create_read_only_engine() -> sqlalchemy.engine.Engine:
+    """
+    :return: engine of pooled, read-only connections to the database of
+        SQLALCHEMY_DATABASE_URI, with the SQLite profile applied
+    """
+    url = sqlalchemy.engine.make_url(server.config["SQLALCHEMY_DATABASE_URI"])
+    engine = sqlalchemy.create_engine(
+        f"sqlite:///file:{url.database}?mode=ro&uri=true",
+        poolclass=sqlalchemy.pool.QueuePool,
+        pool_size=server.config["FAR_READ_POOL_SIZE"],
+        # Connections move between the threads of a worker, one at a time
+        connect_args={"check_same_thread": False},
+    )
+    configure_engine(engine, read_only=True)
+    return engine
+
+
+configure_engine(db.engine)
+read_only_engine = create_read_only_engine()
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+"""
+Export of the ledger, which streams the expense or income records of a
+date range as CSV or Parquet, e.g.
+    /export/expenses.csv?start=2021-01-01&end=2022-01-01
+with start inclusive, end exclusive, and both optional.
+
+Records are read in chunks of EXPORT_CHUNK_ROWS from one snapshot of the
+ledger, and each chunk is sent as it is read, so exports of any size use
+bounded memory: CSV responses are chunked, and Parquet files are written
+one row group per chunk. Categories and accounts are exported by their
+names, as stored. pyarrow is an optional dependency, only needed by the
+Parquet export.
+"""
+
+import csv
+import enum
+import io
+
+import flask
+import sqlalchemy
+
+from app import server
+import far_core
+import far_core.archive
+import far_core.db
+import far_core.snapshot
+
+
+# Records read, and sent, at a time, and rows per Parquet row group
+EXPORT_CHUNK_ROWS = 10000
+
+_MODELS = {
+    "expenses": far_core.db.ExpenseRecord,
+    "incomes": far_core.db.IncomeRecord,
+}
+
+
+def iter_chunks(model, start_date=None, end_date=None):
+    """
+    :return: generator of lists of the rows of at most EXPORT_CHUNK_ROWS of
+        model's records from start_date until end_date, archived or not,
+        ordered by date, with the values of the columns of model's table,
+        enums as their names and amounts as floats
+    """
+    with far_core.snapshot.snapshot() as session:
+        table = far_core.archive.get_source(session, model, start_date)
+        columns = [
+            # Floats rather than the Decimals of the Numeric column
+            (
+                sqlalchemy.type_coerce(column, sqlalchemy.Float).label(column.name)
+                if column.name == "amount"
+                else column
+            )
+            for column in table.columns
+        ]
+        query = sqlalchemy.select(*columns).order_by(
+            table.c.date, table.primary_key.columns.values()[0]
+        )
+        if start_date:
+            query = query.where(table.c.date >= start_date)
+        if end_date:
+            query = query.where(table.c.date < end_date)
+        result = session.execute(query, execution_options={"stream_results": True})
+        for rows in result.partitions(EXPORT_CHUNK_ROWS):
+            yield [
+                [value.name if isinstance(value, enum.Enum) else value for value in row]
+                for row in rows
+            ]
+
+
+def _iter_csv(model, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in model.__table__.columns])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file which keeps what was written until it is taken"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _iter_parquet(model, chunks):
+    # Only needed by the Parquet export, so not a requirement of the app
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {
+        sqlalchemy.Integer: pa.int64(),
+        sqlalchemy.Date: pa.date32(),
+        sqlalchemy.Numeric: pa.float64(),
+    }
+    schema = pa.schema(
+        [
+            (
+                column.name,
+                next(
+                    (
+                        arrow_type
+                        for sql_type, arrow_type in types.items()
+                        if isinstance(column.type, sql_type)
+                    ),
+                    pa.string(),
+                ),
+            )
+            for column in model.__table__.columns
+        ]
+    )
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in chunks:
+            writer.write_table(
+                pa.Table.from_arrays(
+                    [
+                        pa.array(values, type=field.type)
+                        for values, field in zip(zip(*rows), schema)
+                    ],
+                    schema=schema,
+                )
+            )
+            yield sink.take()
+    yield sink.take()
+
+
+def _get_date_arg(name: str):
+    date_str = flask.request.args.get(name)
+    if not date_str:
+        return None
+    try:
+        return far_core.date_from_string(date_str)
+    except ValueError as e:
+        flask.abort(400, description=f"Invalid {name} date: {e}")
+
+
+@server.route("/export/<record_type>.<export_format>")
+def export_records(record_type: str, export_format: str):
+    model = _MODELS.get(record_type)
+    if model is None or export_format not in ("csv", "parquet"):
+        flask.abort(404)
+    start_date, end_date = _get_date_arg("start"), _get_date_arg("end")
+    chunks = iter_chunks(model, start_date, end_date)
+    filename = "_".join(
+        [record_type] + [date.isoformat() for date in (start_date, end_date) if date]
+    )
+    if export_format == "csv":
+        body, mimetype = _iter_csv(model, chunks), "text/csv"
+    else:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            flask.abort(501, description="Parquet exports need pyarrow installed")
+        body = _iter_parquet(model, chunks)
+        mimetype = "application/vnd.apache.parquet"
+    return flask.Response(
+        # Keeps the request, and so its snapshot, open while streaming
+        flask.stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": (f"attachment; filename={filename}.{export_format}")
+        },
+    )
@@ -4,7 +4,19 @@ import datetime
 import json
 
 import far_core.db
-from app import db
+
+
+def _records_from_json(records: list) -> list:
+    return [
+        {
+            "date": datetime.datetime.strptime(rec[0], "%Y-%m-%dT%H:%M:%S.%fZ").date(),
+            "amount": rec[1],
+            "category": rec[2],
+            "note": rec[3],
+            "account": rec[4],
+        }
+        for rec in records
+    ]
 
 
 def import_expenses_from_json(json_path: str):
@@ -15,16 +27,7 @@ def import_expenses_from_json(json_path: str):
     """
     with open(json_path, "rt") as f:
         expenses = json.load(f)
-    for exp in expenses:
-        exp_record = far_core.db.ExpenseRecord(
-            date=datetime.datetime.strptime(exp[0], "%Y-%m-%dT%H:%M:%S.%fZ").date(),
-            amount=exp[1],
-            category=exp[2],
-            note=exp[3],
-            account=exp[4],
-        )
-        db.session.add(exp_record)
-    db.session.commit()
+    far_core.db.insert_records(expense_records=_records_from_json(expenses))
 
 
 def import_incomes_from_json(json_path):
@@ -35,13 +38,4 @@ def import_incomes_from_json(json_path):
     """
     with open(json_path, "rt") as f:
         expenses = json.load(f)
-    for exp in expenses:
-        exp_record = far_core.db.IncomeRecord(
-            date=datetime.datetime.strptime(exp[0], "%Y-%m-%dT%H:%M:%S.%fZ").date(),
-            amount=exp[1],
-            category=exp[2],
-            note=exp[3],
-            account=exp[4],
-        )
-        db.session.add(exp_record)
-    db.session.commit()
+    far_core.db.insert_records(income_records=_records_from_json(expenses))
@@ -0,0 +1,352 @@
+#!/usr/bin/python3
+"""
+Background job runner for long computations, e.g. forecasts and the annual
+report, so they do not hold up the request threads of the server.
+
+Jobs are queued in a local SQLite file, which lets any worker process poll
+the status of a job no matter which process runs it.
+"""
+
+import contextlib
+import enum
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import plotly.utils
+
+from app import server
+import far_core.metrics
+import far_core.profiling
+import far_core.querywatch
+import far_core.snapshot
+
+
+# Registered job functions by name, see job_function()
+JOB_FUNCTIONS = {}
+# Finished jobs are deleted from the queue after this many seconds
+JOB_RETENTION_SECONDS = 60 * 60
+# How long an idle runner thread sleeps before checking the queue again,
+# doubling while the queue stays empty up to MAX_POLL_INTERVAL_SECONDS
+POLL_INTERVAL_SECONDS = 0.1
+MAX_POLL_INTERVAL_SECONDS = 2.0
+# How often each process marks the jobs it runs as alive, and running jobs
+# not marked for STALE_JOB_SECONDS, i.e. left by a process which stopped,
+# are failed
+JOB_HEARTBEAT_SECONDS = 30
+STALE_JOB_SECONDS = 4 * JOB_HEARTBEAT_SECONDS
+
+_local = threading.local()
+_runner_lock = threading.Lock()
+_runner_pid = None
+# Set by submit(), so that the runners of the submitting process claim the
+# job without waiting for their poll interval
+_wakeup = threading.Event()
+# Ids of the jobs run by the runner threads of this process
+_running_job_ids = set()
+_running_lock = threading.Lock()
+
+
+@enum.unique
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+    cancelled = "cancelled"
+
+    def __str__(self):
+        return self.value
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+
+def job_function(func):
+    """
+    Decorator registering func so the runner can find it by name.
+    Arguments and return values of job functions must be JSON serialisable,
+    Dash components and plotly figures included.
+    """
+    JOB_FUNCTIONS[f"{func.__module__}.{func.__qualname__}"] = func
+    return func
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        server.config["FAR_JOB_QUEUE_PATH"], timeout=30, isolation_level=None
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS job ("
+        " job_id TEXT PRIMARY KEY,"
+        " function TEXT NOT NULL,"
+        " args TEXT NOT NULL,"
+        " status TEXT NOT NULL,"
+        " progress REAL NOT NULL DEFAULT 0,"
+        " result TEXT,"
+        " error TEXT,"
+        " updated REAL NOT NULL,"
+        " profile INTEGER NOT NULL DEFAULT 0"
+        ")"
+    )
+    return conn
+
+
+def submit(func, *args, supersedes: str = None) -> str:
+    """
+    Queues func(*args) to run in the background.
+
+    :param func: a function registered with job_function()
+    :param str supersedes: id of a previous job which is cancelled, as its
+        result is no longer wanted
+    :return: the id of the new job
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+    if name not in JOB_FUNCTIONS:
+        raise ValueError(f"{name} is not a registered job function")
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        if supersedes:
+            _cancel(conn, supersedes)
+        conn.execute(
+            "DELETE FROM job WHERE status NOT IN (?, ?) AND updated < ?",
+            (JobStatus.queued, JobStatus.running, time.time() - JOB_RETENTION_SECONDS),
+        )
+        conn.execute(
+            "INSERT INTO job (job_id, function, args, status, updated, profile)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                name,
+                json.dumps(args),
+                JobStatus.queued,
+                time.time(),
+                far_core.profiling.is_requested(),
+            ),
+        )
+    finally:
+        conn.close()
+    start_runner()
+    _wakeup.set()
+    return job_id
+
+
+def _cancel(conn: sqlite3.Connection, job_id: str):
+    conn.execute(
+        "UPDATE job SET status = ?, updated = ? WHERE job_id = ? AND status IN (?, ?)",
+        (JobStatus.cancelled, time.time(), job_id, JobStatus.queued, JobStatus.running),
+    )
+
+
+def cancel(job_id: str):
+    conn = _connect()
+    try:
+        _cancel(conn, job_id)
+    finally:
+        conn.close()
+
+
+def get_job(job_id: str) -> dict:
+    """
+    :return: dict with keys "status", "progress", "result" and "error", or
+        None if there is no such job
+    """
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT status, progress, result, error FROM job WHERE job_id = ?",
+            (job_id,),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    status, progress, result, error = row
+    return {
+        "status": JobStatus(status),
+        "progress": progress,
+        "result": json.loads(result) if result is not None else None,
+        "error": error,
+    }
+
+
+def set_progress(fraction: float):
+    """
+    Reports the progress of the job running on this thread, and raises
+    JobCancelled if it has been cancelled. Does nothing outside of a job, so
+    job functions can still be called directly.
+
+    :param float fraction: between 0.0 and 1.0
+    """
+    job_id = getattr(_local, "job_id", None)
+    if job_id is None:
+        return
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE job SET progress = ?, updated = ? WHERE job_id = ? AND status = ?",
+            (fraction, time.time(), job_id, JobStatus.running),
+        )
+        (status,) = conn.execute(
+            "SELECT status FROM job WHERE job_id = ?", (job_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if status == JobStatus.cancelled:
+        raise JobCancelled(job_id)
+
+
+def _claim_next_job(conn: sqlite3.Connection):
+    """
+    :return: the job_id, function, args and profile of the job claimed, or
+        None if no job is queued
+    """
+    while True:
+        # A plain read, so that idle runners do not take the write lock
+        row = conn.execute(
+            "SELECT job_id, function, args, profile FROM job WHERE status = ?"
+            " ORDER BY updated LIMIT 1",
+            (JobStatus.queued,),
+        ).fetchone()
+        if row is None:
+            return None
+        claimed = conn.execute(
+            "UPDATE job SET status = ?, updated = ? WHERE job_id = ? AND status = ?",
+            (JobStatus.running, time.time(), row[0], JobStatus.queued),
+        ).rowcount
+        # Otherwise another runner claimed, or a client cancelled, the job
+        # since it was read
+        if claimed:
+            return row
+
+
+def _run_job(
+    conn: sqlite3.Connection, job_id: str, function: str, args: str, profile: int
+):
+    logger = logging.getLogger(__name__).getChild("_run_job")
+    _local.job_id = job_id
+    with _running_lock:
+        _running_job_ids.add(job_id)
+    try:
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(server.app_context())
+            stack.enter_context(far_core.metrics.track(function))
+            stack.enter_context(far_core.snapshot.snapshot())
+            if profile:
+                stack.enter_context(far_core.profiling.profile(function))
+            if far_core.querywatch.is_enabled():
+                stack.enter_context(far_core.querywatch.watch(function))
+            result = JOB_FUNCTIONS[function](*json.loads(args))
+        conn.execute(
+            "UPDATE job SET status = ?, progress = 1, result = ?, updated = ?"
+            " WHERE job_id = ? AND status = ?",
+            (
+                JobStatus.done,
+                json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder),
+                time.time(),
+                job_id,
+                JobStatus.running,
+            ),
+        )
+    except JobCancelled:
+        logger.info("Job %s (%s) was cancelled", job_id, function)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job_id, function)
+        conn.execute(
+            "UPDATE job SET status = ?, error = ?, updated = ? WHERE job_id = ?",
+            (JobStatus.failed, repr(e), time.time(), job_id),
+        )
+    finally:
+        _local.job_id = None
+        with _running_lock:
+            _running_job_ids.discard(job_id)
+
+
+def _fail_stale_jobs(conn: sqlite3.Connection):
+    """Fails the running jobs of processes which stopped running them"""
+    stale_before = time.time() - STALE_JOB_SECONDS
+    # A plain read first, so that the write lock is only taken when needed
+    if conn.execute(
+        "SELECT 1 FROM job WHERE status = ? AND updated < ? LIMIT 1",
+        (JobStatus.running, stale_before),
+    ).fetchone():
+        conn.execute(
+            "UPDATE job SET status = ?, error = ?, updated = ?"
+            " WHERE status = ? AND updated < ?",
+            (
+                JobStatus.failed,
+                "The job was interrupted, as the process running it stopped",
+                time.time(),
+                JobStatus.running,
+                stale_before,
+            ),
+        )
+
+
+def _heartbeat_loop():
+    logger = logging.getLogger(__name__).getChild("_heartbeat_loop")
+    conn = _connect()
+    while True:
+        try:
+            with _running_lock:
+                job_ids = list(_running_job_ids)
+            if job_ids:
+                conn.executemany(
+                    "UPDATE job SET updated = ? WHERE job_id = ? AND status = ?",
+                    [(time.time(), job_id, JobStatus.running) for job_id in job_ids],
+                )
+            _fail_stale_jobs(conn)
+        except sqlite3.Error:
+            logger.exception("Could not check the running jobs")
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+
+
+def _runner_loop():
+    logger = logging.getLogger(__name__).getChild("_runner_loop")
+    conn = _connect()
+    interval = POLL_INTERVAL_SECONDS
+    while True:
+        try:
+            row = _claim_next_job(conn)
+        except sqlite3.Error:
+            logger.exception("Could not claim a job from the queue")
+            row = None
+        if row is None:
+            if _wakeup.wait(interval):
+                _wakeup.clear()
+                interval = POLL_INTERVAL_SECONDS
+            else:
+                interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+            continue
+        interval = POLL_INTERVAL_SECONDS
+        _run_job(conn, *row)
+
+
+def start_runner():
+    """
+    Starts the runner threads of this process, if not already started,
+    along with a heartbeat thread, which first fails the jobs left running
+    by processes which stopped. Threads do not survive a fork, so each
+    worker process starts its own.
+    """
+    global _runner_pid
+    with _runner_lock:
+        if _runner_pid == os.getpid():
+            return
+        _runner_pid = os.getpid()
+        # Jobs inherited through a fork are run by the parent process
+        with _running_lock:
+            _running_job_ids.clear()
+        threading.Thread(
+            target=_heartbeat_loop, name="far_job_heartbeat", daemon=True
+        ).start()
+        for i in range(server.config["FAR_JOB_WORKERS"]):
+            threading.Thread(
+                target=_runner_loop, name=f"far_job_runner_{i}", daemon=True
+            ).start()
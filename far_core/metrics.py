@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+"""
+Instrumentation of Dash callbacks, SQL statements and the cache, exposed on
+/metrics in the Prometheus text format.
+
+Metrics are kept per process, so under gunicorn each scrape of /metrics
+reports the worker which served it.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+
+import flask
+import sqlalchemy.engine
+import sqlalchemy.event
+import sqlalchemy.orm
+
+from app import cache, server
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """A counter per value of a single label"""
+
+    def __init__(self, name: str, documentation: str, label_name: str):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self._values = {}
+
+    def inc(self, label_value: str, amount: float = 1):
+        with _lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with _lock:
+            values = sorted(self._values.items())
+        for label_value, value in values:
+            lines.append(
+                f'{self.name}{{{self.label_name}="{_escape(label_value)}"}} {value}'
+            )
+        return lines
+
+
+class Histogram:
+    """A histogram per value of a single label"""
+
+    def __init__(self, name: str, documentation: str, label_name: str, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        # label value -> [count per bucket..., count above all buckets, sum]
+        self._values = {}
+
+    def observe(self, label_value: str, value: float):
+        with _lock:
+            counts = self._values.setdefault(
+                label_value, [0] * (len(self.buckets) + 1) + [0.0]
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with _lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for label_value, counts in values:
+            label = f'{self.label_name}="{_escape(label_value)}"'
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{label},le="{bucket}"}} {cumulative}'
+                )
+            cumulative += counts[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {counts[-1]}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+CALLBACK_DURATION = Histogram(
+    "far_callback_duration_seconds",
+    "Latency of Dash callbacks and background jobs",
+    "callback",
+    LATENCY_BUCKETS,
+)
+CALLBACK_QUERIES = Histogram(
+    "far_callback_sql_queries",
+    "SQL statements executed per call of a Dash callback or background job",
+    "callback",
+    COUNT_BUCKETS,
+)
+SQL_QUERIES = Counter("far_sql_queries_total", "SQL statements executed", "callback")
+SQL_DURATION = Counter(
+    "far_sql_duration_seconds_total", "Time spent executing SQL", "callback"
+)
+ROWS_FETCHED = Counter(
+    "far_sql_rows_fetched_total", "Rows fetched from the database", "callback"
+)
+CACHE_REQUESTS = Counter(
+    "far_cache_requests_total", "flask_caching lookups by result", "result"
+)
+METRICS = (
+    CALLBACK_DURATION,
+    CALLBACK_QUERIES,
+    SQL_QUERIES,
+    SQL_DURATION,
+    ROWS_FETCHED,
+    CACHE_REQUESTS,
+)
+
+
+def _current_callback() -> str:
+    return getattr(_local, "callback", None) or "none"
+
+
+@contextlib.contextmanager
+def track(callback: str):
+    """
+    Attributes the SQL statements executed on this thread to callback, and
+    records its latency and statement count when done.
+    """
+    _local.callback = callback
+    _local.queries = 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        CALLBACK_DURATION.observe(callback, time.perf_counter() - start)
+        CALLBACK_QUERIES.observe(callback, _local.queries)
+        _local.callback = None
+
+
+def record_rows_fetched(rows: int):
+    """For queries returning rows which are not ORM objects, e.g. aggregates"""
+    ROWS_FETCHED.inc(_current_callback(), rows)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._far_metrics_start = time.perf_counter()
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    callback = _current_callback()
+    SQL_QUERIES.inc(callback)
+    SQL_DURATION.inc(callback, time.perf_counter() - context._far_metrics_start)
+    if getattr(_local, "callback", None):
+        _local.queries += 1
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Mapper, "load")
+def _on_load(target, context):
+    ROWS_FETCHED.inc(_current_callback())
+
+
+def _instrument_cache_backend():
+    backend = server.extensions["cache"][cache]
+    backend_get = backend.get
+
+    def get(key):
+        value = backend_get(key)
+        # Memoize also gets the version key of the function through
+        # get_many(), which is not a lookup of a result
+        if not key.endswith("_memver"):
+            CACHE_REQUESTS.inc("miss" if value is None else "hit")
+        return value
+
+    backend.get = get
+
+
+_instrument_cache_backend()
+
+
+@server.before_request
+def _start_callback_tracking():
+    if flask.request.path != "/_dash-update-component":
+        return
+    payload = flask.request.get_json(silent=True) or {}
+    tracker = track(payload.get("output", "unknown"))
+    tracker.__enter__()
+    flask.g.far_metrics_tracker = tracker
+
+
+@server.teardown_request
+def _stop_callback_tracking(_exc):
+    tracker = flask.g.pop("far_metrics_tracker", None)
+    if tracker is not None:
+        tracker.__exit__(None, None, None)
+
+
+@server.route("/metrics")
+def metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return flask.Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+"""
+Opt-in profiling of Dash callbacks and background jobs under cProfile.
+
+Profiling is enabled for every callback by the FAR_PROFILE environment
+variable, or for a single request by an "X-FAR-Profile: 1" header or a
+"profile" query flag on either the request or the page it came from, e.g.
+/report/annual?profile=1
+
+Each profiled call writes to FAR_PROFILE_DIR:
+    <time>_<callback>.prof: the cProfile stats, for use with pstats or snakeviz
+    <time>_<callback>.txt: the functions with the highest cumulative time
+    <time>_<callback>.sql: the SQL statements executed, with their durations
+"""
+
+import contextlib
+import cProfile
+import datetime
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import urllib.parse
+
+import flask
+import sqlalchemy.engine
+import sqlalchemy.event
+
+from app import server
+
+
+# How many functions to list in the .txt summary of a profile
+SUMMARY_FUNCTIONS = 40
+
+_local = threading.local()
+
+
+def _is_flag_set(value: str) -> bool:
+    return value is not None and value.lower() not in ("0", "false", "no")
+
+
+def is_requested() -> bool:
+    """:return: whether the current request, if any, should be profiled"""
+    if server.config["FAR_PROFILE"]:
+        return True
+    if not flask.has_request_context():
+        return False
+    if _is_flag_set(flask.request.headers.get("X-FAR-Profile")):
+        return True
+    if _is_flag_set(flask.request.args.get("profile")):
+        return True
+    # Dash callbacks are posted to a fixed URL, so check the page's URL too
+    if flask.request.referrer:
+        query = urllib.parse.parse_qs(
+            urllib.parse.urlparse(flask.request.referrer).query,
+            keep_blank_values=True,
+        )
+        return any(_is_flag_set(value or "1") for value in query.get("profile", ()))
+    return False
+
+
+@contextlib.contextmanager
+def profile(label: str):
+    """Profiles the body, writing the results for label to FAR_PROFILE_DIR"""
+    profiler = cProfile.Profile()
+    _local.statements = []
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        statements, _local.statements = _local.statements, None
+        _write_profile(label, profiler, statements)
+
+
+def _write_profile(label: str, profiler: cProfile.Profile, statements: list):
+    logger = logging.getLogger(__name__).getChild("_write_profile")
+    os.makedirs(server.config["FAR_PROFILE_DIR"], exist_ok=True)
+    file_label = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")[:100]
+    path_prefix = os.path.join(
+        server.config["FAR_PROFILE_DIR"],
+        "{}_{}".format(
+            datetime.datetime.now().strftime("%Y%m%dT%H%M%S.%f"), file_label
+        ),
+    )
+    profiler.dump_stats(f"{path_prefix}.prof")
+    with open(f"{path_prefix}.txt", "wt") as f:
+        f.write(f"Profile of {label}\n")
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(SUMMARY_FUNCTIONS)
+    with open(f"{path_prefix}.sql", "wt") as f:
+        f.write(f"-- {len(statements)} statements executed by {label}\n")
+        for statement, parameters, duration in statements:
+            f.write(f"-- {duration * 1000:.3f} ms, parameters: {parameters!r}\n")
+            f.write(f"{statement};\n")
+    logger.info("Wrote profile of %s to %s.*", label, path_prefix)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._far_profiling_start = time.perf_counter()
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = getattr(_local, "statements", None)
+    if statements is not None:
+        statements.append(
+            (
+                statement,
+                parameters,
+                time.perf_counter() - context._far_profiling_start,
+            )
+        )
+
+
+@server.before_request
+def _start_callback_profile():
+    if flask.request.path != "/_dash-update-component" or not is_requested():
+        return
+    payload = flask.request.get_json(silent=True) or {}
+    profiler = profile(payload.get("output", "unknown"))
+    profiler.__enter__()
+    flask.g.far_profiler = profiler
+
+
+@server.teardown_request
+def _stop_callback_profile(_exc):
+    profiler = flask.g.pop("far_profiler", None)
+    if profiler is not None:
+        profiler.__exit__(None, None, None)
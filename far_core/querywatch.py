@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""
+Development-mode detector of N+1 query patterns, i.e. the same shape of SQL
+statement running over and over within a single request or background job,
+such as a query per month of a report or a delete per selected row.
+
+Enabled by the FAR_DEV_MODE environment variable. A statement shape running
+more than FAR_QUERY_REPEAT_THRESHOLD times logs a warning with the stack
+which ran it, and with FAR_QUERY_REPEAT_RAISE set the request fails instead.
+Tests and benchmarks can use watch() directly to fail on repeated queries.
+"""
+
+import collections
+import contextlib
+import logging
+import os
+import re
+import threading
+import traceback
+
+import flask
+import sqlalchemy.engine
+import sqlalchemy.event
+
+from app import server
+
+
+# Frames of the stack from files under this directory are kept in warnings
+_SOURCE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_local = threading.local()
+
+
+class RepeatedQueryError(Exception):
+    """Raised when a statement shape ran more often than allowed"""
+
+
+def fingerprint(statement: str) -> str:
+    """
+    :return: the shape of a SQL statement, with literals, IN lists and
+        repeated OR clauses collapsed, so near-identical statements match
+    """
+    shape = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\s+", " ", shape).strip()
+    shape = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", shape)
+    shape = re.sub(r"([\w.]+ = \?)(?: OR \1)+", r"\1 OR ...", shape)
+    return shape
+
+
+def is_enabled() -> bool:
+    return server.config["FAR_DEV_MODE"]
+
+
+class _Watch:
+    def __init__(self, label: str, threshold: int):
+        self.label = label
+        self.threshold = threshold
+        self.counts = collections.Counter()
+        # statement shape -> stack of the run which crossed the threshold
+        self.violations = {}
+
+
+@contextlib.contextmanager
+def watch(label: str, threshold: int = None, raise_on_repeat: bool = None):
+    """
+    Counts the statement shapes executed on this thread within the body.
+
+    :param str label: name of the request or job, used in messages
+    :param int threshold: most runs allowed per statement shape, defaults to
+        FAR_QUERY_REPEAT_THRESHOLD
+    :param bool raise_on_repeat: raise RepeatedQueryError on leaving the body
+        if any shape ran more than threshold times, defaults to
+        FAR_QUERY_REPEAT_RAISE
+    """
+    if threshold is None:
+        threshold = server.config["FAR_QUERY_REPEAT_THRESHOLD"]
+    if raise_on_repeat is None:
+        raise_on_repeat = server.config["FAR_QUERY_REPEAT_RAISE"]
+    previous_watch = getattr(_local, "watch", None)
+    current_watch = _local.watch = _Watch(label, threshold)
+    try:
+        yield current_watch
+    finally:
+        _local.watch = previous_watch
+    if raise_on_repeat and current_watch.violations:
+        raise RepeatedQueryError(
+            "{} repeated statements: {}".format(
+                label,
+                "; ".join(
+                    f"{current_watch.counts[shape]}x {shape}"
+                    for shape in current_watch.violations
+                ),
+            )
+        )
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    current_watch = getattr(_local, "watch", None)
+    if current_watch is None:
+        return
+    shape = fingerprint(statement)
+    current_watch.counts[shape] += 1
+    if current_watch.counts[shape] != current_watch.threshold + 1:
+        return
+    stack = "".join(
+        traceback.format_list(
+            frame
+            for frame in traceback.extract_stack()
+            if frame.filename.startswith(_SOURCE_ROOT) and frame.filename != __file__
+        )
+    )
+    current_watch.violations[shape] = stack
+    logging.getLogger(__name__).warning(
+        "%s ran the same statement more than %d times, possible N+1 query:\n%s\n%s",
+        current_watch.label,
+        current_watch.threshold,
+        shape,
+        stack,
+    )
+
+
+@server.before_request
+def _start_request_watch():
+    if not is_enabled():
+        return
+    payload = flask.request.get_json(silent=True) or {}
+    watcher = watch(payload.get("output", flask.request.path))
+    watcher.__enter__()
+    flask.g.far_query_watch = watcher
+
+
+@server.after_request
+def _stop_request_watch(response):
+    watcher = flask.g.pop("far_query_watch", None)
+    if watcher is not None:
+        # Raises RepeatedQueryError, failing the request, if configured to
+        watcher.__exit__(None, None, None)
+    return response
+
+
+@server.teardown_request
+def _clean_up_request_watch(_exc):
+    # The request failed before reaching _stop_request_watch
+    watcher = flask.g.pop("far_query_watch", None)
+    if watcher is not None:
+        _local.watch = None
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+"""
+Consistent reads of the ledger, on the pooled read-only connections of
+far_core.engine rather than the session of flask_sqlalchemy which the
+writes go through.
+
+The first read of a request, i.e. of a callback, or of a background job
+begins a read transaction which lasts until the request or job ends, so
+that every query of one render sees the ledger as of the same commit, even
+while far_core.writer commits in between. In WAL mode neither the snapshot
+nor the writer waits for the other. Reads outside of a request or job,
+e.g. in scripts, each run in a snapshot of their own.
+"""
+
+import contextlib
+import threading
+
+import flask
+import sqlalchemy.orm
+
+from app import server
+import far_core.engine
+
+
+_Session = sqlalchemy.orm.sessionmaker(bind=far_core.engine.read_only_engine)
+_local = threading.local()
+
+
+def _begin() -> sqlalchemy.orm.Session:
+    session = _Session()
+    # pysqlite only begins transactions before writes, so begin the read
+    # transaction explicitly. SQLite takes the snapshot on its first read.
+    session.connection().exec_driver_sql("BEGIN")
+    return session
+
+
+def _end():
+    session, _local.session = getattr(_local, "session", None), None
+    if session is not None:
+        # Ends the read transaction, returning the connection to the pool
+        session.close()
+
+
+@contextlib.contextmanager
+def snapshot():
+    """
+    Runs the body in the snapshot of the current request, or of an
+    enclosing snapshot() such as a background job's, beginning it if
+    needed, or else in a snapshot of its own.
+
+    :return: context manager of the sqlalchemy.orm.Session of the snapshot,
+        which must only be read from
+    """
+    session = getattr(_local, "session", None)
+    if session is not None:
+        yield session
+        return
+    _local.session = _begin()
+    if flask.has_request_context():
+        # Ended by _end_request_snapshot
+        yield _local.session
+        return
+    try:
+        yield _local.session
+    finally:
+        _end()
+
+
+@server.teardown_request
+def _end_request_snapshot(_exc):
+    _end()
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+"""
+Version of the ledger, the id of its latest LedgerChange, which every
+write of any process moves on, so that pages and other clients can tell
+whether the ledger changed without reading it.
+
+/ledger/version serves it as JSON with the version as its ETag, so that
+clients polling with If-None-Match get an empty 304 response until the
+ledger changes. Pages poll get_ledger_version() every
+FAR_LIVE_REFRESH_SECONDS into the ledger_version store of index.py, which
+only changes, and so only re-runs the callbacks of the page taking it as
+an input, when the ledger did.
+
+/ledger/version and the JSON API of apps.api also carry the time of the
+latest change as their Last-Modified, for clients revalidating with
+If-Modified-Since.
+"""
+
+import datetime
+
+import flask
+import sqlalchemy
+
+from app import server
+import far_core.analytics
+import far_core.snapshot
+
+
+def get_ledger_version() -> int:
+    """:return: version of the ledger, in the snapshot of the current request"""
+    with far_core.snapshot.snapshot() as session:
+        # Read once per snapshot, as it cannot change within one
+        if "ledger_version" not in session.info:
+            session.info["ledger_version"] = far_core.analytics.get_ledger_version(
+                session
+            )
+        return session.info["ledger_version"]
+
+
+def get_ledger_state() -> tuple:
+    """
+    :return: tuple of the version of the ledger, in the snapshot of the
+        current request, and the naive UTC datetime of its latest change, to
+        the second as in HTTP dates, or None if it has not changed yet
+    """
+    with far_core.snapshot.snapshot() as session:
+        version = far_core.analytics.get_ledger_version(session)
+        changed = session.execute(
+            sqlalchemy.text("SELECT changed FROM ledger_change WHERE change_id = :id"),
+            {"id": version},
+        ).scalar()
+    if changed is None:
+        return version, None
+    return version, datetime.datetime.utcfromtimestamp(int(changed))
+
+
+def set_validators(response, version: int, last_modified, tag: str = None):
+    """
+    Sets the ETag and Last-Modified of response, a representation of the
+    ledger at version, so that clients cache it but revalidate it on every
+    request
+
+    :param str tag: distinguishes the representations of a same version
+    """
+    response.set_etag(f"{version}-{tag}" if tag else str(version))
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+@server.route("/ledger/version")
+def ledger_version():
+    version, last_modified = get_ledger_state()
+    response = flask.jsonify(version=version)
+    set_validators(response, version, last_modified)
+    return response.make_conditional(flask.request)
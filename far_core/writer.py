@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+"""
+Single writer of the database, which runs every mutation of the ledger on
+one connection of one thread, so request threads never contend with each
+other for SQLite's write lock.
+
+Mutations queued while a transaction runs are committed together with it
+(group commit), each within its own savepoint so one failing mutation does
+not undo the others. The tuned SQLite profile of far_core.engine switches
+the database to WAL journaling, so reads never wait for the writer.
+
+Each worker process of the server has its own writer, and writers of
+different processes wait for each other on SQLite's busy timeout.
+"""
+
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+
+import sqlalchemy.exc
+
+from app import db
+import far_core.engine  # noqa: F401, profiles the writer's connection
+
+
+# Most mutations committed together by one transaction
+MAX_BATCH_OPERATIONS = 100
+# How long callers wait for their mutation to be committed
+WRITE_TIMEOUT_SECONDS = 30
+
+_queue = queue.Queue()
+_writer_lock = threading.Lock()
+_writer_pid = None
+_commit_hooks = []
+
+
+def on_commit(hook):
+    """
+    Decorator which registers hook to be called, without arguments, on the
+    writer's thread after every transaction it commits, and before the
+    callers of execute() return, e.g. to bring in-memory state of this
+    process up to date with the writes
+
+    :param hook: callable, whose exceptions are logged and ignored
+    """
+    _commit_hooks.append(hook)
+    return hook
+
+
+def submit(operation) -> concurrent.futures.Future:
+    """
+    Queues operation to run on the writer's connection.
+
+    :param operation: callable taking a sqlalchemy.engine.Connection, which
+        must only write through that connection
+    :return: future of the operation's return value, set once committed
+    """
+    start_writer()
+    future = concurrent.futures.Future()
+    _queue.put((operation, future))
+    return future
+
+
+def execute(operation):
+    """
+    Runs operation on the writer's connection, waiting until it is committed.
+    Operations still queued after WRITE_TIMEOUT_SECONDS are cancelled, so
+    that they never commit once the caller was told they failed, while
+    those already running are waited for.
+
+    :return: the return value of operation
+    :raises: any exception raised by operation or by the commit, or
+        concurrent.futures.TimeoutError if operation was cancelled
+    """
+    future = submit(operation)
+    try:
+        return future.result(timeout=WRITE_TIMEOUT_SECONDS)
+    except concurrent.futures.TimeoutError:
+        if future.cancel():
+            raise
+    return future.result()
+
+
+def _run_batch(conn, batch: list):
+    """
+    Runs batch in one transaction, each operation in its own savepoint
+
+    :raises: errors which leave conn unusable, once the futures of batch
+        are failed
+    """
+    logger = logging.getLogger(__name__).getChild("_run_batch")
+    # Futures cancelled by execute() can no longer be cancelled once running
+    batch = [
+        (operation, future)
+        for operation, future in batch
+        if future.set_running_or_notify_cancel()
+    ]
+    if not batch:
+        return
+    results = []
+    try:
+        # SQLAlchemy's transaction stops it committing after every statement,
+        # and SQLite's is begun explicitly to take the write lock up front
+        with conn.begin():
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            for i, (operation, future) in enumerate(batch):
+                conn.exec_driver_sql(f"SAVEPOINT far_write_{i}")
+                try:
+                    result = operation(conn)
+                except Exception as e:
+                    logger.exception("Write operation failed, rolling it back")
+                    conn.exec_driver_sql(f"ROLLBACK TO SAVEPOINT far_write_{i}")
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                conn.exec_driver_sql(f"RELEASE SAVEPOINT far_write_{i}")
+    except Exception as e:
+        logger.exception("Write transaction of %d operations failed", len(batch))
+        for _, future in batch:
+            future.set_exception(e)
+        # Errors of operations are caught within their savepoint, so these
+        # come from the connection or the transaction itself
+        if isinstance(e, sqlalchemy.exc.OperationalError) or (
+            isinstance(e, sqlalchemy.exc.DBAPIError) and e.connection_invalidated
+        ):
+            raise
+        return
+    for hook in _commit_hooks:
+        try:
+            hook()
+        except Exception:
+            logger.exception("Commit hook %s failed", hook)
+    for future, result, exception in results:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+def _writer_loop():
+    logger = logging.getLogger(__name__).getChild("_writer_loop")
+    # Transactions are begun and committed explicitly by _run_batch
+    conn = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+    logger.info("Writer started, database journal mode is %s", journal_mode)
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < MAX_BATCH_OPERATIONS:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _run_batch(conn, batch)
+        except Exception:
+            # The connection itself failed, start over on a new one
+            logger.exception("Writer connection failed, reconnecting")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Writer connection failed"))
+            conn.invalidate()
+            conn = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def start_writer():
+    """
+    Starts the writer thread of this process, if not already started.
+    Threads do not survive a fork, so each worker process starts its own.
+    """
+    global _writer_pid
+    with _writer_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+        threading.Thread(target=_writer_loop, name="far_writer", daemon=True).start()
@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+"""
+gunicorn settings for the production entrypoint, run with:
+gunicorn --config gunicorn.conf.py wsgi:server
+"""
+
+import os
+
+
+bind = "0.0.0.0:8080"
+workers = int(os.environ.get("FAR_WORKERS", 4))
+threads = int(os.environ.get("FAR_THREADS", 2))
+# Import the app once in the master, so workers fork with every module loaded
+preload_app = True
+timeout = 120
+
+
+def post_fork(server, worker):
+    # Database connections opened in the master must not be shared by workers
+    from app import db
+    import far_core.engine
+
+    db.engine.dispose()
+    far_core.engine.read_only_engine.dispose()
@@ -3,26 +3,83 @@
 Entrypoint for the FaR app docker container, which runs a server on 8080
 """
 
+import functools
+import importlib
 import logging
 
 import dash.dependencies
+import dash.exceptions
 import dash_core_components as dcc
 import dash_html_components as html
 
-from app import app
-import apps.expenses
-import apps.forecast
-import apps.incomes
-import apps.input
-import apps.main
-import apps.report
+from app import app, server
+import apps.api
 import far_core.db
+import far_core.export
+import far_core.metrics
+import far_core.profiling
+import far_core.querywatch
+import far_core.version
 
 
-app.layout = html.Div([
-    dcc.Location(id='url', refresh=False),
-    html.Div(id='page-content')
-])
+# Pages by pathname, as (page module, arguments of the module's get_layout).
+# Page modules register their callbacks when imported, and defer importing
+# their heavy dependencies until a callback or layout first needs them.
+PAGES = {
+    "/": ("apps.main", ()),
+    "/expenses": ("apps.expenses", ()),
+    "/incomes": ("apps.incomes", ()),
+    "/input": ("apps.input", ()),
+    "/report/annual": ("apps.report", ("annual",)),
+    "/report/monthly": ("apps.report", ("monthly",)),
+    "/report/forecast": ("apps.forecast", ()),
+    "/report/projection": ("apps.projection", ()),
+}
+for page_module, _ in PAGES.values():
+    importlib.import_module(page_module)
+
+
+def get_app_layout():
+    """
+    Built on every page load, so that the ledger_version store starts at the
+    version the page is first rendered at. Callbacks of pages which take it
+    as an input re-run whenever the ledger changes.
+    """
+    refresh_seconds = server.config["FAR_LIVE_REFRESH_SECONDS"]
+    return html.Div([
+        dcc.Location(id='url', refresh=False),
+        dcc.Store(id='ledger_version', data=far_core.version.get_ledger_version()),
+        dcc.Interval(
+            id='ledger_version_interval',
+            interval=refresh_seconds * 1000,
+            disabled=not refresh_seconds,
+        ),
+        html.Div(id='page-content')
+    ])
+
+
+app.layout = get_app_layout
+
+
+@app.callback(
+    dash.dependencies.Output("ledger_version", "data"),
+    [dash.dependencies.Input("ledger_version_interval", "n_intervals")],
+    [dash.dependencies.State("ledger_version", "data")],
+    prevent_initial_call=True,
+)
+def poll_ledger_version(_n_intervals, version):
+    latest = far_core.version.get_ledger_version()
+    if latest == version:
+        # Leaves the callbacks of the page alone
+        raise dash.exceptions.PreventUpdate
+    return latest
+
+
+@functools.lru_cache(maxsize=None)
+def get_page_layout(pathname: str):
+    """Builds the layout of a page on its first request"""
+    page_module, layout_args = PAGES[pathname]
+    return importlib.import_module(page_module).get_layout(*layout_args)
 
 
 @app.callback(
@@ -30,20 +87,8 @@ app.layout = html.Div([
     [dash.dependencies.Input("url", "pathname")]
 )
 def display_page(pathname):
-    if pathname == "/":
-        return apps.main.LAYOUT
-    elif pathname == "/expenses":
-        return apps.expenses.LAYOUT
-    elif pathname == "/incomes":
-        return apps.incomes.LAYOUT
-    elif pathname == "/input":
-        return apps.input.LAYOUT
-    elif pathname == "/report/annual":
-        return apps.report.ANNUAL_LAYOUT
-    elif pathname == "/report/monthly":
-        return apps.report.MONTHLY_LAYOUT
-    elif pathname == "/report/forecast":
-        return apps.forecast.LAYOUT
+    if pathname in PAGES:
+        return get_page_layout(pathname)
     else:
         return [
             html.Div(
@@ -0,0 +1,15 @@
+#!/usr/bin/python3
+"""
+Production entrypoint for the FaR app docker container, which serves the
+flask server under gunicorn, see gunicorn.conf.py
+"""
+
+import logging
+
+import far_core.db
+import index
+
+
+logging.basicConfig(level=logging.INFO)
+far_core.db.init_tables()
+server = index.app.server